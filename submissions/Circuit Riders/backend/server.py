@@ -3,12 +3,25 @@
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from collections import defaultdict, deque
+import atexit
+import itertools
+import json
 import logging
+import logging.handlers
 import math
+import queue
+import struct
+import threading
+import time
+import uuid
+import zlib
 
 # Load environment variables
 load_dotenv()
@@ -16,15 +29,89 @@ load_dotenv()
 # Initialize Flask
 app = Flask(__name__)
 CORS(app)
+# Behind nginx (nginx.conf) remote_addr is the proxy - take the client address
+# from the X-Forwarded-For entries added by this many trusted proxies (0 = direct)
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 1))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 
-# Logging
-logging.basicConfig(level=logging.INFO)
+# Logging - records are queued and formatted/written by a background listener
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # 'json' (structured) or 'text'
+LOG_SAMPLE_RATIO = float(os.getenv("LOG_SAMPLE_RATIO", 0.01))  # share of per-sample logs kept
+LOG_SAMPLE_EVERY = max(1, round(1 / LOG_SAMPLE_RATIO)) if LOG_SAMPLE_RATIO > 0 else 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line - extra={"fields": {...}} adds structured fields"""
+    
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue the record untouched so message formatting happens on the
+    listener thread instead of the request thread
+    """
+    
+    def prepare(self, record):
+        return record
+
+
+def setup_logging():
+    """Route all logging through a queue drained by a background writer"""
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    root = logging.getLogger()
+    root.handlers[:] = [LazyQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Per-sample log counters - sampled logs cost one counter increment when skipped
+sample_log_counters = defaultdict(itertools.count)
+
+
+def should_log_sample(key):
+    """True for 1 in LOG_SAMPLE_EVERY calls per key (never when sampling is off)"""
+    return LOG_SAMPLE_EVERY > 0 and next(sample_log_counters[key]) % LOG_SAMPLE_EVERY == 0
+
+
+# Storage calls - the HTTP timeout matches the fan-out timeout, so a timed-out
+# call frees its worker instead of holding it for the client's 120s default
+STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", 8))
+STORAGE_CALL_TIMEOUT = float(os.getenv("STORAGE_CALL_TIMEOUT", 5.0))  # seconds
+BACKGROUND_MAX_WORKERS = int(os.getenv("BACKGROUND_MAX_WORKERS", 2))
+
 # Supabase Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_SERVICE_KEY,
+    options=ClientOptions(postgrest_client_timeout=STORAGE_CALL_TIMEOUT)
+)
 
 # Telegram Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -32,13 +119,411 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 # Settings
 HARSH_BRAKE_THRESHOLD = -8.0  # m/s²
 HARSH_ACCEL_THRESHOLD = 6.0   # m/s²
+HARSH_EVENT_COOLDOWN = float(os.getenv("HARSH_EVENT_COOLDOWN", 5))  # s between harsh events of one type per rider
 FALL_DETECTION_THRESHOLD = 15.0  # Combined sensor difference
+DEFAULT_RIDER_ID = os.getenv("RIDER_ID", "default")  # Used when a device sends no rider_id
+
+# Storage fan-out (independent Supabase reads run in parallel on request paths)
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+# Fire-and-forget background writes (score upserts, laps) get their own pool
+# so they can never starve request-path reads
+background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_MAX_WORKERS, thread_name_prefix="background")
+
+# Adaptive sampling - control block returned to the ESP32s on every ingest
+# send_interval_ms: time between uploads, sample_rate_hz: MPU6050 internal
+# sample rate, upload_mode: "raw" samples, on-device window "features" only,
+# or "both"
+SAMPLING_PROFILES = {
+    'STATIONARY': {"send_interval_ms": 30000, "sample_rate_hz": 10, "upload_mode": "features"},
+    'WALKING': {"send_interval_ms": 5000, "sample_rate_hz": 50, "upload_mode": "features"},
+    'SCOOTER': {"send_interval_ms": 2000, "sample_rate_hz": 100, "upload_mode": "both"},
+    'MOTORCYCLE': {"send_interval_ms": 1000, "sample_rate_hz": 200, "upload_mode": "both"},
+    'UNKNOWN': {"send_interval_ms": 2000, "sample_rate_hz": 50, "upload_mode": "both"},
+    'CRASH_PENDING': {"send_interval_ms": 500, "sample_rate_hz": 200, "upload_mode": "both"},
+}
+IMU_COLUMNS = ('accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z')  # compact FIFO batch row layout
+IMU_BATCH_KEYS = {'imu', 'rate_hz', 'accel_scale', 'gyro_scale', 'age_ms', 'features'}
+STEP_FREQUENCY_HZ = (1.0, 3.0)  # leg cadence that means the rider is on foot
+MAX_IMU_ROWS = 2000  # readings accepted in one compact batch
+MAX_SPOOL_UPLOADS = 100  # uploads accepted in one store-and-forward drain
+UPLOAD_DEDUPE_WINDOW = 512  # recent (boot, seq) upload ids remembered per device
+CLOCK_KEYS = ('clock_base_ms', 'clock_ms', 'clock_error_ms')  # device clock fields of an upload
+MAX_CLOCK_AHEAD_MS = 60000  # device clocks further ahead of ours are not trusted
+INGEST_CAPACITY = float(os.getenv("INGEST_CAPACITY", 50))  # ingest requests/s before backing off
+MAX_SEND_INTERVAL = 60000  # ms
+DEVICE_WINDOW_SAMPLES = 460  # firmware RING_SAMPLES (512) less headroom for upload jitter
+DEVICE_SAMPLE_RATES_HZ = (200, 100, 50, 25, 10)  # rates offered under load - each change restarts the device FIFO
+
+# Riding-behaviour score
+SPEED_LIMIT_KMH = float(os.getenv("SPEED_LIMIT_KMH", 60))
+TRIP_IDLE_TIMEOUT = 300  # seconds without riding before a trip is closed
+MAX_SAMPLE_GAP = 10  # seconds - longer gaps between fixes are not integrated
+SCORE_PERSIST_INTERVAL = 30  # seconds between score upserts per rider
+RIDING_ACTIVITIES = {'SCOOTER', 'MOTORCYCLE'}
+HARSH_EVENT_TYPES = {'HARSH_BRAKE', 'HARSH_ACCEL', 'ACCIDENT_ALERT'}
+
+# Crash pipeline - impact spike (provisional alert) then confirmation window
+CRASH_IMPACT_THRESHOLD = 35.0  # m/s² (~3.5g) on either sensor
+CRASH_CONFIRM_WINDOW = 10.0  # seconds to confirm or cancel after the impact
+CRASH_STILLNESS_SECONDS = 3.0  # post-impact stillness needed to confirm
+CRASH_STILL_ACCEL_TOLERANCE = 1.5  # m/s² around gravity
+CRASH_STILL_GYRO_MAX = 0.3  # rad/s
+CRASH_STILL_SPEED_MAX = 3.0  # km/h
+CRASH_ORIENTATION_CHANGE = 60.0  # degrees of torso rotation vs pre-impact
+CRASH_RESUME_SPEED = 15.0  # km/h - riding on at this speed cancels the alert
+GRAVITY = 9.81
+
+# Recent-events index - bounded ring buffers per (rider, type), newest first
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", 100))  # events kept per key
+EVENT_WARM_LIMIT = int(os.getenv("EVENT_WARM_LIMIT", 1000))  # rows loaded at startup
+event_index = defaultdict(lambda: deque(maxlen=EVENT_BUFFER_SIZE))
+event_index_lock = threading.Lock()
+event_index_state = {"complete": False}  # True when the warm-up saw every stored event
+
+# Lap timer - start/finish line and sector gates for test-track sessions
+EARTH_RADIUS_M = 6371000.0
+LAP_MIN_TIME = 10.0  # seconds - ignore start/finish re-crossings faster than this
+
+# State snapshots - in-process state saved to local disk for fast warm restarts
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state.snapshot"))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 10))  # seconds between snapshots
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", 3600))  # older snapshots are ignored
+SNAPSHOT_MAGIC = b"IGNS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct(">4sHdII")  # magic, version, saved_at, crc32, payload length
+
+# Priority alert lane - dedicated dispatcher threads and a send pool that
+# routine ingest (request threads, storage_executor) never touches. Each rider
+# is pinned to one dispatcher so their alerts stay in order
+ALERT_DISPATCHERS = int(os.getenv("ALERT_DISPATCHERS", 4))
+ALERT_RECIPIENTS_TTL = float(os.getenv("ALERT_RECIPIENTS_TTL", 60))  # seconds between recipient refreshes
+alert_queues = [queue.Queue() for _ in range(ALERT_DISPATCHERS)]
+alert_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="alert")
+alert_recipients = {"chat_ids": None, "loaded_at": 0.0}
+alert_recipients_lock = threading.Lock()
+
+# Alert delivery ledger - per-chat send results buffered in memory and
+# flushed in one batched upsert, instead of an UPDATE per alert
+TELEGRAM_SEND_TIMEOUT = 5.0  # seconds per attempt
+ALERT_SEND_ATTEMPTS = int(os.getenv("ALERT_SEND_ATTEMPTS", 2))  # first try + retries on 429/5xx/network errors
+DELIVERY_FLUSH_INTERVAL = float(os.getenv("DELIVERY_FLUSH_INTERVAL", 2))  # seconds between ledger flushes
+DELIVERY_LEDGER_MAX = 10000  # rows kept while the DB is unreachable
+delivery_ledger = []
+delivery_notified_ids = set()
+delivery_ledger_lock = threading.Lock()
+
+# Live tracking - /track messages are edited in place. Ingest only marks a
+# rider as changed; a loop renders each changed rider once per interval and
+# edits every follower's message with that one text
+TRACK_EDIT_INTERVAL = float(os.getenv("TRACK_EDIT_INTERVAL", 3))  # seconds between edits of a message
+TRACKERS_REFRESH_INTERVAL = float(os.getenv("TRACKERS_REFRESH_INTERVAL", 10))  # seconds between follower reloads
+TRACK_MAX_WORKERS = int(os.getenv("TRACK_MAX_WORKERS", 4))
+tracking_executor = ThreadPoolExecutor(max_workers=TRACK_MAX_WORKERS, thread_name_prefix="tracking")
+trackers = {"by_rider": {}, "loaded_at": 0.0}  # rider_id -> [(chat_id, message_id)]
+tracked_changes = set()  # riders with new data since the last push
+last_track_text = {}  # (chat_id, message_id) -> text currently shown
+tracking_lock = threading.Lock()
+
+# Telegram PIN linking - verification attempts allowed per client and window
+PIN_ATTEMPTS_PER_WINDOW = int(os.getenv("PIN_ATTEMPTS_PER_WINDOW", 5))
+PIN_ATTEMPT_WINDOW = 60.0  # seconds
+PIN_ATTEMPT_CLIENTS_MAX = 10000
+pin_attempts = defaultdict(deque)
+pin_attempts_lock = threading.Lock()
+
+# In-process rider state, keyed by rider_id (latest activity drives the sampling profile)
+rider_state = {}
+rider_state_lock = threading.Lock()
+ingest_meter = {"window_start": time.monotonic(), "count": 0, "rate": 0.0}
+ingest_meter_lock = threading.Lock()
 
 
 # =============================================
 # HELPER FUNCTIONS
 # =============================================
 
+def run_concurrently(*calls, timeout=STORAGE_CALL_TIMEOUT, executor=None):
+    """
+    Run independent storage calls in parallel on the shared executor
+    Returns results in call order - a call that fails or exceeds the
+    timeout yields None, so latency is the slowest call, not the sum
+    Only for reads and idempotent calls: a timed-out write may still commit
+    """
+    executor = executor or storage_executor
+    return wait_for_results([executor.submit(call) for call in calls], timeout)
+
+
+def wait_for_results(futures, timeout=STORAGE_CALL_TIMEOUT):
+    """Collect futures in order - failures and timeouts yield None"""
+    deadline = time.monotonic() + timeout
+    results = []
+    
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+        except FuturesTimeoutError:
+            future.cancel()
+            logger.warning(f"Storage call timed out after {timeout}s")
+            results.append(None)
+        except Exception as e:
+            logger.error(f"Storage call failed: {e}")
+            results.append(None)
+    
+    return results
+
+
+def first_row(result):
+    """Return the first row of a Supabase result, or {} if there is none"""
+    return result.data[0] if result and result.data else {}
+
+
+def record_ingest():
+    """Count an ingest request - the rate is recomputed once per second"""
+    with ingest_meter_lock:
+        ingest_meter["count"] += 1
+        elapsed = time.monotonic() - ingest_meter["window_start"]
+        if elapsed >= 1.0:
+            ingest_meter["rate"] = ingest_meter["count"] / elapsed
+            ingest_meter["window_start"] = time.monotonic()
+            ingest_meter["count"] = 0
+
+
+def get_sampling_control(activity):
+    """
+    Build the control block telling a device how fast to sample and send
+    Chosen from the rider's current activity, stretched when the server is loaded
+    """
+    control = dict(SAMPLING_PROFILES.get(activity, SAMPLING_PROFILES['UNKNOWN']))
+    
+    if activity == 'CRASH_PENDING':
+        # Never stretch the confirmation window's data
+        control["activity"] = activity
+        return control
+    
+    load = ingest_meter["rate"] / INGEST_CAPACITY if INGEST_CAPACITY > 0 else 0
+    if load > 1.0:
+        # Spread uploads out proportionally to the overload
+        scale = min(load, MAX_SEND_INTERVAL / control["send_interval_ms"])
+        control["send_interval_ms"] = int(control["send_interval_ms"] * scale)
+        if control["upload_mode"] != "features":
+            # Raw samples wait in the device's fixed ring until the next upload - drop
+            # to the fastest rate whose window still fits, then cap the interval at it
+            window_s = control["send_interval_ms"] / 1000.0
+            fitting = [rate for rate in DEVICE_SAMPLE_RATES_HZ
+                       if rate <= control["sample_rate_hz"] and rate * window_s <= DEVICE_WINDOW_SAMPLES]
+            control["sample_rate_hz"] = fitting[0] if fitting else DEVICE_SAMPLE_RATES_HZ[-1]
+            control["send_interval_ms"] = min(control["send_interval_ms"],
+                                              DEVICE_WINDOW_SAMPLES * 1000 // control["sample_rate_hz"])
+    
+    control["activity"] = activity
+    return control
+
+
+def allow_pin_attempt(client_key):
+    """Sliding-window limit on PIN verification attempts per client (brute-force guard)"""
+    now = time.monotonic()
+    with pin_attempts_lock:
+        attempts = pin_attempts[client_key]
+        while attempts and now - attempts[0] > PIN_ATTEMPT_WINDOW:
+            attempts.popleft()
+        if len(attempts) >= PIN_ATTEMPTS_PER_WINDOW:
+            return False
+        attempts.append(now)
+        
+        # Keep the map bounded - forget clients with no recent attempts
+        if len(pin_attempts) > PIN_ATTEMPT_CLIENTS_MAX:
+            for key in [key for key, times in pin_attempts.items() if now - times[-1] > PIN_ATTEMPT_WINDOW]:
+                del pin_attempts[key]
+        return True
+
+
+def get_rider_state(rider_id):
+    """Get (or create) the in-process state for a rider"""
+    with rider_state_lock:
+        return rider_state.setdefault(rider_id, {
+            "activity": "UNKNOWN",
+            "trip": None,
+            "day": None,
+            "last_sample_at": None,
+            "last_riding_at": None,
+            "last_persist_at": 0.0,
+            "last_leg": {},
+            "last_chest": {},
+            "crash": None,
+            "lap_session": None,
+            "uploads": {},
+            "harsh": {}
+        })
+
+
+def parse_timestamp(value):
+    """Convert an ISO timestamp to epoch seconds (falls back to now)"""
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def expand_imu_batch(data):
+    """
+    Expand a compact FIFO batch into readings:
+    {"rate_hz": 200, "age_ms": 12, "accel_scale": ..., "gyro_scale": ...,
+     "imu": [[ax, ay, az, gx, gy, gz], ...], ...fields shared by every reading}
+    Rows are raw sensor counts, oldest first; the last row is age_ms old
+    """
+    rows = data['imu']
+    try:
+        rate_hz = float(data['rate_hz'])
+        accel_scale = float(data['accel_scale'])
+        gyro_scale = float(data['gyro_scale'])
+        age_ms = float(data.get('age_ms', 0) or 0)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("imu batches need numeric rate_hz, accel_scale and gyro_scale")
+    if rate_hz <= 0:
+        raise ValueError("rate_hz must be positive")
+    if not isinstance(rows, list) or not rows or len(rows) > MAX_IMU_ROWS:
+        raise ValueError(f"imu must be a list of 1-{MAX_IMU_ROWS} rows")
+    
+    shared = {key: value for key, value in data.items() if key not in IMU_BATCH_KEYS}
+    period_ms = 1000.0 / rate_hz
+    samples = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, list) or len(row) != len(IMU_COLUMNS) or \
+                not all(isinstance(value, (int, float)) for value in row):
+            raise ValueError(f"every imu row must hold {len(IMU_COLUMNS)} numbers")
+        sample = dict(shared)
+        for column, value in zip(IMU_COLUMNS, row):
+            sample[column] = round(value * (accel_scale if column.startswith('accel') else gyro_scale), 3)
+        sample['age_ms'] = age_ms + (len(rows) - 1 - index) * period_ms
+        samples.append(sample)
+    # Window features summarise the whole batch - stored once, on the newest row.
+    # The rows carry their own accel_x, so the window extremes would double-count
+    if 'features' in data:
+        if not isinstance(data['features'], dict):
+            raise ValueError("features must be a JSON object")
+        samples[-1]['features'] = {key: value for key, value in data['features'].items()
+                                   if key not in ('accel_x_min', 'accel_x_max')}
+    return samples
+
+
+def device_clock(data):
+    """
+    When the device built an upload, by its NTP-synced clock: "clock_base_ms"
+    (epoch ms at its last sync) + "clock_ms" (ms since then), "clock_error_ms"
+    bounding the error. Removes the fields and returns (epoch seconds, error ms),
+    or (None, None) for an unsynced device or a clock too far ahead of ours
+    """
+    base, elapsed, error = (data.pop(key, None) for key in CLOCK_KEYS)
+    if base is None or elapsed is None:
+        return None, None
+    try:
+        built_at = (float(base) + float(elapsed)) / 1000.0
+        error = int(round(float(error))) if error is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("clock fields must be numbers")
+    if (built_at - time.time()) * 1000 > MAX_CLOCK_AHEAD_MS:
+        return None, None
+    return built_at, error
+
+
+def parse_samples(data, rider_id):
+    """
+    Split an ingest payload into readings - a single reading, {"samples": [...]}
+    or a compact FIFO batch {"imu": [...]}
+    Readings are stamped from the device clock when the upload has one,
+    otherwise from their age on arrival
+    Raises ValueError for an empty batch or a reading that is not an object
+    """
+    built_at, clock_error_ms = device_clock(data)
+    if 'imu' in data:
+        samples = expand_imu_batch(data)
+    else:
+        samples = data['samples'] if 'samples' in data else [data]
+    if not isinstance(samples, list) or not samples:
+        raise ValueError("samples must be a non-empty list")
+    if not all(isinstance(sample, dict) for sample in samples):
+        raise ValueError("every sample must be a JSON object")
+    if not all(isinstance(sample.get('features', {}), dict) for sample in samples):
+        raise ValueError("features must be a JSON object")
+    
+    now = datetime.now()
+    for sample in samples:
+        sample['rider_id'] = rider_id
+        # Batched readings carry their age relative to the upload
+        try:
+            age_ms = float(sample.pop('age_ms', 0) or 0)
+        except (TypeError, ValueError):
+            raise ValueError("age_ms must be a number")
+        # Add timestamp if not provided
+        if 'timestamp' not in sample:
+            if built_at is None:
+                sample['timestamp'] = (now - timedelta(milliseconds=age_ms)).isoformat()
+            else:
+                sample['timestamp'] = datetime.fromtimestamp(built_at - age_ms / 1000.0).isoformat()
+        # Same keys on every reading - a bulk insert needs them to match
+        sample['clock_error_ms'] = clock_error_ms
+    return samples
+
+
+def parse_upload(data, rider_id, device):
+    """
+    Readings from one upload, or from every upload in a store-and-forward drain
+    {"spool": [{"delay_ms": 5000, "upload": {...}}, ...]} (oldest first) - delay_ms
+    is how long the upload sat on the device, null when it was spooled before a reboot
+    Uploads already stored (same device "boot" and "seq") are skipped
+    Returns (readings, upload ids to remember once the readings are stored)
+    """
+    if 'spool' in data:
+        entries = data['spool']
+        if not isinstance(entries, list) or not entries or len(entries) > MAX_SPOOL_UPLOADS:
+            raise ValueError(f"spool must be a list of 1-{MAX_SPOOL_UPLOADS} uploads")
+        uploads = []
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get('upload'), dict):
+                raise ValueError("every spool entry needs an upload object")
+            try:
+                delay_ms = float(entry.get('delay_ms') or 0)
+            except (TypeError, ValueError):
+                raise ValueError("delay_ms must be a number")
+            upload = entry['upload']
+            # Ages were measured when the upload was built - without a device clock
+            # to date that, add the time it was queued
+            if upload.get('clock_base_ms') is None:
+                for reading in upload['samples'] if isinstance(upload.get('samples'), list) else [upload]:
+                    if isinstance(reading, dict):
+                        reading['age_ms'] = (reading.get('age_ms') or 0) + delay_ms
+            uploads.append(upload)
+    else:
+        uploads = [data]
+    
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        seen = set(state.setdefault("uploads", {}).get(device, []))
+    
+    samples, upload_ids = [], []
+    for upload in uploads:
+        seq, boot = upload.pop('seq', None), upload.pop('boot', None)
+        upload_id = f"{boot}:{seq}" if seq is not None else None
+        if upload_id in seen:
+            continue
+        samples.extend(parse_samples(upload, rider_id))
+        if upload_id:
+            seen.add(upload_id)
+            upload_ids.append(upload_id)
+    return samples, upload_ids
+
+
+def remember_uploads(rider_id, device, upload_ids):
+    """Record stored uploads so a replay of them is skipped"""
+    if not upload_ids:
+        return
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        recent = state.setdefault("uploads", {}).setdefault(device, [])
+        recent.extend(upload_ids)
+        del recent[:-UPLOAD_DEDUPE_WINDOW]
+
+
 def calculate_acceleration_magnitude(accel_x, accel_y, accel_z):
     """Calculate total acceleration magnitude"""
     return math.sqrt(accel_x**2 + accel_y**2 + accel_z**2)
@@ -86,12 +571,22 @@ def detect_activity_type(leg_data, chest_data):
             cos_angle = max(-1, min(1, cos_angle))  # Clamp to [-1, 1]
             angle_diff = math.degrees(math.acos(cos_angle))
         
-        logger.info(f"Activity Detection - Speed: {speed:.2f} km/h, Gyro: {leg_gyro_magnitude:.3f}, Angle: {angle_diff:.1f}°")
+        if should_log_sample("activity_detection"):
+            logger.info(
+                "Activity Detection - Speed: %.2f km/h, Gyro: %.3f, Angle: %.1f°", speed, leg_gyro_magnitude, angle_diff,
+                extra={"fields": {"speed": speed, "leg_gyro": leg_gyro_magnitude, "angle": angle_diff}}
+            )
         
         # Detection logic (prioritize speed ranges)
         
+        # Step cadence from the leg's window features - GPS speed lags when
+        # the rider sets off on foot
+        step_hz = (leg_data.get('features') or {}).get('step_hz') or 0
+        
         # Stationary: Very low speed
         if speed < 1:
+            if STEP_FREQUENCY_HZ[0] <= step_hz <= STEP_FREQUENCY_HZ[1]:
+                return 'WALKING'
             return 'STATIONARY'
         
         # Walking: 1-15 km/h (walking speed range)
@@ -123,6 +618,16 @@ def detect_activity_type(leg_data, chest_data):
         return 'UNKNOWN'
 
 
+def forward_accel_range(leg_data):
+    """
+    Lowest and highest forward acceleration a leg reading stands for - a
+    features-only upload summarises a whole window, so its extremes count
+    """
+    accel_x = leg_data.get('accel_x', 0) or 0
+    features = leg_data.get('features') or {}
+    return features.get('accel_x_min', accel_x), features.get('accel_x_max', accel_x)
+
+
 def check_harsh_brake(accel_x):
     """Check if harsh braking occurred"""
     return accel_x < HARSH_BRAKE_THRESHOLD
@@ -133,6 +638,31 @@ def check_harsh_acceleration(accel_x):
     return accel_x > HARSH_ACCEL_THRESHOLD
 
 
+def harsh_event_onsets(rider_id, samples):
+    """
+    Leg readings that start a harsh braking / acceleration excursion - one
+    event per continuous run past the threshold (a run can span uploads), and
+    none within HARSH_EVENT_COOLDOWN of the rider's last event of that type
+    Returns [(event_type, reading, forward acceleration)]
+    """
+    state = get_rider_state(rider_id)
+    onsets = []
+    with rider_state_lock:
+        harsh = state.setdefault("harsh", {})
+        for sample in samples:
+            accel_low, accel_high = forward_accel_range(sample)
+            sample_at = parse_timestamp(sample.get('timestamp'))
+            for event_type, over, accel in (("HARSH_BRAKE", check_harsh_brake(accel_low), accel_low),
+                                            ("HARSH_ACCEL", check_harsh_acceleration(accel_high), accel_high)):
+                run = harsh.setdefault(event_type, {"active": False, "last_event_at": None})
+                if over and not run["active"] and (run["last_event_at"] is None or
+                                                   sample_at - run["last_event_at"] >= HARSH_EVENT_COOLDOWN):
+                    run["last_event_at"] = sample_at
+                    onsets.append((event_type, sample, accel))
+                run["active"] = over
+    return onsets
+
+
 def check_fall_or_accident(leg_data, chest_data):
     """
     Detect potential fall or accident
@@ -161,10 +691,14 @@ def check_fall_or_accident(leg_data, chest_data):
         return False, 0
 
 
-def create_event(event_type, severity, leg_data, chest_data, description=""):
-    """Create event in database and trigger Telegram alert if needed"""
+def create_event(event_type, severity, leg_data, chest_data, description="", priority=False):
+    """
+    Create event in database and trigger Telegram alert if needed
+    priority=True (crash pipeline) always notifies first, using the alert send pool
+    """
     try:
         event_data = {
+            "rider_id": chest_data.get('rider_id') or leg_data.get('rider_id') or DEFAULT_RIDER_ID,
             "event_type": event_type,
             "severity": severity,
             "latitude": chest_data.get('latitude'),  # GPS is on chest now
@@ -179,10 +713,31 @@ def create_event(event_type, severity, leg_data, chest_data, description=""):
             "description": description
         }
         
+        if priority:
+            # Crash alerts go out before the event is stored - the rider's
+            # contacts never wait on the database
+            deliveries = send_telegram(get_alert_recipients(), format_alert_message(event_type, event_data),
+                                       executor=alert_executor)
+            if any(delivery["status"] == 'sent' for delivery in deliveries):
+                event_data["telegram_notified"] = True
+                event_data["telegram_sent_at"] = datetime.now().isoformat()
+        
         result = supabase.table("events").insert(event_data).execute()
         
+        if result.data:
+            # Feed the inserted row (with its id and timestamp) to the recent-events index
+            event_data = result.data[0]
+            index_event(event_data)
+        
+        if priority:
+            # Linked to the stored event id - telegram_notified is already set on the row
+            record_deliveries(event_data.get('id'), deliveries, mark_notified=False)
+        
+        if event_type in HARSH_EVENT_TYPES:
+            record_harsh_event(event_data["rider_id"])
+        
         # Trigger Telegram notification for critical events
-        if severity in ['HIGH', 'CRITICAL']:
+        if not priority and severity in ['HIGH', 'CRITICAL']:
             notify_telegram(event_type, event_data)
         
         return result
@@ -192,57 +747,1021 @@ def create_event(event_type, severity, leg_data, chest_data, description=""):
         return None
 
 
-def notify_telegram(event_type, event_data):
-    """Send notification to linked Telegram users"""
+def load_alert_recipients():
+    """Reload the chat ids of linked users with notifications enabled"""
     try:
-        import requests
-        
-        # Get all linked users with notifications enabled
         users = supabase.table("telegram_users")\
             .select("telegram_chat_id")\
             .eq("is_linked", True)\
             .eq("notifications_enabled", True)\
             .execute()
+        chat_ids = [user['telegram_chat_id'] for user in users.data or []]
+    except Exception as e:
+        logger.error(f"Error loading alert recipients: {e}")
+        return None
+    
+    with alert_recipients_lock:
+        alert_recipients.update(chat_ids=chat_ids, loaded_at=time.monotonic())
+    return chat_ids
+
+
+def get_alert_recipients():
+    """
+    Cached recipient chat ids - a stale list is still used while it is
+    refreshed in the background, only a cold cache loads inline
+    """
+    with alert_recipients_lock:
+        chat_ids = alert_recipients["chat_ids"]
+        stale = time.monotonic() - alert_recipients["loaded_at"] > ALERT_RECIPIENTS_TTL
+        if chat_ids is not None and stale:
+            alert_recipients["loaded_at"] = time.monotonic()  # one refresh at a time
+            background_executor.submit(load_alert_recipients)
+    
+    if chat_ids is None:
+        chat_ids = load_alert_recipients()
+    return chat_ids or []
+
+
+def format_alert_message(event_type, event_data):
+    """Markdown Telegram message for an event"""
+    message = f"🚨 *{event_type.replace('_', ' ')}*\n\n"
+    message += f"⚠️ Severity: {event_data['severity']}\n"
+    
+    if event_data.get('latitude') and event_data.get('longitude'):
+        lat = event_data['latitude']
+        lon = event_data['longitude']
+        message += f"📍 Location: [{lat:.6f}, {lon:.6f}](https://maps.google.com/?q={lat},{lon})\n"
+    
+    if event_data.get('speed'):
+        message += f"🏍️ Speed: {event_data['speed']:.1f} km/h\n"
+    
+    if event_data.get('description'):
+        message += f"\n{event_data['description']}"
+    
+    message += f"\n\n⏰ Time: {datetime.now().strftime('%H:%M:%S')}"
+    return message
+
+
+def send_telegram(chat_ids, message, executor=None):
+    """
+    Send a message to every chat in parallel, retrying rate-limited and failed sends
+    Returns one delivery record per chat (status, HTTP status, latency, attempts)
+    """
+    import requests
+    
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    
+    def send_to(chat_id):
+        payload = {
+            "chat_id": chat_id,
+            "text": message,
+            "parse_mode": "Markdown"
+        }
         
-        if not users.data:
+        def send():
+            started = time.monotonic()
+            http_status = None
+            for attempt in range(1, ALERT_SEND_ATTEMPTS + 1):
+                try:
+                    http_status = requests.post(url, json=payload, timeout=TELEGRAM_SEND_TIMEOUT).status_code
+                except requests.RequestException:
+                    http_status = None
+                    continue
+                if http_status < 500 and http_status != 429:
+                    break  # delivered, or a client error that a retry will not fix
+            return delivery_record(chat_id, http_status, started, attempt)
+        
+        return send
+    
+    results = run_concurrently(*[send_to(chat_id) for chat_id in chat_ids], executor=executor,
+                               timeout=TELEGRAM_SEND_TIMEOUT * ALERT_SEND_ATTEMPTS + 1)
+    # A send still running at the deadline is recorded as failed
+    return [result or delivery_record(chat_id, None, None, ALERT_SEND_ATTEMPTS)
+            for chat_id, result in zip(chat_ids, results)]
+
+
+def delivery_record(chat_id, http_status, started, attempts):
+    return {
+        "telegram_chat_id": chat_id,
+        "status": 'sent' if http_status is not None and 200 <= http_status < 300 else 'failed',
+        "http_status": http_status,
+        "latency_ms": round((time.monotonic() - started) * 1000) if started is not None else None,
+        "attempts": attempts,
+        "sent_at": datetime.now().isoformat()
+    }
+
+
+def notify_telegram(event_type, event_data, executor=None):
+    """Send notification to linked Telegram users"""
+    try:
+        chat_ids = get_alert_recipients()
+        if not chat_ids:
             return
         
-        # Prepare message
-        message = f"🚨 *{event_type.replace('_', ' ')}*\n\n"
-        message += f"⚠️ Severity: {event_data['severity']}\n"
+        deliveries = send_telegram(chat_ids, format_alert_message(event_type, event_data), executor=executor)
+        record_deliveries(event_data.get('id'), deliveries)
         
-        if event_data.get('latitude') and event_data.get('longitude'):
-            lat = event_data['latitude']
-            lon = event_data['longitude']
-            message += f"📍 Location: [{lat:.6f}, {lon:.6f}](https://maps.google.com/?q={lat},{lon})\n"
+    except Exception as e:
+        logger.error(f"Telegram notification error: {e}")
+
+
+# =============================================
+# ALERT DELIVERY LEDGER
+# =============================================
+
+def record_deliveries(event_id, deliveries, mark_notified=True):
+    """Buffer per-chat delivery results for the next batched flush"""
+    if event_id is None or not deliveries:
+        return
+    
+    with delivery_ledger_lock:
+        delivery_ledger.extend(dict(delivery, event_id=event_id) for delivery in deliveries)
+        del delivery_ledger[:-DELIVERY_LEDGER_MAX]
+        if mark_notified and any(delivery["status"] == 'sent' for delivery in deliveries):
+            delivery_notified_ids.add(event_id)
+
+
+def flush_delivery_ledger():
+    """Write buffered deliveries in one upsert and mark their events notified in one update"""
+    with delivery_ledger_lock:
+        rows = list(delivery_ledger)
+        notified_ids = sorted(delivery_notified_ids)
+        delivery_ledger.clear()
+        delivery_notified_ids.clear()
+    
+    if not rows and not notified_ids:
+        return
+    
+    try:
+        if rows:
+            supabase.table("alert_deliveries")\
+                .upsert(rows, on_conflict="event_id,telegram_chat_id")\
+                .execute()
+        if notified_ids:
+            supabase.table("events")\
+                .update({"telegram_notified": True, "telegram_sent_at": datetime.now().isoformat()})\
+                .in_("id", notified_ids)\
+                .execute()
+    except Exception as e:
+        logger.error(f"Error flushing delivery ledger: {e}")
+        # Keep the batch for the next flush (upserts make the retry idempotent)
+        with delivery_ledger_lock:
+            delivery_ledger[:0] = rows
+            del delivery_ledger[:-DELIVERY_LEDGER_MAX]
+            delivery_notified_ids.update(notified_ids)
+
+
+def delivery_flush_loop():
+    while True:
+        time.sleep(DELIVERY_FLUSH_INTERVAL)
+        flush_delivery_ledger()
+
+
+# =============================================
+# RECENT-EVENTS INDEX
+# =============================================
+
+def event_index_keys(event):
+    """Index keys an event belongs to - None means 'any'"""
+    rider_id = event.get('rider_id') or DEFAULT_RIDER_ID
+    event_type = event.get('event_type')
+    return [(None, None), (None, event_type), (rider_id, None), (rider_id, event_type)]
+
+
+def index_event(event):
+    """Add a newly created event to the front of its ring buffers"""
+    with event_index_lock:
+        for key in event_index_keys(event):
+            event_index[key].appendleft(event)
+
+
+def warm_event_index():
+    """Load the newest events into the index at startup (one bounded query)"""
+    try:
+        result = supabase.table("events")\
+            .select("*")\
+            .order("timestamp", desc=True)\
+            .limit(EVENT_WARM_LIMIT)\
+            .execute()
+        rows = result.data or []
         
-        if event_data.get('speed'):
-            message += f"🏍️ Speed: {event_data['speed']:.1f} km/h\n"
+        with event_index_lock:
+            # Oldest first so appendleft leaves the newest at the front
+            for event in reversed(rows):
+                for key in event_index_keys(event):
+                    event_index[key].appendleft(event)
+            event_index_state["complete"] = len(rows) < EVENT_WARM_LIMIT
         
-        if event_data.get('description'):
-            message += f"\n{event_data['description']}"
+        logger.info(f"Recent-events index warmed with {len(rows)} events")
+    except Exception as e:
+        logger.error(f"Error warming events index: {e}")
+
+
+def get_cached_events(rider_id=None, event_type=None, limit=10, offset=0):
+    """
+    Serve a page of recent events from the index
+    Returns None when the page reaches deeper than the buffer holds - the
+    caller then falls back to the database
+    """
+    with event_index_lock:
+        buffer = event_index.get((rider_id, event_type))
+        size = len(buffer) if buffer else 0
         
-        message += f"\n\n⏰ Time: {datetime.now().strftime('%H:%M:%S')}"
+        # A buffer that never filled up holds every event for its key
+        is_complete = event_index_state["complete"] and size < EVENT_BUFFER_SIZE
+        if offset + limit > size and not is_complete:
+            return None
+        
+        return list(itertools.islice(buffer, offset, offset + limit)) if buffer else []
+
+
+# =============================================
+# RIDING-BEHAVIOUR SCORE
+# =============================================
+
+class RideScore:
+    """
+    Incremental riding-behaviour score for one trip or one day
+    Every update is O(1) - speed mean/variance use Welford's algorithm and
+    distance integrates speed over the time between fixes
+    """
+    
+    def __init__(self, period, period_key):
+        self.period = period  # 'trip' or 'day'
+        self.period_key = period_key
+        self.started_at = datetime.now().isoformat()
+        self.distance_km = 0.0
+        self.harsh_events = 0
+        self.samples = 0
+        self.mean_speed = 0.0
+        self.speed_m2 = 0.0
+        self.riding_time = 0.0
+        self.over_limit_time = 0.0
+    
+    def add_sample(self, speed, dt):
+        """Add one speed reading (km/h) taken dt seconds after the previous one"""
+        self.samples += 1
+        delta = speed - self.mean_speed
+        self.mean_speed += delta / self.samples
+        self.speed_m2 += delta * (speed - self.mean_speed)
+        
+        if dt > 0:
+            self.distance_km += speed * dt / 3600.0
+            self.riding_time += dt
+            if speed > SPEED_LIMIT_KMH:
+                self.over_limit_time += dt
+    
+    def add_harsh_event(self):
+        self.harsh_events += 1
+    
+    @property
+    def speed_variance(self):
+        return self.speed_m2 / (self.samples - 1) if self.samples > 1 else 0.0
+    
+    @property
+    def harsh_per_100km(self):
+        # Floor the distance at 1 km so a single event on a short hop doesn't explode
+        return self.harsh_events * 100.0 / max(self.distance_km, 1.0)
+    
+    @property
+    def over_limit_fraction(self):
+        return self.over_limit_time / self.riding_time if self.riding_time > 0 else 0.0
+    
+    @property
+    def score(self):
+        """0-100, higher is safer"""
+        harsh_penalty = min(50.0, self.harsh_per_100km * 2.0)
+        variance_penalty = min(20.0, math.sqrt(self.speed_variance) * 0.5)
+        speeding_penalty = self.over_limit_fraction * 30.0
+        return max(0.0, 100.0 - harsh_penalty - variance_penalty - speeding_penalty)
+    
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a score from the raw attributes saved in a snapshot"""
+        score = cls.__new__(cls)
+        score.__dict__.update(state)
+        return score
+    
+    def to_dict(self):
+        return {
+            "period": self.period,
+            "period_key": self.period_key,
+            "started_at": self.started_at,
+            "score": round(self.score, 1),
+            "distance_km": round(self.distance_km, 3),
+            "harsh_events": self.harsh_events,
+            "harsh_per_100km": round(self.harsh_per_100km, 2),
+            "mean_speed": round(self.mean_speed, 2),
+            "speed_variance": round(self.speed_variance, 2),
+            "over_limit_fraction": round(self.over_limit_fraction, 3),
+            "riding_time_s": round(self.riding_time, 1)
+        }
+
+
+def update_ride_score(rider_id, samples, activity):
+    """Feed chest samples into the rider's open trip and today's score"""
+    state = get_rider_state(rider_id)
+    
+    with rider_state_lock:
+        for sample in samples:
+            sample_at = parse_timestamp(sample.get('timestamp'))
+            speed = float(sample.get('speed', 0) or 0)
+            
+            if activity in RIDING_ACTIVITIES:
+                if state["trip"] is None:
+                    state["trip"] = RideScore('trip', f"{rider_id}-{int(sample_at)}")
+                state["last_riding_at"] = sample_at
+            elif state["trip"] is not None and sample_at - (state["last_riding_at"] or sample_at) > TRIP_IDLE_TIMEOUT:
+                close_trip(rider_id, state)
+            
+            today = datetime.fromtimestamp(sample_at).date().isoformat()
+            if state["day"] is None or state["day"].period_key != today:
+                if state["day"] is not None:
+                    persist_scores(rider_id, [state["day"]])
+                state["day"] = RideScore('day', today)
+            
+            if state["trip"] is not None:
+                last = state["last_sample_at"]
+                dt = sample_at - last if last is not None and 0 < sample_at - last <= MAX_SAMPLE_GAP else 0.0
+                state["trip"].add_sample(speed, dt)
+                state["day"].add_sample(speed, dt)
+            
+            state["last_sample_at"] = sample_at
         
-        # Send to all users
-        for user in users.data:
-            chat_id = user['telegram_chat_id']
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-            payload = {
-                "chat_id": chat_id,
-                "text": message,
-                "parse_mode": "Markdown"
+        if time.monotonic() - state["last_persist_at"] >= SCORE_PERSIST_INTERVAL:
+            state["last_persist_at"] = time.monotonic()
+            persist_scores(rider_id, [score for score in (state["trip"], state["day"]) if score])
+
+
+def close_trip(rider_id, state):
+    """Persist and close the rider's open trip (caller holds rider_state_lock)"""
+    persist_scores(rider_id, [state["trip"]])
+    state["trip"] = None
+
+
+def record_harsh_event(rider_id):
+    """Count a harsh event against the rider's open trip and today's score"""
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        for score in (state["trip"], state["day"]):
+            if score is not None:
+                score.add_harsh_event()
+
+
+def persist_scores(rider_id, scores):
+    """Upsert score snapshots in the background (never blocks ingest)"""
+    rows = [dict(score.to_dict(), rider_id=rider_id, updated_at=datetime.now().isoformat()) for score in scores]
+    
+    def upsert():
+        try:
+            supabase.table("rider_scores")\
+                .upsert(rows, on_conflict="rider_id,period,period_key")\
+                .execute()
+        except Exception as e:
+            logger.error(f"Error persisting scores: {e}")
+    
+    background_executor.submit(upsert)
+
+
+def get_current_scores(rider_id):
+    """Current trip and day scores for a rider, straight from memory"""
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        return {
+            "trip": state["trip"].to_dict() if state["trip"] else None,
+            "day": state["day"].to_dict() if state["day"] else None
+        }
+
+
+# =============================================
+# CRASH PIPELINE
+# =============================================
+
+def alert_dispatcher(alert_queue):
+    """Drain one priority alert queue in order (provisional before confirmed/cancelled)"""
+    while True:
+        task = alert_queue.get()
+        try:
+            task()
+        except Exception as e:
+            logger.error(f"Priority alert error: {e}")
+
+
+def dispatch_alert(event_type, severity, leg_data, chest_data, description):
+    """Queue a crash alert on the rider's priority dispatcher - returns immediately"""
+    rider_id = chest_data.get('rider_id') or leg_data.get('rider_id') or DEFAULT_RIDER_ID
+    alert_queue = alert_queues[zlib.crc32(rider_id.encode()) % len(alert_queues)]
+    alert_queue.put(lambda: create_event(event_type, severity, leg_data, chest_data, description, priority=True))
+
+
+def vector_angle(a, b):
+    """Angle in degrees between two 3-axis vectors"""
+    mag_a = math.sqrt(sum(x**2 for x in a))
+    mag_b = math.sqrt(sum(x**2 for x in b))
+    if mag_a < 0.1 or mag_b < 0.1:
+        return 0.0
+    cos_angle = sum(x * y for x, y in zip(a, b)) / (mag_a * mag_b)
+    return math.degrees(math.acos(max(-1, min(1, cos_angle))))
+
+
+def accel_vector(data):
+    return [data.get('accel_x', 0) or 0, data.get('accel_y', 0) or 0, data.get('accel_z', 0) or 0]
+
+
+def open_crash_candidate(rider_id, state, sample_at, leg_data, chest_data, reason):
+    """
+    Stage 1 - impact spike: raise a provisional alert straight away and
+    start the confirmation window (caller holds rider_state_lock)
+    """
+    pre_impact = state["last_chest"] or chest_data
+    state["crash"] = {
+        "impact_at": sample_at,
+        "pre_impact_accel": accel_vector(pre_impact),
+        "still_since": None,
+        "samples": 0,
+        "leg_data": leg_data,
+        "chest_data": chest_data
+    }
+    state["activity_before_crash"] = state["activity"]
+    state["activity"] = 'CRASH_PENDING'
+    
+    dispatch_alert(
+        "FALL_DETECTED",
+        "HIGH",
+        leg_data,
+        chest_data,
+        f"Possible crash: {reason}. Confirming (up to {CRASH_CONFIRM_WINDOW:.0f}s)..."
+    )
+    
+    timer = threading.Timer(CRASH_CONFIRM_WINDOW, finalize_crash_candidate, args=(rider_id, state["crash"]))
+    timer.daemon = True
+    timer.start()
+
+
+def resolve_crash_candidate(state, confirmed, reason):
+    """Send the confirmed/cancelled status on the priority lane (caller holds rider_state_lock)"""
+    crash = state["crash"]
+    state["crash"] = None
+    state["activity"] = state.pop("activity_before_crash", 'UNKNOWN')
+    
+    if confirmed:
+        dispatch_alert("ACCIDENT_ALERT", "CRITICAL", crash["leg_data"], crash["chest_data"],
+                       f"Crash CONFIRMED: {reason}")
+    else:
+        dispatch_alert("CRASH_CANCELLED", "LOW", crash["leg_data"], crash["chest_data"],
+                       f"Earlier crash alert cancelled: {reason}")
+
+
+def update_crash_candidate(state, sample_at, chest_data):
+    """Stage 2 - confirmation: look for stillness or an orientation change (caller holds rider_state_lock)"""
+    crash = state["crash"]
+    crash["samples"] += 1
+    crash["chest_data"] = chest_data
+    
+    accel = accel_vector(chest_data)
+    accel_mag = math.sqrt(sum(x**2 for x in accel))
+    gyro_mag = math.sqrt(sum((chest_data.get(axis, 0) or 0)**2 for axis in ('gyro_x', 'gyro_y', 'gyro_z')))
+    speed = float(chest_data.get('speed', 0) or 0)
+    
+    if speed >= CRASH_RESUME_SPEED:
+        resolve_crash_candidate(state, False, f"rider moving again at {speed:.1f} km/h")
+        return
+    
+    is_still = (abs(accel_mag - GRAVITY) < CRASH_STILL_ACCEL_TOLERANCE and
+                gyro_mag < CRASH_STILL_GYRO_MAX and
+                speed < CRASH_STILL_SPEED_MAX)
+    
+    if not is_still:
+        crash["still_since"] = None
+        return
+    
+    rotation = vector_angle(crash["pre_impact_accel"], accel)
+    if rotation >= CRASH_ORIENTATION_CHANGE:
+        resolve_crash_candidate(state, True, f"rider orientation changed by {rotation:.0f}°")
+        return
+    
+    if crash["still_since"] is None:
+        crash["still_since"] = sample_at
+    elif sample_at - crash["still_since"] >= CRASH_STILLNESS_SECONDS:
+        resolve_crash_candidate(state, True, f"no movement for {sample_at - crash['still_since']:.0f}s after impact")
+
+
+def finalize_crash_candidate(rider_id, crash):
+    """Confirmation window expired - silence is treated as a crash, motion as a false alarm"""
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        if state["crash"] is not crash:
+            return  # already resolved
+        if crash["samples"] == 0:
+            resolve_crash_candidate(state, True, "no sensor data since impact")
+        else:
+            resolve_crash_candidate(state, False, "rider recovered within the confirmation window")
+
+
+def process_chest_crash_samples(rider_id, samples):
+    """Run chest samples through both crash pipeline stages"""
+    state = get_rider_state(rider_id)
+    
+    with rider_state_lock:
+        leg_data = state["last_leg"]
+        for sample in samples:
+            sample_at = parse_timestamp(sample.get('timestamp'))
+            
+            if state["crash"] is not None:
+                if sample_at > state["crash"]["impact_at"]:
+                    update_crash_candidate(state, sample_at, sample)
+            else:
+                magnitude = calculate_acceleration_magnitude(*accel_vector(sample))
+                is_fall, difference = check_fall_or_accident(leg_data, sample) if leg_data else (False, 0)
+                
+                if magnitude > CRASH_IMPACT_THRESHOLD:
+                    open_crash_candidate(rider_id, state, sample_at, leg_data or {}, sample,
+                                         f"chest impact {magnitude:.1f} m/s²")
+                elif is_fall:
+                    open_crash_candidate(rider_id, state, sample_at, leg_data, sample,
+                                         f"leg/chest sensor difference {difference:.1f}")
+            
+            state["last_chest"] = sample
+
+
+def process_leg_crash_samples(rider_id, samples):
+    """Stage 1 on the leg sensor - an impact spike here also opens a candidate"""
+    state = get_rider_state(rider_id)
+    
+    with rider_state_lock:
+        state["last_leg"] = samples[-1]
+        if state["crash"] is not None:
+            return
+        for sample in samples:
+            magnitude = calculate_acceleration_magnitude(*accel_vector(sample))
+            if magnitude > CRASH_IMPACT_THRESHOLD:
+                open_crash_candidate(rider_id, state, parse_timestamp(sample.get('timestamp')),
+                                     sample, state["last_chest"], f"leg impact {magnitude:.1f} m/s²")
+                return
+
+
+# =============================================
+# LAP TIMER
+# =============================================
+
+def to_local_xy(origin, point):
+    """Project [lat, lon] to metres on a plane tangent at origin (fine at track scale)"""
+    lat0 = math.radians(origin[0])
+    x = math.radians(point[1] - origin[1]) * math.cos(lat0) * EARTH_RADIUS_M
+    y = math.radians(point[0] - origin[0]) * EARTH_RADIUS_M
+    return x, y
+
+
+def segment_crossing(p1, p2, g1, g2):
+    """
+    Fraction t along p1→p2 where it crosses gate g1-g2, or None
+    All points are local (x, y) in metres
+    """
+    dx, dy = p2[0] - p1[0], p2[1] - p1[1]
+    gx, gy = g2[0] - g1[0], g2[1] - g1[1]
+    denom = dx * gy - dy * gx
+    if abs(denom) < 1e-9:
+        return None  # parallel
+    
+    ox, oy = g1[0] - p1[0], g1[1] - p1[1]
+    t = (ox * gy - oy * gx) / denom
+    u = (ox * dy - oy * dx) / denom
+    return t if 0 <= t <= 1 and 0 <= u <= 1 else None
+
+
+def start_lap_session(rider_id, start_finish, sectors):
+    """Arm the lap timer for a rider - gates are [[lat, lon], [lat, lon]] lines"""
+    origin = start_finish[0]
+    session = {
+        "session_id": str(uuid.uuid4()),
+        "created_at": datetime.now().isoformat(),
+        "start_finish": start_finish,
+        "sectors": sectors,
+        # Gates in crossing order, projected once: sector gates then the start/finish line
+        "gates": [[to_local_xy(origin, g[0]), to_local_xy(origin, g[1])] for g in sectors + [start_finish]],
+        "next_gate": len(sectors),  # waiting for the first start/finish crossing
+        "last_fix": None,  # [x, y, epoch seconds, speed]
+        "lap": None,
+        "laps": []
+    }
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        state["lap_session"] = session
+    return session
+
+
+def update_lap_timer(rider_id, samples):
+    """
+    Feed chest GPS fixes to the rider's lap session - O(1) per fix: only
+    the next expected gate is tested against the segment from the previous fix
+    """
+    state = get_rider_state(rider_id)
+    completed = []
+    
+    with rider_state_lock:
+        session = state.get("lap_session")
+        if session is None:
+            return
+        
+        for sample in samples:
+            if sample.get('latitude') is None or sample.get('longitude') is None:
+                continue
+            
+            x, y = to_local_xy(session["start_finish"][0], [sample['latitude'], sample['longitude']])
+            fix_at = parse_timestamp(sample.get('timestamp'))
+            speed = float(sample.get('speed', 0) or 0)
+            last = session["last_fix"]
+            if last is not None and fix_at <= last[2]:
+                continue  # stale or out-of-order fix - keep the newer one as the segment start
+            session["last_fix"] = [x, y, fix_at, speed]
+            if last is None:
+                continue
+            
+            lap = session["lap"]
+            dt = fix_at - last[2]
+            if lap is not None:
+                lap["max_speed"] = max(lap["max_speed"], speed)
+                lap["speed_time"] += speed * dt
+                lap["time"] += dt
+            
+            gate = session["gates"][session["next_gate"]]
+            t = segment_crossing((last[0], last[1]), (x, y), gate[0], gate[1])
+            if t is None:
+                continue
+            
+            # Interpolate the crossing time between the two fixes
+            crossed_at = last[2] + t * dt
+            is_start_finish = session["next_gate"] == len(session["gates"]) - 1
+            
+            if not is_start_finish:
+                lap["splits"].append(round(crossed_at - lap["last_gate_at"], 3))
+                lap["last_gate_at"] = crossed_at
+                session["next_gate"] += 1
+                continue
+            
+            if lap is not None:
+                if crossed_at - lap["started_at"] < LAP_MIN_TIME:
+                    continue
+                lap["splits"].append(round(crossed_at - lap["last_gate_at"], 3))
+                result = {
+                    "session_id": session["session_id"],
+                    "rider_id": rider_id,
+                    "lap_number": len(session["laps"]) + 1,
+                    "lap_time_s": round(crossed_at - lap["started_at"], 3),
+                    "sector_splits": lap["splits"],
+                    "max_speed": round(lap["max_speed"], 1),
+                    "avg_speed": round(lap["speed_time"] / lap["time"], 1) if lap["time"] > 0 else 0.0,
+                    "started_at": datetime.fromtimestamp(lap["started_at"]).isoformat(),
+                    "completed_at": datetime.fromtimestamp(crossed_at).isoformat()
+                }
+                session["laps"].append(result)
+                completed.append(result)
+            
+            session["lap"] = {
+                "started_at": crossed_at,
+                "last_gate_at": crossed_at,
+                "splits": [],
+                "max_speed": speed,
+                "speed_time": 0.0,
+                "time": 0.0
             }
-            requests.post(url, json=payload, timeout=5)
+            session["next_gate"] = 0
+    
+    if completed:
+        background_executor.submit(store_laps, completed)
+
+
+def store_laps(laps):
+    try:
+        supabase.table("laps").insert(laps).execute()
+    except Exception as e:
+        logger.error(f"Error storing laps: {e}")
+
+
+def parse_gate(value):
+    """Validate a gate given as [[lat, lon], [lat, lon]]"""
+    if (not isinstance(value, list) or len(value) != 2 or
+            not all(isinstance(p, list) and len(p) == 2 for p in value)):
+        raise ValueError("gate must be [[lat, lon], [lat, lon]]")
+    return [[float(p[0]), float(p[1])] for p in value]
+
+
+# =============================================
+# LIVE TRACKING
+# =============================================
+
+def mark_rider_changed(rider_id):
+    """Called on ingest - O(1), the edit itself happens on the tracking loop"""
+    with tracking_lock:
+        tracked_changes.add(rider_id)
+
+
+def load_trackers():
+    """Reload active /track messages, grouped by the rider they follow"""
+    try:
+        result = supabase.table("telegram_trackers")\
+            .select("telegram_chat_id, message_id, rider_id")\
+            .eq("active", True)\
+            .execute()
+    except Exception as e:
+        logger.error(f"Error loading trackers: {e}")
+        return
+    
+    by_rider = defaultdict(list)
+    for row in result.data or []:
+        by_rider[row.get('rider_id') or DEFAULT_RIDER_ID].append((row['telegram_chat_id'], row['message_id']))
+    
+    with tracking_lock:
+        trackers.update(by_rider=dict(by_rider), loaded_at=time.monotonic())
+        # Forget texts of messages nobody tracks any more
+        live = {message for followers in by_rider.values() for message in followers}
+        for message in [message for message in last_track_text if message not in live]:
+            del last_track_text[message]
+
+
+def format_track_message(rider_id):
+    """Render the live tracking text for a rider (once per push, shared by all followers)"""
+    state = get_rider_state(rider_id)
+    with rider_state_lock:
+        activity = state["activity"]
+        chest = dict(state["last_chest"] or {})
+        trip = state["trip"].to_dict() if state["trip"] else None
+    
+    message = "📡 *Live tracking*\n\n"
+    message += f"🏷️ Activity: {activity.replace('_', ' ').title()}\n"
+    message += f"🏍️ Speed: {float(chest.get('speed', 0) or 0):.1f} km/h\n"
+    
+    if chest.get('latitude') and chest.get('longitude'):
+        lat = chest['latitude']
+        lon = chest['longitude']
+        message += f"📍 Location: [{lat:.5f}, {lon:.5f}](https://maps.google.com/?q={lat},{lon})\n"
+    
+    if trip:
+        message += f"\n🛣️ Trip: {trip['distance_km']:.2f} km in {trip['riding_time_s'] / 60:.0f} min\n"
+        message += f"⭐ Score: {trip['score']:.0f}/100 · ⚠️ Harsh events: {trip['harsh_events']}\n"
+    else:
+        message += "\n🅿️ No ride in progress\n"
+    
+    return message
+
+
+def edit_track_message(chat_id, message_id, text):
+    """Edit one follower's message - returns the Telegram HTTP status"""
+    import requests
+    
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/editMessageText"
+    payload = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": text,
+        "parse_mode": "Markdown",
+        "disable_web_page_preview": True
+    }
+    response = requests.post(url, json=payload, timeout=TELEGRAM_SEND_TIMEOUT)
+    if response.status_code == 400 and "not modified" in response.text:
+        return 200
+    return response.status_code
+
+
+def stop_tracker(chat_id):
+    """The message is gone (deleted, chat blocked) - stop editing it"""
+    try:
+        supabase.table("telegram_trackers")\
+            .update({"active": False})\
+            .eq("telegram_chat_id", chat_id)\
+            .execute()
+    except Exception as e:
+        logger.error(f"Error stopping tracker: {e}")
+
+
+def push_tracking_updates():
+    """Render each changed rider once and edit their followers' messages"""
+    with tracking_lock:
+        stale = time.monotonic() - trackers["loaded_at"] > TRACKERS_REFRESH_INTERVAL
+    if stale:
+        load_trackers()
+    
+    with tracking_lock:
+        changed = list(tracked_changes)
+        tracked_changes.clear()
+        by_rider = trackers["by_rider"]
+    
+    edits = []
+    for rider_id in changed:
+        followers = by_rider.get(rider_id)
+        if not followers:
+            continue
+        text = format_track_message(rider_id)
+        with tracking_lock:
+            edits.extend((message, text) for message in followers if last_track_text.get(message) != text)
+    
+    if not edits:
+        return
+    
+    statuses = run_concurrently(
+        *[lambda message=message, text=text: edit_track_message(*message, text) for message, text in edits],
+        executor=tracking_executor,
+        timeout=TELEGRAM_SEND_TIMEOUT + 1
+    )
+    
+    for (message, text), status in zip(edits, statuses):
+        if status == 200:
+            with tracking_lock:
+                last_track_text[message] = text
+        elif status in (400, 403):
+            stop_tracker(message[0])
+            with tracking_lock:
+                for followers in trackers["by_rider"].values():
+                    if message in followers:
+                        followers.remove(message)
+        # 429 / network errors: the rider is marked changed again by the next upload
+
+
+def tracking_loop():
+    while True:
+        time.sleep(TRACK_EDIT_INTERVAL)
+        try:
+            push_tracking_updates()
+        except Exception as e:
+            logger.error(f"Live tracking error: {e}")
+
+
+# =============================================
+# STATE SNAPSHOTS
+# =============================================
+# File layout: header (magic, version, saved_at, crc32, length) + zlib-compressed JSON
+
+def build_snapshot():
+    """Serialise rider state and the recent-events index"""
+    with rider_state_lock:
+        riders = {}
+        for rider_id, state in rider_state.items():
+            riders[rider_id] = dict(
+                state,
+                trip=vars(state["trip"]) if state["trip"] else None,
+                day=vars(state["day"]) if state["day"] else None,
+                last_persist_at=0.0  # monotonic clock does not survive a restart
+            )
+        riders_json = json.dumps(riders, default=str)
+    
+    with event_index_lock:
+        events = {}
+        buffers = []
+        for (rider_id, event_type), buffer in event_index.items():
+            for event in buffer:
+                events[event['id']] = event
+            buffers.append([rider_id, event_type, [event['id'] for event in buffer]])
+        index_json = json.dumps({
+            "complete": event_index_state["complete"],
+            "events": list(events.values()),
+            "buffers": buffers
+        }, default=str)
+    
+    return ('{"riders": %s, "event_index": %s}' % (riders_json, index_json)).encode()
+
+
+def save_snapshot():
+    """Write a snapshot atomically (temp file + rename)"""
+    try:
+        payload = zlib.compress(build_snapshot())
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time(), zlib.crc32(payload), len(payload))
+        
+        tmp_path = SNAPSHOT_PATH + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error(f"Error saving state snapshot: {e}")
+
+
+def restore_snapshot():
+    """
+    Restore state from the last snapshot on boot
+    Returns False (cold start) when there is no usable snapshot
+    """
+    try:
+        with open(SNAPSHOT_PATH, "rb") as f:
+            magic, version, saved_at, crc, length = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            payload = f.read(length)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.error(f"Unreadable state snapshot: {e}")
+        return False
+    
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring state snapshot with unsupported format (version {version})")
+        return False
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        logger.warning("Ignoring corrupt state snapshot")
+        return False
+    if time.time() - saved_at > SNAPSHOT_MAX_AGE:
+        logger.info("Ignoring stale state snapshot")
+        return False
+    
+    try:
+        # Decode and rebuild everything before touching live state, so a
+        # snapshot that passes the CRC but does not parse is just a cold start
+        snapshot = json.loads(zlib.decompress(payload))
         
-        # Update event as notified
-        supabase.table("events")\
-            .update({"telegram_notified": True, "telegram_sent_at": datetime.now().isoformat()})\
-            .eq("id", event_data.get('id'))\
+        riders = {}
+        for rider_id, state in snapshot["riders"].items():
+            state["trip"] = RideScore.from_state(state["trip"]) if state["trip"] else None
+            state["day"] = RideScore.from_state(state["day"]) if state["day"] else None
+            riders[rider_id] = state
+        
+        index = snapshot["event_index"]
+        events = {event['id']: event for event in index["events"]}
+        buffers = [((rider_id, event_type), [events[event_id] for event_id in event_ids])
+                   for rider_id, event_type, event_ids in index["buffers"]]
+    except Exception as e:
+        logger.error(f"Ignoring undecodable state snapshot: {e}")
+        return False
+    
+    with rider_state_lock:
+        rider_state.update(riders)
+        for rider_id, state in riders.items():
+            # Re-arm the confirmation timer for a crash that was pending at shutdown
+            if state["crash"] is not None:
+                remaining = max(0.0, state["crash"]["impact_at"] + CRASH_CONFIRM_WINDOW - time.time())
+                timer = threading.Timer(remaining, finalize_crash_candidate, args=(rider_id, state["crash"]))
+                timer.daemon = True
+                timer.start()
+    
+    with event_index_lock:
+        for key, buffer in buffers:
+            event_index[key].extend(buffer)
+        event_index_state["complete"] = index["complete"]
+    
+    catch_up_event_index(saved_at, set(events))
+    
+    logger.info(f"Restored state snapshot from {time.time() - saved_at:.0f}s ago "
+                f"({len(riders)} riders, {len(events)} events)")
+    return True
+
+
+def catch_up_event_index(saved_at, known_ids):
+    """
+    Index events stored after the snapshot was written (another instance or
+    a crash-alert insert that landed during shutdown). If the gap cannot be
+    read in full the index is marked incomplete so deep pages use the DB
+    """
+    try:
+        result = supabase.table("events")\
+            .select("*")\
+            .gt("timestamp", datetime.fromtimestamp(saved_at - SNAPSHOT_INTERVAL).isoformat())\
+            .order("timestamp", desc=True)\
+            .limit(EVENT_WARM_LIMIT)\
             .execute()
+        rows = result.data or []
         
+        with event_index_lock:
+            # Oldest first so appendleft leaves the newest at the front
+            for event in reversed(rows):
+                if event['id'] in known_ids:
+                    continue
+                for key in event_index_keys(event):
+                    event_index[key].appendleft(event)
+            if len(rows) >= EVENT_WARM_LIMIT:
+                event_index_state["complete"] = False
     except Exception as e:
-        logger.error(f"Telegram notification error: {e}")
+        logger.error(f"Error catching up events index: {e}")
+        with event_index_lock:
+            event_index_state["complete"] = False
+
+
+def snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        save_snapshot()
+
+
+# =============================================
+# STARTUP
+# =============================================
+
+def start_background_services():
+    """Alert dispatchers, state restore, snapshot/ledger writers and live tracking - once per serving process"""
+    for number, alert_queue in enumerate(alert_queues):
+        threading.Thread(target=alert_dispatcher, args=(alert_queue,), name=f"alert-dispatcher-{number}", daemon=True).start()
+    background_executor.submit(load_alert_recipients)
+    
+    # A restored snapshot already holds the events index - only cold starts query the DB
+    if not restore_snapshot():
+        warm_event_index()
+    
+    threading.Thread(target=snapshot_loop, name="snapshot", daemon=True).start()
+    threading.Thread(target=delivery_flush_loop, name="delivery-ledger", daemon=True).start()
+    threading.Thread(target=tracking_loop, name="live-tracking", daemon=True).start()
+    atexit.register(save_snapshot)
+    atexit.register(flush_delivery_ledger)
+
+
+# The debug reloader's parent process only watches files and never serves -
+# running this there too would restore and write the snapshot twice
+if __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    start_background_services()
 
 
 # =============================================
@@ -273,6 +1792,9 @@ def receive_leg_data():
         "gyro_z": 0.02,
         "temperature": 28.5
     }
+    or a batch {"samples": [ ... ]} / compact FIFO batch {"imu": [ ... ]}, either
+    optionally with a "features" window summary, or a store-and-forward drain
+    {"spool": [ ... ]} - the response carries a "control" block
     """
     try:
         data = request.get_json()
@@ -280,19 +1802,60 @@ def receive_leg_data():
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
-        # Add timestamp if not provided
-        if 'timestamp' not in data:
-            data['timestamp'] = datetime.now().isoformat()
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        
+        record_ingest()
+        rider_id = data.get('rider_id') or DEFAULT_RIDER_ID
+        try:
+            samples, upload_ids = parse_upload(data, rider_id, 'leg')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not samples:
+            return jsonify({
+                "status": "duplicate",
+                "message": "Leg sensor data already recorded",
+                "control": get_sampling_control(get_rider_state(rider_id)["activity"])
+            }), 200
+        data = samples[-1]
+        
+        process_leg_crash_samples(rider_id, samples)
         
         # Insert into database
-        result = supabase.table("esp32_leg_data").insert(data).execute()
+        result = supabase.table("esp32_leg_data").insert(samples).execute()
+        remember_uploads(rider_id, 'leg', upload_ids)
+        
+        # One event per harsh braking / acceleration excursion in the batch
+        chest_data = get_rider_state(rider_id)["last_chest"]
+        for event_type, leg_data, accel in harsh_event_onsets(rider_id, samples):
+            if event_type == "HARSH_BRAKE":
+                create_event(
+                    "HARSH_BRAKE",
+                    "MEDIUM",
+                    leg_data,
+                    chest_data,
+                    f"Harsh braking detected: {accel} m/s²"
+                )
+            else:
+                create_event(
+                    "HARSH_ACCEL",
+                    "LOW",
+                    leg_data,
+                    chest_data,
+                    f"Harsh acceleration detected: {accel} m/s²"
+                )
         
-        logger.info(f"Leg data received: Accel({data.get('accel_x')}, {data.get('accel_y')}, {data.get('accel_z')})")
+        if should_log_sample("leg_ingest"):
+            logger.info(
+                "Leg data received: Accel(%s, %s, %s)", data.get('accel_x'), data.get('accel_y'), data.get('accel_z'),
+                extra={"fields": {"rider_id": rider_id, "samples": len(samples)}}
+            )
         
         return jsonify({
             "status": "success",
             "message": "Leg sensor data recorded",
-            "id": result.data[0]['id'] if result.data else None
+            "id": result.data[-1]['id'] if result.data else None,
+            "control": get_sampling_control(get_rider_state(rider_id)["activity"])
         }), 201
         
     except Exception as e:
@@ -321,6 +1884,9 @@ def receive_chest_data():
         "gyro_z": 0.01,
         "temperature": 27.8
     }
+    or a batch {"samples": [ ... ]} / compact FIFO batch {"imu": [ ... ]}, either
+    optionally with a "features" window summary, or a store-and-forward drain
+    {"spool": [ ... ]} - the response carries a "control" block
     """
     try:
         data = request.get_json()
@@ -328,62 +1894,68 @@ def receive_chest_data():
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
-        # Add timestamp if not provided
-        if 'timestamp' not in data:
-            data['timestamp'] = datetime.now().isoformat()
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
         
-        # Insert into database
-        result = supabase.table("esp32_chest_data").insert(data).execute()
+        record_ingest()
+        rider_id = data.get('rider_id') or DEFAULT_RIDER_ID
+        try:
+            samples, upload_ids = parse_upload(data, rider_id, 'chest')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not samples:
+            return jsonify({
+                "status": "duplicate",
+                "message": "Chest sensor data already recorded",
+                "control": get_sampling_control(get_rider_state(rider_id)["activity"])
+            }), 200
+        data = samples[-1]
         
-        logger.info(f"Chest data received: GPS({data.get('latitude')}, {data.get('longitude')}), Speed: {data.get('speed')}")
+        # Crash pipeline runs before any storage round trip - alerts go out on the priority lane
+        process_chest_crash_samples(rider_id, samples)
         
-        # Check for events (harsh brake, acceleration, fall detection)
-        # Get latest leg data to compare
-        leg_data_result = supabase.table("esp32_leg_data")\
-            .select("*")\
-            .order("timestamp", desc=True)\
-            .limit(1)\
-            .execute()
+        # Fetch latest leg data (to compare) while the insert runs. The insert
+        # stays on the request thread - a timed-out insert could still commit
+        # and the device's retry would duplicate the rows
+        leg_future = storage_executor.submit(
+            lambda: supabase.table("esp32_leg_data")
+                .select("*")
+                .eq("rider_id", rider_id)
+                .order("timestamp", desc=True)
+                .limit(1)
+                .execute()
+        )
+        result = supabase.table("esp32_chest_data").insert(samples).execute()
+        remember_uploads(rider_id, 'chest', upload_ids)
+        leg_data_result, = wait_for_results([leg_future])
         
-        if leg_data_result.data:
-            leg_data = leg_data_result.data[0]
-            chest_data = data
-            
-            # Check harsh braking
-            if check_harsh_brake(leg_data.get('accel_x', 0)):
-                create_event(
-                    "HARSH_BRAKE",
-                    "MEDIUM",
-                    leg_data,
-                    chest_data,
-                    f"Harsh braking detected: {leg_data.get('accel_x')} m/s²"
-                )
-            
-            # Check harsh acceleration
-            if check_harsh_acceleration(leg_data.get('accel_x', 0)):
-                create_event(
-                    "HARSH_ACCEL",
-                    "LOW",
-                    leg_data,
-                    chest_data,
-                    f"Harsh acceleration detected: {leg_data.get('accel_x')} m/s²"
-                )
-            
-            # Check fall/accident
-            is_fall, difference = check_fall_or_accident(leg_data, chest_data)
-            if is_fall:
-                create_event(
-                    "FALL_DETECTED",
-                    "CRITICAL",
-                    leg_data,
-                    chest_data,
-                    f"Potential fall or accident detected! Sensor difference: {difference:.2f}"
-                )
+        if should_log_sample("chest_ingest"):
+            logger.info(
+                "Chest data received: GPS(%s, %s), Speed: %s", data.get('latitude'), data.get('longitude'), data.get('speed'),
+                extra={"fields": {"rider_id": rider_id, "samples": len(samples)}}
+            )
+        
+        # Harsh brake/accel are checked per leg reading on the leg endpoint,
+        # falls go through the crash pipeline - leg data here drives activity only
+        leg_data = first_row(leg_data_result)
+        state = get_rider_state(rider_id)
+        
+        # Check-and-set under the lock - a crash candidate opened by a concurrent
+        # leg upload must not be overwritten with a riding activity
+        with rider_state_lock:
+            if leg_data and state["crash"] is None:
+                state["activity"] = detect_activity_type(leg_data, data)
+            activity = state["activity"]
+        
+        update_ride_score(rider_id, samples, activity)
+        update_lap_timer(rider_id, samples)
+        mark_rider_changed(rider_id)
         
         return jsonify({
             "status": "success",
             "message": "Chest sensor data recorded",
-            "id": result.data[0]['id'] if result.data else None
+            "id": result.data[-1]['id'] if result.data else None,
+            "control": get_sampling_control(activity)
         }), 201
         
     except Exception as e:
@@ -398,39 +1970,49 @@ def get_live_data():
     Returns matched data from both sensors (within 2 seconds)
     """
     try:
-        # Get latest leg data
-        leg_result = supabase.table("esp32_leg_data")\
-            .select("*")\
-            .order("timestamp", desc=True)\
-            .limit(1)\
-            .execute()
+        rider_id = request.args.get('rider_id', DEFAULT_RIDER_ID)
         
-        # Get latest chest data
-        chest_result = supabase.table("esp32_chest_data")\
-            .select("*")\
-            .order("timestamp", desc=True)\
-            .limit(1)\
-            .execute()
+        # Recent events come from the in-memory index when it covers them
+        recent_events = get_cached_events(rider_id=rider_id, limit=10)
+        
+        # Latest leg, latest chest (and recent events on an index miss) are independent - fetch in parallel
+        leg_result, chest_result, events_result = run_concurrently(
+            lambda: supabase.table("esp32_leg_data")
+                .select("*")
+                .eq("rider_id", rider_id)
+                .order("timestamp", desc=True)
+                .limit(1)
+                .execute(),
+            lambda: supabase.table("esp32_chest_data")
+                .select("*")
+                .eq("rider_id", rider_id)
+                .order("timestamp", desc=True)
+                .limit(1)
+                .execute(),
+            lambda: supabase.table("events")
+                .select("*")
+                .eq("rider_id", rider_id)
+                .order("timestamp", desc=True)
+                .limit(10)
+                .execute() if recent_events is None else None
+        )
         
-        leg_data = leg_result.data[0] if leg_result.data else {}
-        chest_data = chest_result.data[0] if chest_result.data else {}
+        if recent_events is None:
+            recent_events = events_result.data if events_result and events_result.data else []
+        
+        leg_data = first_row(leg_result)
+        chest_data = first_row(chest_result)
         
         # Detect activity type
         activity = detect_activity_type(leg_data, chest_data) if leg_data and chest_data else 'UNKNOWN'
         
-        # Get recent events
-        events_result = supabase.table("events")\
-            .select("*")\
-            .order("timestamp", desc=True)\
-            .limit(10)\
-            .execute()
-        
         response = {
             "timestamp": datetime.now().isoformat(),
             "leg_sensor": leg_data,
             "chest_sensor": chest_data,
             "activity_type": activity,
-            "recent_events": events_result.data if events_result.data else []
+            "recent_events": recent_events,
+            "score": get_current_scores(rider_id)
         }
         
         return jsonify(response), 200
@@ -447,37 +2029,25 @@ def verify_telegram_pin():
     Expected JSON: {"pin": "123456"}
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         pin = data.get('pin')
         
         if not pin:
             return jsonify({"success": False, "message": "PIN is required"}), 400
         
-        # Check if PIN exists and not expired
-        pin_result = supabase.table("telegram_pins")\
-            .select("*")\
-            .eq("pin_code", pin)\
-            .eq("is_used", False)\
-            .gt("expires_at", datetime.now().isoformat())\
-            .execute()
-        
-        if not pin_result.data:
-            return jsonify({"success": False, "message": "Invalid or expired PIN"}), 404
+        if not allow_pin_attempt(request.remote_addr or "unknown"):
+            return jsonify({"success": False, "message": "Too many attempts - try again in a minute"}), 429
         
-        pin_data = pin_result.data[0]
-        chat_id = pin_data['telegram_chat_id']
+        # One atomic call: consume a valid PIN and link its chat, or do nothing
+        # (the DB function runs in a single transaction, so a failed link keeps the PIN valid)
+        result = supabase.rpc("link_telegram_pin", {"p_pin": str(pin)}).execute()
+        chat_id = result.data
         
-        # Mark PIN as used
-        supabase.table("telegram_pins")\
-            .update({"is_used": True, "used_at": datetime.now().isoformat()})\
-            .eq("pin_code", pin)\
-            .execute()
+        if chat_id is None:
+            return jsonify({"success": False, "message": "Invalid or expired PIN"}), 404
         
-        # Link user
-        supabase.table("telegram_users")\
-            .update({"is_linked": True, "linked_at": datetime.now().isoformat()})\
-            .eq("telegram_chat_id", chat_id)\
-            .execute()
+        # New recipient - refresh the cached alert list instead of waiting for the TTL
+        background_executor.submit(load_alert_recipients)
         
         logger.info(f"Telegram account linked: chat_id={chat_id}, pin={pin}")
         
@@ -491,23 +2061,142 @@ def verify_telegram_pin():
         return jsonify({"success": False, "message": "Internal server error"}), 500
 
 
+@app.route('/api/scores', methods=['GET'])
+def get_scores():
+    """
+    Get riding-behaviour scores for a rider
+    Query: rider_id, period ('trip' or 'day'), limit (stored history rows)
+    """
+    try:
+        rider_id = request.args.get('rider_id', DEFAULT_RIDER_ID)
+        period = request.args.get('period', None)
+        limit = request.args.get('limit', 10, type=int)
+        
+        query = supabase.table("rider_scores").select("*").eq("rider_id", rider_id)
+        
+        if period:
+            query = query.eq("period", period)
+        
+        result = query.order("updated_at", desc=True).limit(limit).execute()
+        
+        return jsonify({
+            "rider_id": rider_id,
+            "current": get_current_scores(rider_id),
+            "history": result.data if result.data else []
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error fetching scores: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/laps/session', methods=['POST'])
+def create_lap_session():
+    """
+    Start a lap timing session for a rider
+    Expected JSON:
+    {
+        "rider_id": "default",
+        "start_finish": [[12.9716, 77.5946], [12.9718, 77.5946]],
+        "sectors": [[[12.9730, 77.5960], [12.9732, 77.5960]]]
+    }
+    """
+    try:
+        data = request.get_json() or {}
+        rider_id = data.get('rider_id') or DEFAULT_RIDER_ID
+        
+        try:
+            start_finish = parse_gate(data.get('start_finish'))
+            sectors = [parse_gate(gate) for gate in data.get('sectors', [])]
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid track config: {e}"}), 400
+        
+        session = start_lap_session(rider_id, start_finish, sectors)
+        
+        return jsonify({
+            "status": "success",
+            "session_id": session["session_id"],
+            "rider_id": rider_id
+        }), 201
+        
+    except Exception as e:
+        logger.error(f"Error creating lap session: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/laps', methods=['GET'])
+def get_laps():
+    """
+    Get laps for a session (the rider's current session by default)
+    Query: rider_id, session_id
+    """
+    try:
+        rider_id = request.args.get('rider_id', DEFAULT_RIDER_ID)
+        session_id = request.args.get('session_id', None)
+        
+        state = get_rider_state(rider_id)
+        with rider_state_lock:
+            session = state.get("lap_session")
+            if session and session_id in (None, session["session_id"]):
+                return jsonify({
+                    "session_id": session["session_id"],
+                    "laps": list(session["laps"]),
+                    "lap_in_progress": session["lap"] is not None
+                }), 200
+        
+        if not session_id:
+            return jsonify({"session_id": None, "laps": [], "lap_in_progress": False}), 200
+        
+        result = supabase.table("laps")\
+            .select("*")\
+            .eq("session_id", session_id)\
+            .order("lap_number")\
+            .execute()
+        
+        return jsonify({
+            "session_id": session_id,
+            "laps": result.data if result.data else [],
+            "lap_in_progress": False
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error fetching laps: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/events/recent', methods=['GET'])
 def get_recent_events():
-    """Get recent events with optional filtering"""
+    """
+    Get recent events with optional filtering
+    Query: type, rider_id, limit, offset - served from the in-memory index,
+    pages deeper than the buffer fall back to the database
+    """
     try:
         limit = request.args.get('limit', 50, type=int)
+        offset = request.args.get('offset', 0, type=int)
         event_type = request.args.get('type', None)
+        rider_id = request.args.get('rider_id', None)
         
-        query = supabase.table("events").select("*")
+        if limit is None or offset is None or limit < 1 or offset < 0:
+            return jsonify({"error": "limit must be >= 1 and offset >= 0"}), 400
         
-        if event_type:
-            query = query.eq("event_type", event_type)
+        events = get_cached_events(rider_id=rider_id, event_type=event_type, limit=limit, offset=offset)
         
-        result = query.order("timestamp", desc=True).limit(limit).execute()
+        if events is None:
+            query = supabase.table("events").select("*")
+            
+            if event_type:
+                query = query.eq("event_type", event_type)
+            
+            if rider_id:
+                query = query.eq("rider_id", rider_id)
+            
+            result = query.order("timestamp", desc=True).range(offset, offset + limit - 1).execute()
+            events = result.data if result.data else []
         
         return jsonify({
-            "events": result.data if result.data else [],
-            "count": len(result.data) if result.data else 0
+            "events": events,
+            "count": len(events)
         }), 200
         
     except Exception as e:
@@ -0,0 +1,216 @@
+"""
+Test setup for the Flask backend
+The Supabase client is replaced by a small in-memory table store before
+server.py is imported, so tests run without network or credentials
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+import pytest
+import supabase
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Supports the subset of the PostgREST query builder server.py uses"""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.op = 'select'
+        self.payload = None
+        self.filters = []
+        self.order_by = None
+        self.row_limit = None
+        self.row_range = None
+        self.on_conflict = None
+
+    def select(self, *columns, count=None):
+        self.op = 'select'
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, on_conflict=None):
+        self.op, self.payload, self.on_conflict = 'upsert', payload, on_conflict
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = 'update', payload
+        return self
+
+    def delete(self):
+        self.op = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row[column]) > str(value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row[column]) >= str(value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row[column]) < str(value))
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def range(self, start, end):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        with self.db.lock:
+            self.db.calls.append((self.table, self.op))
+            if self.db.fail_tables.get(self.table):
+                raise RuntimeError(f"{self.table} unavailable")
+
+            rows = self.db.tables.setdefault(self.table, [])
+
+            if self.op in ('insert', 'upsert'):
+                payload = self.payload if isinstance(self.payload, list) else [self.payload]
+                inserted = []
+                for item in payload:
+                    row = dict(item)
+                    if self.op == 'upsert' and self.on_conflict:
+                        keys = self.on_conflict.split(',')
+                        existing = [r for r in rows if all(r.get(k) == row.get(k) for k in keys)]
+                        if existing:
+                            existing[0].update(row)
+                            inserted.append(dict(existing[0]))
+                            continue
+                    row.setdefault('id', next(self.db.ids))
+                    row.setdefault('timestamp', '2026-01-01T00:00:00')
+                    rows.append(row)
+                    inserted.append(dict(row))
+                return FakeResult(inserted)
+
+            selected = [r for r in rows if all(f(r) for f in self.filters)]
+
+            if self.op == 'update':
+                for row in selected:
+                    row.update(self.payload)
+                return FakeResult([dict(r) for r in selected])
+
+            if self.op == 'delete':
+                for row in selected:
+                    rows.remove(row)
+                return FakeResult(selected)
+
+            if self.order_by:
+                column, desc = self.order_by
+                selected.sort(key=lambda r: str(r.get(column)), reverse=desc)
+            if self.row_range:
+                selected = selected[self.row_range[0]:self.row_range[1] + 1]
+            if self.row_limit is not None:
+                selected = selected[:self.row_limit]
+            return FakeResult([dict(r) for r in selected], count=len(selected))
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.tables = {}
+        self.calls = []
+        self.fail_tables = {}
+        self.ids = itertools.count(1)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+
+class FakeRpc:
+    """Database functions from supabase/setup.sql, each run as one transaction"""
+
+    def __init__(self, db, name, params):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        with self.db.lock:
+            self.db.calls.append((self.name, 'rpc'))
+            return FakeResult(getattr(self, self.name)(**self.params))
+
+    def link_telegram_pin(self, p_pin):
+        now = datetime.now().isoformat()
+        pins = [p for p in self.db.tables.get("telegram_pins", [])
+                if p["pin_code"] == p_pin and not p["is_used"] and p["expires_at"] > now]
+        if not pins:
+            return None
+        if self.db.fail_tables.get("telegram_users"):
+            raise RuntimeError("telegram_users unavailable")  # rolls back: PIN untouched
+        pins[0].update(is_used=True, used_at=now)
+        for user in self.db.tables.get("telegram_users", []):
+            if user["telegram_chat_id"] == pins[0]["telegram_chat_id"]:
+                user.update(is_linked=True, linked_at=now)
+        return pins[0]["telegram_chat_id"]
+
+
+FAKE_DB = FakeSupabase()
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test-key")
+os.environ.setdefault("LOG_SAMPLE_RATIO", "0")
+os.environ.setdefault("SNAPSHOT_PATH", os.path.join(tempfile.mkdtemp(), "state.snapshot"))
+supabase.create_client = lambda *args, **kwargs: FAKE_DB
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """Empty fake database and fresh in-process state for every test"""
+    FAKE_DB.reset()
+    server.rider_state.clear()
+    server.event_index.clear()
+    server.event_index_state["complete"] = True
+    server.alert_recipients.update(chat_ids=None, loaded_at=0.0)
+    server.delivery_ledger.clear()
+    server.delivery_notified_ids.clear()
+    server.pin_attempts.clear()
+    server.trackers.update(by_rider={}, loaded_at=0.0)
+    server.tracked_changes.clear()
+    server.last_track_text.clear()
+    yield FAKE_DB
+
+
+@pytest.fixture
+def client(db):
+    server.app.config["TESTING"] = True
+    return server.app.test_client()
@@ -0,0 +1,110 @@
+"""Tests for the two-stage crash pipeline and the priority alert lane"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def chest(seconds, accel=(0.0, 0.0, 9.81), gyro=0.0, speed=0.0):
+    return {
+        "rider_id": "r1", "timestamp": (START + timedelta(seconds=seconds)).isoformat(),
+        "accel_x": accel[0], "accel_y": accel[1], "accel_z": accel[2],
+        "gyro_x": gyro, "gyro_y": 0.0, "gyro_z": 0.0, "speed": speed
+    }
+
+
+@pytest.fixture
+def alerts(db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(server, "dispatch_alert", lambda event_type, *args: sent.append(event_type))
+    return sent
+
+
+def test_impact_then_orientation_change_confirms(alerts):
+    server.process_chest_crash_samples("r1", [chest(0), chest(1, accel=(40.0, 0.0, 9.81))])
+    assert alerts == ["FALL_DETECTED"]
+    assert server.get_rider_state("r1")["activity"] == 'CRASH_PENDING'
+
+    # Lying on the side: gravity now on the x axis
+    server.process_chest_crash_samples("r1", [chest(2, accel=(9.81, 0.0, 0.0))])
+    assert alerts == ["FALL_DETECTED", "ACCIDENT_ALERT"]
+    assert server.get_rider_state("r1")["crash"] is None
+
+
+def test_stillness_without_rotation_confirms_after_window(alerts):
+    server.process_chest_crash_samples("r1", [chest(0), chest(1, accel=(0.0, 0.0, 45.0))])
+    server.process_chest_crash_samples("r1", [chest(2), chest(4)])
+    assert alerts == ["FALL_DETECTED"]
+
+    server.process_chest_crash_samples("r1", [chest(2 + server.CRASH_STILLNESS_SECONDS)])
+    assert alerts == ["FALL_DETECTED", "ACCIDENT_ALERT"]
+
+
+def test_riding_on_cancels_and_restores_activity(alerts):
+    server.get_rider_state("r1")["activity"] = 'SCOOTER'
+    server.process_chest_crash_samples("r1", [chest(0, accel=(0.0, 0.0, 40.0))])
+    server.process_chest_crash_samples("r1", [chest(2, speed=server.CRASH_RESUME_SPEED + 5)])
+
+    assert alerts == ["FALL_DETECTED", "CRASH_CANCELLED"]
+    assert server.get_rider_state("r1")["activity"] == 'SCOOTER'
+
+
+def test_window_expiry_confirms_silence_and_cancels_motion(alerts):
+    state = server.get_rider_state("r1")
+    server.process_chest_crash_samples("r1", [chest(0, accel=(0.0, 0.0, 40.0))])
+    server.finalize_crash_candidate("r1", state["crash"])
+    assert alerts[-1] == "ACCIDENT_ALERT"
+
+    server.process_chest_crash_samples("r1", [chest(20, accel=(0.0, 0.0, 40.0))])
+    server.process_chest_crash_samples("r1", [chest(21, accel=(3.0, 2.0, 12.0), gyro=1.0)])
+    server.finalize_crash_candidate("r1", state["crash"])
+    assert alerts[-1] == "CRASH_CANCELLED"
+    # A late timer for an already resolved candidate is a no-op
+    server.finalize_crash_candidate("r1", {"samples": 0})
+    assert alerts[-1] == "CRASH_CANCELLED"
+
+
+def test_leg_impact_opens_candidate(alerts):
+    leg = dict(chest(0, accel=(0.0, 38.0, 9.81)), rider_id="r1")
+    server.process_leg_crash_samples("r1", [leg])
+    assert alerts == ["FALL_DETECTED"]
+    assert server.get_rider_state("r1")["last_leg"] is leg
+
+
+def test_priority_alert_is_sent_before_the_event_is_stored(db, monkeypatch):
+    db.tables["telegram_users"] = [{"telegram_chat_id": 7, "is_linked": True, "notifications_enabled": True}]
+    calls_at_send = []
+
+    def fake_send(chat_ids, message, executor=None):
+        calls_at_send.append((list(chat_ids), list(db.calls)))
+        return [server.delivery_record(chat_id, 200, None, 1) for chat_id in chat_ids]
+
+    monkeypatch.setattr(server, "send_telegram", fake_send)
+    server.create_event("ACCIDENT_ALERT", "CRITICAL", {"rider_id": "r1"}, chest(0), "test", priority=True)
+
+    chat_ids, calls = calls_at_send[0]
+    assert chat_ids == [7]
+    assert ("events", "insert") not in calls
+    assert db.tables["events"][0]["telegram_notified"] is True
+
+
+def test_alert_recipients_are_cached(db):
+    db.tables["telegram_users"] = [
+        {"telegram_chat_id": 1, "is_linked": True, "notifications_enabled": True},
+        {"telegram_chat_id": 2, "is_linked": True, "notifications_enabled": False},
+    ]
+    assert server.get_alert_recipients() == [1]
+    assert server.get_alert_recipients() == [1]
+    assert db.calls.count(("telegram_users", "select")) == 1
+
+
+def test_riders_are_pinned_to_one_dispatcher(monkeypatch):
+    monkeypatch.setattr(server, "alert_queues", [server.queue.Queue() for _ in range(4)])
+    for _ in range(3):
+        server.dispatch_alert("FALL_DETECTED", "HIGH", {}, {"rider_id": "r1"}, "")
+    sizes = [q.qsize() for q in server.alert_queues]
+    assert sorted(sizes) == [0, 0, 0, 3]
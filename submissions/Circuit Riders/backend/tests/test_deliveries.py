@@ -0,0 +1,68 @@
+"""Tests for Telegram send retries and the batched delivery ledger"""
+
+import requests
+
+import server
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_send_retries_rate_limited_chats_only(monkeypatch):
+    statuses = {1: [429, 200], 2: [400], 3: [200]}
+    posts = []
+
+    def fake_post(url, json, timeout):
+        posts.append(json["chat_id"])
+        return FakeResponse(statuses[json["chat_id"]].pop(0))
+
+    monkeypatch.setattr(requests, "post", fake_post)
+    deliveries = server.send_telegram([1, 2, 3], "hi")
+
+    assert [(d["telegram_chat_id"], d["status"], d["attempts"]) for d in deliveries] == [
+        (1, 'sent', 2), (2, 'failed', 1), (3, 'sent', 1)
+    ]
+    assert sorted(posts) == [1, 1, 2, 3]
+
+
+def test_flush_writes_one_upsert_and_one_update(db):
+    db.tables["events"] = [{"id": 10, "telegram_notified": False}, {"id": 11, "telegram_notified": False}]
+    server.record_deliveries(10, [server.delivery_record(1, 200, None, 1), server.delivery_record(2, 500, None, 2)])
+    server.record_deliveries(11, [server.delivery_record(1, 403, None, 1)])
+
+    server.flush_delivery_ledger()
+
+    assert db.calls == [("alert_deliveries", "upsert"), ("events", "update")]
+    assert len(db.tables["alert_deliveries"]) == 3
+    assert [e["telegram_notified"] for e in db.tables["events"]] == [True, False]
+
+
+def test_failed_flush_keeps_the_batch(db):
+    server.record_deliveries(10, [server.delivery_record(1, 200, None, 1)])
+    db.fail_tables["alert_deliveries"] = True
+    server.flush_delivery_ledger()
+    assert len(server.delivery_ledger) == 1
+
+    db.fail_tables.clear()
+    server.flush_delivery_ledger()
+    server.flush_delivery_ledger()
+    assert len(db.tables["alert_deliveries"]) == 1
+
+
+def test_deliveries_without_an_event_id_are_dropped(db):
+    server.record_deliveries(None, [server.delivery_record(1, 200, None, 1)])
+    assert server.delivery_ledger == []
+
+
+def test_priority_event_links_deliveries_to_stored_id(db, monkeypatch):
+    monkeypatch.setattr(server, "get_alert_recipients", lambda: [5])
+    monkeypatch.setattr(server, "send_telegram",
+                        lambda chat_ids, message, executor=None: [server.delivery_record(5, 200, None, 1)])
+
+    server.create_event("ACCIDENT_ALERT", "CRITICAL", {"rider_id": "r1"}, {}, "test", priority=True)
+    event_id = db.tables["events"][0]["id"]
+
+    assert [row["event_id"] for row in server.delivery_ledger] == [event_id]
+    assert server.delivery_notified_ids == set()  # already stored as notified
@@ -0,0 +1,65 @@
+"""Tests for the recent-events ring buffers and their database fallback"""
+
+import server
+
+
+def add_events(count, rider_id="r1", event_type="HARSH_BRAKE"):
+    for i in range(count):
+        server.index_event({
+            "id": i, "rider_id": rider_id, "event_type": event_type,
+            "timestamp": f"2026-01-01T00:00:{i:02d}"
+        })
+
+
+def test_pages_are_newest_first(db):
+    add_events(5)
+    assert [e["id"] for e in server.get_cached_events(limit=2)] == [4, 3]
+    assert [e["id"] for e in server.get_cached_events(limit=2, offset=2)] == [2, 1]
+    assert [e["id"] for e in server.get_cached_events(limit=10, offset=4)] == [0]
+
+
+def test_filters_by_rider_and_type(db):
+    add_events(3, rider_id="r1", event_type="HARSH_BRAKE")
+    add_events(2, rider_id="r2", event_type="HARSH_ACCEL")
+
+    assert len(server.get_cached_events(rider_id="r1")) == 3
+    assert len(server.get_cached_events(event_type="HARSH_ACCEL")) == 2
+    assert server.get_cached_events(rider_id="r2", event_type="HARSH_BRAKE") == []
+
+
+def test_complete_index_answers_past_the_end_without_database(client, db):
+    add_events(3)
+    response = client.get("/api/events/recent?limit=10&offset=5")
+
+    assert response.status_code == 200
+    assert response.get_json()["events"] == []
+    assert ("events", "select") not in db.calls
+
+
+def test_incomplete_index_falls_back_to_database(client, db):
+    server.event_index_state["complete"] = False
+    add_events(2)
+    db.tables["events"] = [
+        {"id": i, "rider_id": "r1", "event_type": "HARSH_BRAKE", "timestamp": f"2026-01-01T00:00:{i:02d}"}
+        for i in range(4)
+    ]
+
+    assert server.get_cached_events(limit=2) is not None
+    assert server.get_cached_events(limit=2, offset=2) is None
+
+    response = client.get("/api/events/recent?limit=2&offset=2")
+    assert [e["id"] for e in response.get_json()["events"]] == [1, 0]
+    assert ("events", "select") in db.calls
+
+
+def test_full_buffer_falls_back_for_deeper_pages(db, monkeypatch):
+    monkeypatch.setattr(server, "EVENT_BUFFER_SIZE", 3)
+    add_events(5)
+
+    assert [e["id"] for e in server.get_cached_events(limit=3)] == [4, 3, 2]
+    assert server.get_cached_events(limit=3, offset=1) is None
+
+
+def test_invalid_paging_is_rejected(client, db):
+    assert client.get("/api/events/recent?limit=0").status_code == 400
+    assert client.get("/api/events/recent?offset=-1").status_code == 400
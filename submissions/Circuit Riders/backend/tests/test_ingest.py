@@ -0,0 +1,243 @@
+"""Tests for ingest payload validation and per-reading event detection"""
+
+from datetime import datetime
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("payload", [
+    {"samples": []},
+    {"samples": [1, 2]},
+    {"samples": [{"accel_x": 0}, "bad"]},
+    {"samples": {"accel_x": 0}},
+    [{"accel_x": 0}],
+])
+@pytest.mark.parametrize("endpoint", ["/api/esp32-leg", "/api/esp32-chest"])
+def test_invalid_batches_are_rejected(client, db, endpoint, payload):
+    response = client.post(endpoint, json=payload)
+    assert response.status_code == 400
+    assert not db.tables.get("esp32_leg_data") and not db.tables.get("esp32_chest_data")
+
+
+def test_harsh_brake_in_middle_of_batch_creates_event(client, db):
+    samples = [
+        {"accel_x": 0.1, "accel_y": 0, "accel_z": 9.8, "age_ms": 200},
+        {"accel_x": -9.5, "accel_y": 0, "accel_z": 9.8, "age_ms": 100},
+        {"accel_x": 0.2, "accel_y": 0, "accel_z": 9.8, "age_ms": 0},
+    ]
+    response = client.post("/api/esp32-leg", json={"samples": samples})
+
+    assert response.status_code == 201
+    assert len(db.tables["esp32_leg_data"]) == 3
+    events = [e for e in db.tables.get("events", []) if e["event_type"] == "HARSH_BRAKE"]
+    assert len(events) == 1
+
+
+def test_compact_imu_batch_expands_with_timestamps(client, db):
+    payload = {
+        "rate_hz": 100, "age_ms": 20, "accel_scale": 0.01, "gyro_scale": 0.001,
+        "imu": [[0, 0, 981, 0, 0, 0], [-950, 0, 981, 10, 0, 0], [0, 0, 981, 0, 0, 0]],
+        "temperature": 28.5
+    }
+    response = client.post("/api/esp32-leg", json=payload)
+
+    assert response.status_code == 201
+    rows = db.tables["esp32_leg_data"]
+    assert [row["accel_x"] for row in rows] == [0.0, -9.5, 0.0]
+    assert rows[1]["gyro_x"] == 0.01
+    assert all(row["temperature"] == 28.5 for row in rows)
+    # 10 ms apart, oldest first
+    assert rows[0]["timestamp"] < rows[1]["timestamp"] < rows[2]["timestamp"]
+    assert [e["event_type"] for e in db.tables["events"]] == ["HARSH_BRAKE"]
+
+
+@pytest.mark.parametrize("payload", [
+    {"imu": [[1, 2, 3, 4, 5, 6]]},
+    {"imu": [], "rate_hz": 100, "accel_scale": 1, "gyro_scale": 1},
+    {"imu": [[1, 2, 3]], "rate_hz": 100, "accel_scale": 1, "gyro_scale": 1},
+    {"imu": [[1, 2, 3, 4, 5, "x"]], "rate_hz": 100, "accel_scale": 1, "gyro_scale": 1},
+    {"imu": [[1, 2, 3, 4, 5, 6]], "rate_hz": 0, "accel_scale": 1, "gyro_scale": 1},
+])
+def test_invalid_imu_batches_are_rejected(client, db, payload):
+    assert client.post("/api/esp32-chest", json=payload).status_code == 400
+
+
+def brake_batch(rows, braking_rows):
+    """100 Hz compact batch with `braking_rows` consecutive rows at -9.0 m/s² in the middle"""
+    start = (rows - braking_rows) // 2
+    imu = [[-900 if start <= index < start + braking_rows else 0, 0, 981, 0, 0, 0] for index in range(rows)]
+    return {"rate_hz": 100, "accel_scale": 0.01, "gyro_scale": 0.001, "imu": imu}
+
+
+def test_sustained_brake_across_many_rows_creates_one_event(client, db):
+    response = client.post("/api/esp32-leg", json=brake_batch(100, 50))
+
+    assert response.status_code == 201
+    assert len(db.tables["esp32_leg_data"]) == 100
+    assert [e["event_type"] for e in db.tables["events"]] == ["HARSH_BRAKE"]
+
+
+def test_harsh_events_cool_down_per_rider(client, db):
+    assert client.post("/api/esp32-leg", json=brake_batch(20, 5)).status_code == 201
+    # A second excursion within HARSH_EVENT_COOLDOWN is the same manoeuvre
+    assert client.post("/api/esp32-leg", json=brake_batch(20, 5)).status_code == 201
+    # Another rider has their own cooldown
+    assert client.post("/api/esp32-leg", json=dict(brake_batch(20, 5), rider_id="r2")).status_code == 201
+
+    events = db.tables["events"]
+    assert [(e["event_type"], e["rider_id"]) for e in events] == [("HARSH_BRAKE", "default"), ("HARSH_BRAKE", "r2")]
+
+
+WINDOW = {"n": 100, "accel_x_min": -9.8, "accel_x_max": 1.2, "accel_mag_mean": 9.9, "step_hz": 0.0}
+
+
+def test_features_only_upload_checks_window_extremes(client, db):
+    payload = {"accel_x": -0.4, "accel_y": 0.1, "accel_z": 9.8, "features": WINDOW}
+    response = client.post("/api/esp32-leg", json=payload)
+
+    assert response.status_code == 201
+    assert db.tables["esp32_leg_data"][0]["features"] == WINDOW
+    assert [e["event_type"] for e in db.tables["events"]] == ["HARSH_BRAKE"]
+
+
+def test_features_with_raw_batch_are_stored_once(client, db):
+    payload = {
+        "rate_hz": 100, "accel_scale": 0.01, "gyro_scale": 0.001,
+        "imu": [[0, 0, 981, 0, 0, 0], [-980, 0, 981, 0, 0, 0]],
+        "features": WINDOW
+    }
+    response = client.post("/api/esp32-leg", json=payload)
+
+    assert response.status_code == 201
+    rows = db.tables["esp32_leg_data"]
+    assert "features" not in rows[0]
+    assert rows[1]["features"] == {"n": 100, "accel_mag_mean": 9.9, "step_hz": 0.0}
+    # The raw rows already carry the peak - the summary must not fire it again
+    assert len(db.tables["events"]) == 1
+
+
+def test_leg_step_cadence_means_walking_before_gps_speed(client, db):
+    client.post("/api/esp32-leg", json={"accel_x": 0, "accel_z": 9.8, "features": dict(WINDOW, accel_x_min=0, step_hz=1.8)})
+    response = client.post("/api/esp32-chest", json={"speed": 0, "accel_z": 9.8})
+
+    assert response.get_json()["control"]["activity"] == "WALKING"
+    assert response.get_json()["control"]["upload_mode"] == "features"
+
+
+def test_non_object_features_are_rejected(client, db):
+    assert client.post("/api/esp32-leg", json={"accel_x": 0, "features": [1, 2]}).status_code == 400
+
+
+def reading(accel_x, seq, age_ms=0):
+    return {"accel_x": accel_x, "accel_y": 0, "accel_z": 9.8, "age_ms": age_ms, "seq": seq, "boot": 7}
+
+
+def test_spool_drain_stores_uploads_oldest_first_with_queue_delay(client, db):
+    payload = {"spool": [
+        {"delay_ms": 60000, "upload": reading(0.1, 1)},
+        {"delay_ms": 30000, "upload": reading(0.2, 2)},
+        {"delay_ms": None, "upload": reading(0.3, 3)},
+    ]}
+    response = client.post("/api/esp32-leg", json=payload)
+
+    assert response.status_code == 201
+    rows = db.tables["esp32_leg_data"]
+    assert [row["accel_x"] for row in rows] == [0.1, 0.2, 0.3]
+    assert rows[0]["timestamp"] < rows[1]["timestamp"] < rows[2]["timestamp"]
+    assert not any("seq" in row or "boot" in row for row in rows)
+
+
+def test_replayed_uploads_are_deduplicated(client, db):
+    assert client.post("/api/esp32-leg", json=reading(0.1, 1)).status_code == 201
+
+    spool = {"spool": [{"delay_ms": 0, "upload": reading(0.1, 1)}, {"delay_ms": 0, "upload": reading(0.2, 2)}]}
+    assert client.post("/api/esp32-leg", json=spool).status_code == 201
+    response = client.post("/api/esp32-leg", json=reading(0.2, 2))
+
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "duplicate"
+    assert [row["accel_x"] for row in db.tables["esp32_leg_data"]] == [0.1, 0.2]
+
+
+def test_upload_is_not_remembered_when_the_insert_fails(client, db):
+    db.fail_tables["esp32_chest_data"] = True
+    assert client.post("/api/esp32-chest", json=reading(0.1, 5)).status_code == 500
+
+    db.fail_tables.clear()
+    assert client.post("/api/esp32-chest", json={"spool": [{"upload": reading(0.1, 5)}]}).status_code == 201
+    assert len(db.tables["esp32_chest_data"]) == 1
+
+
+@pytest.mark.parametrize("payload", [
+    {"spool": []},
+    {"spool": [{"delay_ms": 5}]},
+    {"spool": [{"delay_ms": "soon", "upload": {"accel_x": 0}}]},
+])
+def test_invalid_spool_drains_are_rejected(client, db, payload):
+    assert client.post("/api/esp32-leg", json=payload).status_code == 400
+
+
+CLOCK_BASE_MS = int(datetime(2026, 3, 1, 12, 0, 0).timestamp() * 1000)
+
+
+def test_device_clock_stamps_every_sample(client, db):
+    payload = {
+        "clock_base_ms": CLOCK_BASE_MS, "clock_ms": 5000, "clock_error_ms": 12,
+        "rate_hz": 100, "age_ms": 20, "accel_scale": 0.01, "gyro_scale": 0.001,
+        "imu": [[0, 0, 981, 0, 0, 0], [0, 0, 981, 0, 0, 0]],
+    }
+    assert client.post("/api/esp32-chest", json=payload).status_code == 201
+
+    rows = db.tables["esp32_chest_data"]
+    assert [row["timestamp"] for row in rows] == ["2026-03-01T12:00:04.970000", "2026-03-01T12:00:04.980000"]
+    assert all(row["clock_error_ms"] == 12 for row in rows)
+    assert not any(key in row for row in rows for key in ("clock_base_ms", "clock_ms"))
+
+
+def test_spooled_uploads_with_a_device_clock_ignore_the_queue_delay(client, db):
+    upload = dict(reading(0.1, 1, age_ms=500), clock_base_ms=CLOCK_BASE_MS, clock_ms=1500, clock_error_ms=3)
+    payload = {"spool": [{"delay_ms": 60000, "upload": upload}, {"delay_ms": 0, "upload": reading(0.2, 2)}]}
+    assert client.post("/api/esp32-leg", json=payload).status_code == 201
+
+    rows = db.tables["esp32_leg_data"]
+    assert rows[0]["timestamp"] == "2026-03-01T12:00:01"
+    # No clock - stamped on arrival, with no error bound
+    assert rows[1]["timestamp"] > rows[0]["timestamp"] and rows[1]["clock_error_ms"] is None
+
+
+def test_device_clock_far_ahead_falls_back_to_arrival_time(client, db):
+    ahead_ms = int(datetime(2099, 1, 1).timestamp() * 1000)
+    payload = dict(reading(0.1, 1), clock_base_ms=ahead_ms, clock_ms=0, clock_error_ms=3)
+    assert client.post("/api/esp32-leg", json=payload).status_code == 201
+
+    row = db.tables["esp32_leg_data"][0]
+    assert row["timestamp"] < "2099" and row["clock_error_ms"] is None
+
+
+def test_invalid_device_clock_is_rejected(client, db):
+    payload = dict(reading(0.1, 1), clock_base_ms="noon", clock_ms=0)
+    assert client.post("/api/esp32-leg", json=payload).status_code == 400
+
+
+@pytest.mark.parametrize("load", [2, 5, 60])
+@pytest.mark.parametrize("activity", ["MOTORCYCLE", "SCOOTER", "UNKNOWN"])
+def test_stretched_raw_windows_still_fit_the_device_ring(monkeypatch, activity, load):
+    monkeypatch.setitem(server.ingest_meter, "rate", server.INGEST_CAPACITY * load)
+    profile = server.SAMPLING_PROFILES[activity]
+
+    control = server.get_sampling_control(activity)
+
+    assert control["send_interval_ms"] > profile["send_interval_ms"]
+    assert control["sample_rate_hz"] * control["send_interval_ms"] / 1000 <= server.DEVICE_WINDOW_SAMPLES
+    assert control["sample_rate_hz"] in server.DEVICE_SAMPLE_RATES_HZ
+
+
+def test_stretched_features_windows_keep_their_rate(monkeypatch):
+    monkeypatch.setitem(server.ingest_meter, "rate", server.INGEST_CAPACITY * 10)
+
+    control = server.get_sampling_control("WALKING")
+
+    assert control["sample_rate_hz"] == server.SAMPLING_PROFILES["WALKING"]["sample_rate_hz"]
+    assert control["send_interval_ms"] == 50000
@@ -0,0 +1,28 @@
+"""Tests for the GPS lap timer"""
+
+from datetime import datetime, timedelta
+
+import server
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+START_FINISH = [[12.0, 77.0], [12.0, 77.002]]
+
+
+def fix(latitude, seconds):
+    return {"latitude": latitude, "longitude": 77.001, "speed": 60.0,
+            "timestamp": (START + timedelta(seconds=seconds)).isoformat()}
+
+
+def test_out_of_order_fix_does_not_move_the_segment_start(db):
+    session = server.start_lap_session("r1", START_FINISH, [])
+
+    server.update_lap_timer("r1", [fix(11.999, 0), fix(12.001, 20)])  # lap starts at ~10 s
+    assert session["lap"] is not None
+
+    # A late fix from behind the line, then the next in-order fix further ahead:
+    # the segment must run from the 20 s fix, not back across the line from the stale one
+    server.update_lap_timer("r1", [fix(11.999, 5), fix(12.002, 60)])
+
+    assert session["laps"] == []
+    assert session["last_fix"][2] == (START + timedelta(seconds=60)).timestamp()
+    assert session["lap"]["time"] == 40
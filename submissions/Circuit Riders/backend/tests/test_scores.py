@@ -0,0 +1,83 @@
+"""Tests for the incremental riding-behaviour score"""
+
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+def test_welford_mean_and_variance_match_batch_statistics():
+    speeds = [12.0, 30.5, 45.0, 44.0, 18.25, 60.0]
+    score = server.RideScore('trip', 'test')
+    for speed in speeds:
+        score.add_sample(speed, 1.0)
+
+    assert score.mean_speed == pytest.approx(statistics.mean(speeds))
+    assert score.speed_variance == pytest.approx(statistics.variance(speeds))
+
+
+def test_distance_and_over_limit_time_integrate_dt():
+    score = server.RideScore('trip', 'test')
+    score.add_sample(36.0, 0.0)  # first fix, nothing to integrate
+    score.add_sample(36.0, 100.0)  # 36 km/h for 100 s = 1 km
+    score.add_sample(server.SPEED_LIMIT_KMH + 10, 100.0)
+
+    assert score.distance_km == pytest.approx(1.0 + (server.SPEED_LIMIT_KMH + 10) * 100 / 3600)
+    assert score.riding_time == 200.0
+    assert score.over_limit_fraction == pytest.approx(0.5)
+
+
+def test_score_penalties_are_capped():
+    clean = server.RideScore('trip', 'clean')
+    for _ in range(10):
+        clean.add_sample(30.0, 1.0)
+    assert clean.score == 100.0
+
+    reckless = server.RideScore('trip', 'reckless')
+    for i in range(100):
+        reckless.add_sample(200.0 if i % 2 else 0.0, 1.0)
+    for _ in range(500):
+        reckless.add_harsh_event()
+    # harsh (50) + variance (20) + speeding (15 = half the time over the limit)
+    assert reckless.score == pytest.approx(15.0)
+
+
+def test_harsh_rate_floors_distance_at_one_km():
+    score = server.RideScore('trip', 'short')
+    score.add_harsh_event()
+    assert score.harsh_per_100km == 100.0
+
+
+def test_snapshot_state_round_trip():
+    score = server.RideScore('day', '2026-01-01')
+    for speed in (20.0, 40.0, 70.0):
+        score.add_sample(speed, 2.0)
+    score.add_harsh_event()
+
+    restored = server.RideScore.from_state(dict(vars(score)))
+    assert restored.to_dict() == score.to_dict()
+
+
+def test_update_ride_score_opens_trip_and_skips_long_gaps(db):
+    start = datetime(2026, 1, 1, 12, 0, 0)
+    samples = [
+        {"speed": 36.0, "timestamp": (start + timedelta(seconds=s)).isoformat()}
+        for s in (0, 5, 10, 60)  # the 50 s gap exceeds MAX_SAMPLE_GAP
+    ]
+    server.update_ride_score("r1", samples, 'SCOOTER')
+
+    scores = server.get_current_scores("r1")
+    assert scores["trip"]["riding_time_s"] == 10.0
+    assert scores["trip"]["distance_km"] == pytest.approx(0.1)
+    assert scores["day"]["period_key"] == "2026-01-01"
+
+
+def test_trip_closes_after_idle_timeout(db):
+    start = datetime(2026, 1, 1, 12, 0, 0)
+    server.update_ride_score("r1", [{"speed": 30.0, "timestamp": start.isoformat()}], 'MOTORCYCLE')
+    later = start + timedelta(seconds=server.TRIP_IDLE_TIMEOUT + 1)
+    server.update_ride_score("r1", [{"speed": 0.0, "timestamp": later.isoformat()}], 'STATIONARY')
+
+    assert server.get_current_scores("r1")["trip"] is None
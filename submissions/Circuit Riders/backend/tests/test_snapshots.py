@@ -0,0 +1,88 @@
+"""Tests for saving and restoring in-process state snapshots"""
+
+from datetime import datetime
+
+import pytest
+
+import server
+
+
+def reset_state():
+    server.rider_state.clear()
+    server.event_index.clear()
+    server.event_index_state["complete"] = False
+
+
+@pytest.fixture
+def saved(db):
+    """A snapshot holding one rider's score and two indexed events"""
+    score = server.RideScore('day', '2026-01-01')
+    score.add_sample(30.0, 0.0)
+    score.add_sample(50.0, 5.0)
+    server.get_rider_state("r1").update(activity='SCOOTER', day=score)
+    for i in (1, 2):
+        server.index_event({"id": i, "rider_id": "r1", "event_type": "HARSH_BRAKE",
+                            "timestamp": f"2026-01-01T00:00:0{i}"})
+    server.save_snapshot()
+    expected = score.to_dict()
+    reset_state()
+    return expected
+
+
+def test_round_trip_restores_riders_and_index(saved, db):
+    assert server.restore_snapshot() is True
+
+    state = server.rider_state["r1"]
+    assert state["activity"] == 'SCOOTER'
+    assert state["day"].to_dict() == saved
+    assert [e["id"] for e in server.get_cached_events(rider_id="r1")] == [2, 1]
+    assert server.event_index_state["complete"] is True
+
+
+def test_catch_up_indexes_events_stored_after_the_snapshot(saved, db):
+    later = datetime.now().isoformat()
+    db.tables["events"] = [{"id": 9, "rider_id": "r1", "event_type": "ACCIDENT_ALERT", "timestamp": later}]
+
+    assert server.restore_snapshot() is True
+    assert [e["id"] for e in server.get_cached_events(rider_id="r1")] == [9, 2, 1]
+
+
+def test_failed_catch_up_marks_index_incomplete(saved, db):
+    db.fail_tables["events"] = True
+
+    assert server.restore_snapshot() is True
+    assert server.event_index_state["complete"] is False
+
+
+def test_corrupt_payload_is_ignored(saved, db):
+    with open(server.SNAPSHOT_PATH, "r+b") as f:
+        f.seek(server.SNAPSHOT_HEADER.size + 3)
+        byte = f.read(1)
+        f.seek(-1, 1)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    assert server.restore_snapshot() is False
+    assert server.rider_state == {}
+
+
+def test_truncated_file_is_ignored(saved, db):
+    with open(server.SNAPSHOT_PATH, "r+b") as f:
+        f.truncate(5)
+
+    assert server.restore_snapshot() is False
+
+
+def test_valid_crc_with_bad_content_does_not_touch_state(db):
+    payload = server.zlib.compress(b'{"riders": {"r1": {"trip": null}}, "event_index": {}}')
+    header = server.SNAPSHOT_HEADER.pack(server.SNAPSHOT_MAGIC, server.SNAPSHOT_VERSION,
+                                         server.time.time(), server.zlib.crc32(payload), len(payload))
+    with open(server.SNAPSHOT_PATH, "wb") as f:
+        f.write(header + payload)
+
+    assert server.restore_snapshot() is False
+    assert server.rider_state == {}
+
+
+def test_stale_snapshot_is_ignored(saved, db, monkeypatch):
+    monkeypatch.setattr(server, "SNAPSHOT_MAX_AGE", -1)
+    assert server.restore_snapshot() is False
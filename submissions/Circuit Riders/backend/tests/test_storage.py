@@ -0,0 +1,78 @@
+"""Tests for the storage fan-out helpers and the PIN linking write order"""
+
+import time
+
+import server
+
+
+def test_run_concurrently_keeps_call_order():
+    results = server.run_concurrently(
+        lambda: (time.sleep(0.05), "slow")[1],
+        lambda: "fast"
+    )
+    assert results == ["slow", "fast"]
+
+
+def test_run_concurrently_failed_and_timed_out_calls_yield_none():
+    def boom():
+        raise RuntimeError("down")
+
+    started = time.monotonic()
+    results = server.run_concurrently(boom, lambda: time.sleep(1), lambda: 1, timeout=0.1)
+
+    assert results == [None, None, 1]
+    assert time.monotonic() - started < 0.5
+
+
+def test_verify_pin_keeps_pin_valid_when_linking_fails(client, db):
+    db.tables["telegram_pins"] = [{
+        "pin_code": "123456", "telegram_chat_id": 42, "is_used": False, "expires_at": "2999-01-01"
+    }]
+    db.tables["telegram_users"] = [{"telegram_chat_id": 42, "is_linked": False}]
+
+    db.fail_tables["telegram_users"] = True
+    assert client.post('/api/telegram/verify-pin', json={"pin": "123456"}).status_code == 500
+    assert db.tables["telegram_pins"][0]["is_used"] is False
+
+    db.fail_tables["telegram_users"] = False
+    assert client.post('/api/telegram/verify-pin', json={"pin": "123456"}).status_code == 200
+    assert db.tables["telegram_users"][0]["is_linked"] is True
+    assert db.tables["telegram_pins"][0]["is_used"] is True
+
+
+def test_verify_pin_is_one_atomic_call(client, db):
+    db.tables["telegram_pins"] = [{
+        "pin_code": "654321", "telegram_chat_id": 7, "is_used": False, "expires_at": "2999-01-01"
+    }]
+    db.tables["telegram_users"] = [{"telegram_chat_id": 7, "is_linked": False}]
+
+    assert client.post('/api/telegram/verify-pin', json={"pin": "654321"}).status_code == 200
+    # The only other call is the background refresh of the alert recipient list
+    assert [call for call in db.calls if call != ("telegram_users", "select")] == [("link_telegram_pin", 'rpc')]
+    assert client.post('/api/telegram/verify-pin', json={"pin": "654321"}).status_code == 404
+
+
+def test_verify_pin_attempts_are_rate_limited(client, db):
+    for _ in range(server.PIN_ATTEMPTS_PER_WINDOW):
+        assert client.post('/api/telegram/verify-pin', json={"pin": "000000"}).status_code == 404
+    calls = len(db.calls)
+
+    assert client.post('/api/telegram/verify-pin', json={"pin": "000000"}).status_code == 429
+    assert len(db.calls) == calls
+
+
+def test_verify_pin_limit_is_per_client_behind_the_proxy(client, db):
+    # Every request reaches the app from nginx's address - the client is in X-Forwarded-For
+    proxy = {"REMOTE_ADDR": "127.0.0.1"}
+    for _ in range(server.PIN_ATTEMPTS_PER_WINDOW):
+        assert client.post('/api/telegram/verify-pin', json={"pin": "000000"}, environ_base=proxy,
+                           headers={"X-Forwarded-For": "203.0.113.7"}).status_code == 404
+    assert client.post('/api/telegram/verify-pin', json={"pin": "000000"}, environ_base=proxy,
+                       headers={"X-Forwarded-For": "203.0.113.7"}).status_code == 429
+
+    assert client.post('/api/telegram/verify-pin', json={"pin": "000000"}, environ_base=proxy,
+                       headers={"X-Forwarded-For": "198.51.100.9"}).status_code == 404
+
+
+def test_verify_pin_without_body_is_rejected(client, db):
+    assert client.post('/api/telegram/verify-pin', data="x").status_code == 400
@@ -0,0 +1,80 @@
+"""Tests for live /track message updates"""
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def followers(db, monkeypatch):
+    db.tables["telegram_trackers"] = [
+        {"telegram_chat_id": chat_id, "message_id": 100 + chat_id, "rider_id": "r1", "active": True}
+        for chat_id in range(1, 51)
+    ]
+    edits = []
+    statuses = {}
+
+    def fake_edit(chat_id, message_id, text):
+        edits.append(chat_id)
+        return statuses.get(chat_id, 200)
+
+    monkeypatch.setattr(server, "edit_track_message", fake_edit)
+    return edits, statuses
+
+
+def test_one_render_per_rider_for_many_followers(followers, monkeypatch):
+    edits, _ = followers
+    renders = []
+    original = server.format_track_message
+    monkeypatch.setattr(server, "format_track_message", lambda rider_id: renders.append(rider_id) or original(rider_id))
+
+    server.get_rider_state("r1")["last_chest"] = {"speed": 42.0, "latitude": 12.9, "longitude": 77.5}
+    for _ in range(10):
+        server.mark_rider_changed("r1")  # uploads between pushes coalesce
+    server.push_tracking_updates()
+
+    assert renders == ["r1"]
+    assert sorted(edits) == list(range(1, 51))
+
+
+def test_unchanged_text_is_not_edited_again(followers):
+    edits, _ = followers
+    server.mark_rider_changed("r1")
+    server.push_tracking_updates()
+    edits.clear()
+
+    server.mark_rider_changed("r1")
+    server.push_tracking_updates()
+    assert edits == []
+
+    server.get_rider_state("r1")["last_chest"] = {"speed": 10.0}
+    server.mark_rider_changed("r1")
+    server.push_tracking_updates()
+    assert len(edits) == 50
+
+
+def test_riders_without_changes_or_followers_cost_nothing(followers):
+    edits, _ = followers
+    server.push_tracking_updates()
+    server.mark_rider_changed("nobody-follows-me")
+    server.push_tracking_updates()
+    assert edits == []
+
+
+def test_deleted_message_stops_its_tracker(followers, db):
+    edits, statuses = followers
+    statuses[7] = 400
+    server.mark_rider_changed("r1")
+    server.push_tracking_updates()
+
+    assert next(t for t in db.tables["telegram_trackers"] if t["telegram_chat_id"] == 7)["active"] is False
+    server.get_rider_state("r1")["last_chest"] = {"speed": 5.0}
+    edits.clear()
+    server.mark_rider_changed("r1")
+    server.push_tracking_updates()
+    assert 7 not in edits and len(edits) == 49
+
+
+def test_chest_upload_marks_rider_changed(client, db):
+    client.post("/api/esp32-chest", json={"rider_id": "r9", "speed": 3.0})
+    assert "r9" in server.tracked_changes
@@ -3,7 +3,11 @@ ESP32 #1 - LEG SENSOR (MicroPython)
 Reads data from:
 - MPU6050 IMU only (Accelerometer + Gyroscope + Temperature)
 
-Sends data to backend API every 2 seconds
+Sends data to backend API every 2 seconds by default - the backend's
+response "control" block adjusts send interval, sample rate and upload mode.
+The MPU6050 buffers samples in its FIFO; each upload carries every sample since
+the last, window features computed on the device, or both. Sampling and
+uploading are separate uasyncio tasks, so a slow upload never stalls sampling
 
 Wiring:
 MPU6050:
@@ -13,7 +17,7 @@ MPU6050:
   - GND → GND
 
 Installation:
-1. Flash MicroPython firmware to ESP32
+1. Flash MicroPython firmware (v1.22 or newer - TLS over asyncio streams) to ESP32
 2. Install required libraries via Thonny package manager:
    - mpu6050 (or use the included MPU6050 class)
 3. Update WiFi credentials and API URL
@@ -21,13 +25,26 @@ Installation:
 """
 
 import machine
+import math
+import micropython
+import os
 import time
 import network
-import urequests as requests
-import ujson as json
+import socket
+import ssl
+import asyncio
+import json
+import struct
 from machine import Pin, I2C
 import gc
 
+if not hasattr(time, "ticks_ms"):
+    # CPython (host tests) - MicroPython's tick helpers on the monotonic clock
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_diff = lambda new, old: new - old
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+
 # WiFi Configuration
 WIFI_SSID = "Sasuke Uchiha"
 WIFI_PASSWORD = "sasukeuchiha"
@@ -35,62 +52,373 @@ WIFI_PASSWORD = "sasukeuchiha"
 # Backend API URL
 API_URL = "https://oracle-apis.hardikgarg.me/ignition-hackathon/api/esp32-leg"
 
-# Timing
+# Timing (defaults - the backend adjusts these via the "control" block)
 SEND_INTERVAL = 2000  # 2 seconds in milliseconds
+SAMPLE_RATE_HZ = 50  # MPU6050 internal sample rate
+
+# Bounds for server-provided control values
+MIN_SEND_INTERVAL = 500
+MAX_SEND_INTERVAL = 60000
+MIN_SAMPLE_RATE_HZ = 10
+MAX_SAMPLE_RATE_HZ = 200
+
+# MPU6050 FIFO: 1024 bytes of 12-byte accel + gyro frames, drained into a fixed ring
+FIFO_SIZE = 1024
+FIFO_FRAME = 12
+FIFO_BURST_FRAMES = 21  # ~256 bytes per I2C read
+RING_SAMPLES = 512  # 6 KB - 2.5 s at 200 Hz
+
+# Upload mode (the backend switches it via the "control" block):
+# "raw" FIFO samples, on-device window "features" only, or "both"
+UPLOAD_MODE = "both"
+STEP_THRESHOLD = 1.5  # m/s² above the window mean that counts as a step
+
+# Cooperative tasks - the sampler drains the FIFO on a fixed schedule while the
+# uploader waits on the network
+IMU_DRAIN_MS = 20  # the 85-frame FIFO lasts 425 ms at 200 Hz
+UPLOAD_BUFFERS = 2  # payload buffers - one being sent, one queued behind it
+
+# Device clock: SNTP at boot and every NTP_SYNC_INTERVAL_MS - samples are
+# stamped from ticks_ms plus the offset from the last sync
+NTP_HOST = "pool.ntp.org"
+NTP_PORT = 123
+NTP_TIMEOUT_MS = 2000
+NTP_SYNC_INTERVAL_MS = 900000  # 15 min
+NTP_RETRY_MS = 30000
+NTP_EPOCH_OFFSET_S = 2208988800  # 1900-01-01 to 1970-01-01
+CLOCK_DRIFT_MS_PER = 20000  # ±50 ppm crystal - 1 ms of error per 20 s since the sync
+CLOCK_MAX_AGE_MS = 86400000  # unsynced for a day - stop claiming device time
+
+# Keep-alive upload connection
+UPLOAD_TIMEOUT_S = 5
+RECONNECT_BACKOFF_MS = 1000  # doubles per failed attempt
+MAX_RECONNECT_BACKOFF_MS = 60000
+
+# Store-and-forward spool in flash for uploads made while the link is down
+SPOOL_DIR = "/spool"
+SPOOL_SEGMENTS = 8
+SPOOL_SEGMENT_BYTES = 16384  # 128 KB of flash in total
+SPOOL_BATCH_BYTES = 16384  # per drain upload
+SPOOL_BATCH_UPLOADS = 50  # backend accepts up to 100
+SPOOL_HEADER = ">III"  # body length, boot id, ticks_ms when spooled
+SPOOL_HEADER_SIZE = 12
+
+# Uploads carry (boot, seq) so the backend can drop replays it already stored
+# (30 bits keeps the id a small int - nothing to allocate when serialising it)
+BOOT_ID = struct.unpack(">I", os.urandom(4))[0] & 0x3FFFFFFF
+
+# Uploads are serialised into preallocated buffers
+PAYLOAD_BUFFER_SIZE = 24576  # a full 512-sample ring plus the other fields
+PAYLOAD_RESERVE = 512  # kept free after the IMU rows for the closing fields / spool wrapper
+IMU_ROW_MAX_BYTES = 45  # "[-32768,...]," - six int16s
+DECIMAL_SCALES = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+MEAN_KEYS = (b',"accel_x":', b',"accel_y":', b',"accel_z":', b',"gyro_x":', b',"gyro_y":', b',"gyro_z":')
+
+# Print every upload and its response - formatting them allocates
+DEBUG = False
+
+# MPU6050 conversions (ranges programmed in MPU6050.__init__)
+ACCEL_SCALE = 8.0 * 9.81 / 32768.0  # ±8g, 16-bit ADC → m/s²
+GYRO_SCALE = 500.0 * 3.14159 / (180.0 * 32768.0)  # ±500°/s, 16-bit ADC → rad/s
+
+# Window features work on raw counts shifted down so every sum stays a small int
+ACCEL_SHIFT = 3
+GYRO_SHIFT = 5
+MAG_SCALE = ACCEL_SCALE * (1 << ACCEL_SHIFT)  # shifted magnitude count → m/s²
+GYRO_ENERGY_SCALE = (GYRO_SCALE * (1 << GYRO_SHIFT)) ** 2
 
 class MPU6050:
-    """Simple MPU6050 driver for MicroPython"""
+    """MPU6050 driver for MicroPython - the sensor samples into its FIFO, we drain it in bulk"""
     
     def __init__(self, i2c, addr=0x68):
         self.i2c = i2c
         self.addr = addr
+        self.reg = bytearray(2)
+        self.reg_byte = memoryview(self.reg)[:1]
         # Wake up the MPU6050
         self.i2c.writeto_mem(self.addr, 0x6B, bytes([0]))
         time.sleep(0.1)
+        # Enable the digital low-pass filter (gyro output rate becomes 1kHz)
+        self.i2c.writeto_mem(self.addr, 0x1A, bytes([1]))
+        # Program the full-scale ranges the conversions below assume -
+        # power-on default is ±2g / ±250°/s
+        self.i2c.writeto_mem(self.addr, 0x1C, bytes([0x10]))  # ACCEL_CONFIG: ±8g
+        self.i2c.writeto_mem(self.addr, 0x1B, bytes([0x08]))  # GYRO_CONFIG: ±500°/s
+        # Latch FIFO overflow in INT_STATUS (no interrupt pin needed)
+        self.i2c.writeto_mem(self.addr, 0x38, bytes([0x10]))
+        self.set_sample_rate(SAMPLE_RATE_HZ)
+        self.start_fifo()
+    
+    def set_sample_rate(self, rate_hz):
+        """Set sample rate via SMPLRT_DIV (rate = 1kHz / (1 + divider))"""
+        divider = max(0, min(255, int(1000 / max(4, rate_hz)) - 1))
+        self.i2c.writeto_mem(self.addr, 0x19, bytes([divider]))
+    
+    def start_fifo(self):
+        """Reset the FIFO and queue accel + gyro (12-byte frames) at the sample rate"""
+        self.i2c.writeto_mem(self.addr, 0x6A, bytes([0x04]))  # USER_CTRL: FIFO_RESET
+        self.i2c.writeto_mem(self.addr, 0x23, bytes([0x78]))  # FIFO_EN: XG, YG, ZG, ACCEL
+        self.i2c.writeto_mem(self.addr, 0x6A, bytes([0x40]))  # USER_CTRL: FIFO_EN
+    
+    def fifo_overflowed(self):
+        """INT_STATUS FIFO_OFLOW bit - cleared by the read"""
+        self.i2c.readfrom_mem_into(self.addr, 0x3A, self.reg_byte)
+        return bool(self.reg[0] & 0x10)
+    
+    def fifo_frames(self):
+        """Whole accel + gyro frames waiting in the FIFO (FIFO_COUNT_H/L)"""
+        self.i2c.readfrom_mem_into(self.addr, 0x72, self.reg)
+        return ((self.reg[0] << 8) | self.reg[1]) // FIFO_FRAME
+    
+    def drain_fifo(self, ring):
+        """
+        Move every complete frame from the FIFO into the ring with burst reads of
+        FIFO_R_W, straight into the ring's storage - nothing is allocated per sample
+        Returns the number of frames moved
+        """
+        if self.fifo_overflowed():
+            # Frame alignment is lost once the 1024-byte FIFO wraps - start clean
+            self.start_fifo()
+            ring.dropped += FIFO_SIZE // FIFO_FRAME
+            return 0
         
-    def read_raw_data(self, addr):
-        """Read raw 16-bit data from MPU6050"""
-        high = self.i2c.readfrom_mem(self.addr, addr, 1)[0]
-        low = self.i2c.readfrom_mem(self.addr, addr + 1, 1)[0]
-        value = (high << 8) | low
-        if value >= 32768:
-            value = value - 65536
-        return value
-    
-    def get_accel_data(self):
-        """Get accelerometer data in m/s²"""
-        accel_x = self.read_raw_data(0x3B)
-        accel_y = self.read_raw_data(0x3D)
-        accel_z = self.read_raw_data(0x3F)
-        
-        # Convert to m/s² (±8g range, 16-bit ADC)
-        accel_scale = 8.0 * 9.81 / 32768.0
-        return {
-            'x': accel_x * accel_scale,
-            'y': accel_y * accel_scale,
-            'z': accel_z * accel_scale
-        }
-    
-    def get_gyro_data(self):
-        """Get gyroscope data in rad/s"""
-        gyro_x = self.read_raw_data(0x43)
-        gyro_y = self.read_raw_data(0x45)
-        gyro_z = self.read_raw_data(0x47)
-        
-        # Convert to rad/s (±500°/s range, 16-bit ADC)
-        gyro_scale = 500.0 * 3.14159 / (180.0 * 32768.0)
-        return {
-            'x': gyro_x * gyro_scale,
-            'y': gyro_y * gyro_scale,
-            'z': gyro_z * gyro_scale
-        }
-    
-    def get_temp_data(self):
-        """Get temperature data in Celsius"""
-        temp_raw = self.read_raw_data(0x41)
-        # Convert to Celsius
-        temp_c = (temp_raw / 340.0) + 36.53
-        return temp_c
+        frames = self.fifo_frames()
+        moved = 0
+        while moved < frames:
+            count = min(frames - moved, FIFO_BURST_FRAMES, ring.contiguous_free())
+            start = ring.write_index * FIFO_FRAME
+            self.i2c.readfrom_mem_into(self.addr, 0x74, ring.view[start:start + count * FIFO_FRAME])
+            ring.commit(count)
+            moved += count
+        return moved
+    
+    def read_temperature(self):
+        """Die temperature in °C (TEMP_OUT_H/L)"""
+        self.i2c.readfrom_mem_into(self.addr, 0x41, self.reg)
+        return struct.unpack_from(">h", self.reg)[0] / 340.0 + 36.53
+
+class SampleRing:
+    """
+    Fixed-size ring of raw FIFO frames (ax, ay, az, gx, gy, gz as big-endian int16)
+    When the uploader falls behind the oldest frames are overwritten
+    """
+    
+    def __init__(self, capacity=RING_SAMPLES):
+        self.capacity = capacity
+        self.data = bytearray(capacity * FIFO_FRAME)
+        self.view = memoryview(self.data)
+        self.write_index = 0
+        self.count = 0
+        self.dropped = 0
+    
+    def contiguous_free(self):
+        """Frames that fit before the write position wraps"""
+        return self.capacity - self.write_index
+    
+    def commit(self, frames):
+        """Account for frames just written at write_index"""
+        self.write_index = (self.write_index + frames) % self.capacity
+        overwritten = max(0, self.count + frames - self.capacity)
+        self.dropped += overwritten
+        self.count = min(self.capacity, self.count + frames)
+    
+    def clear(self):
+        self.count = 0
+        self.dropped = 0
+
+class WindowFeatures:
+    """
+    Per-upload window features from incremental accumulators - each FIFO frame
+    is folded in straight from the ring's raw counts as it is drained, so no
+    window arrays are kept. Everything per sample is small-int arithmetic (no
+    float objects on the heap); values are scaled to SI units once per upload
+    """
+    
+    def __init__(self):
+        self.sums = [0] * 6  # raw ax, ay, az, gx, gy, gz
+        self.step_counts = int(STEP_THRESHOLD / MAG_SCALE)
+        self.reset()
+    
+    def reset(self):
+        self.n = 0
+        for axis in range(6):
+            self.sums[axis] = 0
+        # Magnitude deviations from the window's first magnitude keep the sums small
+        self.mag_ref = 0
+        self.dev_sum = 0
+        self.dev_sq_sum = 0
+        self.last_mag = 0
+        self.peak_step = 0  # largest sample-to-sample magnitude change
+        self.gyro_energy = 0
+        self.accel_x_min = 0
+        self.accel_x_max = 0
+        self.steps = 0
+        self.above = False
+    
+    @micropython.native
+    def add_frames(self, ring, frames):
+        """Fold the newest `frames` raw ring frames into the window"""
+        data = ring.data
+        sums = self.sums
+        for index in range(ring.write_index - frames, ring.write_index):
+            offset = (index % ring.capacity) * FIFO_FRAME
+            mag_sq = 0
+            gyro_sq = 0
+            for axis in range(6):
+                value = data[offset] << 8 | data[offset + 1]
+                if value > 32767:
+                    value -= 65536
+                offset += 2
+                sums[axis] += value
+                if axis == 0:
+                    accel_x = value
+                if axis < 3:
+                    value >>= ACCEL_SHIFT
+                    mag_sq += value * value
+                else:
+                    value >>= GYRO_SHIFT
+                    gyro_sq += value * value
+            
+            mag = isqrt(mag_sq, self.last_mag or 1)
+            self.n += 1
+            if self.n == 1:
+                self.mag_ref = mag
+                self.accel_x_min = self.accel_x_max = accel_x
+            else:
+                self.peak_step = max(self.peak_step, abs(mag - self.last_mag))
+                self.accel_x_min = min(self.accel_x_min, accel_x)
+                self.accel_x_max = max(self.accel_x_max, accel_x)
+            self.last_mag = mag
+            deviation = mag - self.mag_ref
+            self.dev_sum += deviation
+            self.dev_sq_sum += deviation * deviation
+            self.gyro_energy += gyro_sq
+            
+            # Steps = upward crossings of the running mean, with hysteresis
+            mean = self.mag_ref + self.dev_sum // self.n
+            if not self.above and mag > mean + self.step_counts:
+                self.above = True
+                self.steps += 1
+            elif self.above and mag < mean:
+                self.above = False
+    
+    def write(self, writer, rate_hz):
+        """Serialise the window's features as a JSON object"""
+        n = max(1, self.n)
+        mean_dev = self.dev_sum / n
+        ax, ay, az = self.sums[0], self.sums[1], self.sums[2]
+        writer.raw(b'{"n":')
+        writer.int_(self.n)
+        writer.raw(b',"accel_mag_mean":')
+        writer.fixed((self.mag_ref + mean_dev) * MAG_SCALE, 3)
+        writer.raw(b',"accel_mag_var":')
+        writer.fixed((self.dev_sq_sum / n - mean_dev * mean_dev) * MAG_SCALE * MAG_SCALE, 3)
+        writer.raw(b',"peak_jerk":')
+        writer.fixed(self.peak_step * MAG_SCALE * rate_hz, 1)
+        writer.raw(b',"gyro_energy":')
+        writer.fixed(self.gyro_energy / n * GYRO_ENERGY_SCALE, 4)
+        writer.raw(b',"pitch":')
+        writer.fixed(math.degrees(math.atan2(-ax, math.sqrt(ay * ay + az * az))), 1)
+        writer.raw(b',"roll":')
+        writer.fixed(math.degrees(math.atan2(ay, az)), 1)
+        writer.raw(b',"step_hz":')
+        writer.fixed(self.steps * rate_hz / n, 2)
+        writer.raw(b',"accel_x_min":')
+        writer.fixed(self.accel_x_min * ACCEL_SCALE, 3)
+        writer.raw(b',"accel_x_max":')
+        writer.fixed(self.accel_x_max * ACCEL_SCALE, 3)
+        writer.raw(b"}")
+    
+    def write_means(self, writer):
+        """Serialise the window mean of every axis as reading fields"""
+        n = max(1, self.n)
+        for axis in range(6):
+            writer.raw(MEAN_KEYS[axis])
+            writer.fixed(self.sums[axis] / n * (ACCEL_SCALE if axis < 3 else GYRO_SCALE), 3)
+
+def isqrt(value, guess):
+    """
+    Integer square root by Newton's method - seeded with the previous
+    magnitude it settles in a step or two
+    """
+    if value <= 0:
+        return 0
+    root = (guess + value // guess) >> 1
+    while True:
+        better = (root + value // root) >> 1
+        if better >= root:
+            return root
+        root = better
+
+class DeviceClock:
+    """
+    Epoch time from SNTP plus ticks_ms - a sync pins the epoch ms at one tick
+    value, and every upload carries that base, the ms since it and an error
+    bound, so the backend stamps samples with device time instead of arrival
+    """
+    
+    def __init__(self):
+        self.addr = None
+        self.packet = bytearray(48)
+        self.base_ms = None  # epoch ms at base_ticks
+        self.base_digits = None  # base_ms is no small int - formatted once per sync
+        self.base_ticks = 0
+        self.error_ms = 0  # half the round trip of the last sync
+    
+    async def sync(self):
+        """One SNTP exchange, polled without blocking the other tasks - True when the clock was set"""
+        if self.addr is None:
+            self.addr = socket.getaddrinfo(NTP_HOST, NTP_PORT, 0, socket.SOCK_DGRAM)[0][-1]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            packet = self.packet
+            for index in range(48):
+                packet[index] = 0
+            packet[0] = 0x1B  # LI 0, version 3, client mode
+            sent = time.ticks_ms()
+            sock.sendto(packet, self.addr)
+            while True:
+                try:
+                    reply = sock.recv(48)
+                    break
+                except OSError:
+                    if time.ticks_diff(time.ticks_ms(), sent) > NTP_TIMEOUT_MS:
+                        print("NTP sync timed out")
+                        return False
+                    await asyncio.sleep_ms(10)
+            received = time.ticks_ms()
+        finally:
+            sock.close()
+        
+        # Server mode, not a kiss-of-death (stratum 0)
+        if len(reply) < 48 or reply[0] & 0x07 != 4 or not reply[1]:
+            print("NTP reply rejected")
+            return False
+        rx_s, rx_f, tx_s, tx_f = struct.unpack_from(">IIII", reply, 32)
+        server_rx = (rx_s - NTP_EPOCH_OFFSET_S) * 1000 + (rx_f * 1000 >> 32)
+        server_tx = (tx_s - NTP_EPOCH_OFFSET_S) * 1000 + (tx_f * 1000 >> 32)
+        round_trip = max(0, time.ticks_diff(received, sent) - (server_tx - server_rx))
+        self.base_ms = server_tx + round_trip // 2
+        self.base_digits = str(self.base_ms).encode()
+        self.base_ticks = received
+        self.error_ms = round_trip // 2 + 1
+        print(f"Clock synced (±{self.error_ms} ms)")
+        return True
+    
+    def write(self, writer, now):
+        """Clock fields for an upload built at ticks `now` - none before a sync or once it is too old"""
+        if self.base_ms is None:
+            return
+        elapsed = time.ticks_diff(now, self.base_ticks)
+        if not 0 <= elapsed < CLOCK_MAX_AGE_MS:
+            return
+        writer.raw(b',"clock_base_ms":')
+        writer.raw(self.base_digits)
+        writer.raw(b',"clock_ms":')
+        writer.int_(elapsed)
+        writer.raw(b',"clock_error_ms":')
+        writer.int_(self.error_ms + elapsed // CLOCK_DRIFT_MS_PER)
 
 def connect_wifi():
     """Connect to WiFi network"""
@@ -140,8 +468,434 @@ def initialize_sensors():
         print(f"Error initializing sensors: {e}")
         return None
 
-def send_sensor_data(mpu):
-    """Read sensors and send data to backend"""
+def format_int(buf, pos, value):
+    """Write an integer's ASCII digits into buf at pos - returns the position after them"""
+    if value < 0:
+        buf[pos] = 45  # '-'
+        pos += 1
+        value = -value
+    start = pos
+    while True:
+        buf[pos] = 48 + value % 10
+        pos += 1
+        value //= 10
+        if not value:
+            break
+    end = pos - 1
+    while start < end:
+        buf[start], buf[end] = buf[end], buf[start]
+        start += 1
+        end -= 1
+    return pos
+
+class PayloadWriter:
+    """
+    Serialises uploads into one reusable buffer from fixed key templates -
+    no payload dict, no json.dumps string and no per-upload bytes object
+    """
+    
+    def __init__(self, size=PAYLOAD_BUFFER_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.pos = 0
+    
+    def reset(self):
+        self.pos = 0
+    
+    def room(self):
+        return len(self.buf) - self.pos
+    
+    def body(self):
+        """What has been written, as a view into the buffer"""
+        return self.view[:self.pos]
+    
+    def raw(self, data):
+        end = self.pos + len(data)
+        self.view[self.pos:end] = data
+        self.pos = end
+    
+    def int_(self, value):
+        self.pos = format_int(self.buf, self.pos, value)
+    
+    def fixed(self, value, decimals):
+        """A number with a fixed count of decimals, null for None"""
+        if value is None:
+            self.raw(b"null")
+            return
+        scale = DECIMAL_SCALES[decimals]
+        scaled = int(round(value * scale))
+        if scaled < 0:
+            self.buf[self.pos] = 45  # '-'
+            self.pos += 1
+            scaled = -scaled
+        self.int_(scaled // scale)
+        if decimals:
+            buf = self.buf
+            pos = self.pos
+            buf[pos] = 46  # '.'
+            pos += 1
+            fraction = scaled % scale
+            divisor = scale // 10
+            while divisor:
+                buf[pos] = 48 + fraction // divisor % 10
+                pos += 1
+                divisor //= 10
+            self.pos = pos
+    
+    @micropython.native
+    def imu_rows(self, ring):
+        """
+        Buffered ring frames as [[ax, ay, az, gx, gy, gz], ...] raw counts, oldest
+        first. If they do not all fit the oldest are left out, so the last row
+        stays the newest sample
+        """
+        buf = self.buf
+        data = ring.data
+        fit = (self.room() - PAYLOAD_RESERVE) // IMU_ROW_MAX_BYTES
+        count = min(ring.count, max(0, fit))
+        pos = self.pos
+        buf[pos] = 91  # '['
+        pos += 1
+        for index in range(ring.write_index - count, ring.write_index):
+            if pos > self.pos + 1:
+                buf[pos] = 44  # ','
+                pos += 1
+            buf[pos] = 91
+            pos += 1
+            offset = (index % ring.capacity) * FIFO_FRAME
+            for axis in range(6):
+                value = data[offset] << 8 | data[offset + 1]
+                if value > 32767:
+                    value -= 65536
+                offset += 2
+                if axis:
+                    buf[pos] = 44
+                    pos += 1
+                pos = format_int(buf, pos, value)
+            buf[pos] = 93  # ']'
+            pos += 1
+        buf[pos] = 93
+        self.pos = pos + 1
+
+class BoundedQueue:
+    """
+    Fixed-capacity FIFO between tasks (MicroPython's asyncio has no Queue) -
+    the slots are preallocated and put_nowait refuses rather than grows
+    """
+    
+    def __init__(self, capacity):
+        self.items = [None] * capacity
+        self.head = 0
+        self.count = 0
+        self.nonempty = asyncio.Event()
+    
+    def empty(self):
+        return not self.count
+    
+    def put_nowait(self, item):
+        """Append item - False when the queue is full"""
+        if self.count == len(self.items):
+            return False
+        self.items[(self.head + self.count) % len(self.items)] = item
+        self.count += 1
+        self.nonempty.set()
+        return True
+    
+    def get_nowait(self):
+        """Oldest item, None when the queue is empty"""
+        if not self.count:
+            return None
+        item = self.items[self.head]
+        self.items[self.head] = None
+        self.head = (self.head + 1) % len(self.items)
+        self.count -= 1
+        return item
+    
+    async def get(self):
+        while not self.count:
+            self.nonempty.clear()
+            await self.nonempty.wait()
+        return self.get_nowait()
+
+class Uploader:
+    """
+    One long-lived HTTP/1.1 keep-alive connection to the backend - the TCP and
+    TLS handshakes happen once, not per upload. A dropped connection is
+    reopened on the next upload, with exponential backoff while it keeps failing
+    """
+    
+    def __init__(self, url):
+        scheme, _, host, path = url.split("/", 3)
+        self.tls = scheme == "https:"
+        self.host, _, port = host.partition(":")
+        self.port = int(port) if port else (443 if self.tls else 80)
+        self.head = ("POST /%s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n"
+                     "Connection: keep-alive\r\nContent-Length: " % (path, host)).encode()
+        self.length_buf = bytearray(12)
+        self.length_view = memoryview(self.length_buf)
+        self.ssl_context = None
+        if self.tls:
+            # No CA bundle on the device - the link is encrypted, the server is not verified
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.reader = None
+        self.writer = None
+        self.failures = 0
+        self.retry_at = time.ticks_ms()
+    
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), UPLOAD_TIMEOUT_S)
+        print(f"Connected to {self.host}:{self.port}")
+    
+    def close(self):
+        if self.writer:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+            self.reader = self.writer = None
+    
+    async def exchange(self, body):
+        """Write the request and read the response on the open connection"""
+        self.writer.write(self.head)
+        self.writer.write(self.length_view[:format_int(self.length_buf, 0, len(body))])
+        self.writer.write(b"\r\n\r\n")
+        self.writer.write(body)
+        await self.writer.drain()
+        return await self.read_response()
+    
+    async def read_response(self):
+        """Status line, headers and a Content-Length body from the open connection"""
+        status = int((await self.reader.readline()).split(None, 2)[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise OSError("connection closed mid-response")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode().partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                keep_alive = False
+        body = await self.reader.readexactly(length) if length else b""
+        if not keep_alive:
+            self.close()
+        return status, body
+    
+    async def post(self, body):
+        """
+        POST a serialised JSON body (bytes or a buffer view) - returns (status, body bytes), or None
+        while backing off or when the upload failed. Other tasks run while it waits
+        """
+        if time.ticks_diff(self.retry_at, time.ticks_ms()) > 0:
+            return None
+        
+        # A reused socket may have been closed by the server while idle -
+        # that first failure retries once on a fresh connection
+        for attempt in range(2):
+            reused = self.writer is not None
+            try:
+                if not reused:
+                    await self.connect()
+                response = await asyncio.wait_for(self.exchange(body), UPLOAD_TIMEOUT_S)
+                self.failures = 0
+                return response
+            except Exception as e:
+                self.close()
+                if not reused:
+                    print(f"Upload connection failed: {e}")
+                    break
+        
+        self.failures += 1
+        backoff = min(MAX_RECONNECT_BACKOFF_MS, RECONNECT_BACKOFF_MS << min(self.failures - 1, 6))
+        self.retry_at = time.ticks_add(time.ticks_ms(), backoff)
+        print(f"Retrying connection in {backoff} ms")
+        return None
+
+class FlashSpool:
+    """
+    Store-and-forward queue in flash for uploads that could not be sent.
+    Records (length, boot id, ticks, JSON body) are appended to numbered
+    segment files - a full segment starts the next one, and past
+    SPOOL_SEGMENTS the oldest is deleted, so writes rotate across the flash
+    instead of rewriting one block. Drains oldest-first in large batches
+    """
+    
+    def __init__(self):
+        try:
+            os.mkdir(SPOOL_DIR)
+        except OSError:
+            pass  # already exists
+        self.segments = sorted(int(name[3:-4]) for name in os.listdir(SPOOL_DIR)
+                               if name.startswith("seg") and name.endswith(".bin"))
+        # Position in the oldest segment - lost on reboot, the backend dedupes the resend
+        self.read_offset = 0
+        self.header = bytearray(SPOOL_HEADER_SIZE)
+        if self.segments:
+            print(f"Spool holds {len(self.segments)} segment(s) from before reboot")
+    
+    def path(self, segment):
+        return "%s/seg%d.bin" % (SPOOL_DIR, segment)
+    
+    def empty(self):
+        return not self.segments
+    
+    def append(self, body):
+        """Queue one serialised upload"""
+        if not self.segments or os.stat(self.path(self.segments[-1]))[6] >= SPOOL_SEGMENT_BYTES:
+            self.segments.append(self.segments[-1] + 1 if self.segments else 0)
+            if len(self.segments) > SPOOL_SEGMENTS:
+                os.remove(self.path(self.segments.pop(0)))
+                self.read_offset = 0
+                print("Spool full - dropped the oldest segment")
+        
+        struct.pack_into(SPOOL_HEADER, self.header, 0, len(body), BOOT_ID, time.ticks_ms())
+        with open(self.path(self.segments[-1]), "ab") as f:
+            f.write(self.header)
+            f.write(body)
+    
+    async def drain(self, writer, send):
+        """
+        Send up to SPOOL_BATCH_BYTES of the oldest uploads as one
+        {"spool": [{"delay_ms": ..., "upload": {...}}, ...]} body, assembled in
+        the writer's buffer. Returns True once they are delivered (and dropped)
+        """
+        if not self.segments:
+            return False
+        
+        path = self.path(self.segments[0])
+        size = os.stat(path)[6]
+        offset = self.read_offset
+        now = time.ticks_ms()
+        uploads = 0
+        writer.reset()
+        writer.raw(b'{"spool":[')
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while offset < size and writer.pos < SPOOL_BATCH_BYTES and uploads < SPOOL_BATCH_UPLOADS:
+                if f.readinto(self.header) != SPOOL_HEADER_SIZE:
+                    offset = size  # torn header from a power loss - skip the tail
+                    break
+                length, boot, ticks = struct.unpack(SPOOL_HEADER, self.header)
+                if length + 64 > writer.room():
+                    if uploads:
+                        break  # next batch
+                    offset += SPOOL_HEADER_SIZE + length  # can never be sent
+                    continue
+                
+                mark = writer.pos
+                if uploads:
+                    writer.raw(b",")
+                writer.raw(b'{"delay_ms":')
+                # Ticks do not survive a reboot - older records cannot say how long they waited
+                if boot == BOOT_ID:
+                    writer.int_(time.ticks_diff(now, ticks))
+                else:
+                    writer.raw(b"null")
+                writer.raw(b',"upload":')
+                if f.readinto(writer.view[writer.pos:writer.pos + length]) != length:
+                    writer.pos = mark
+                    offset = size  # torn record
+                    break
+                writer.pos += length
+                writer.raw(b"}")
+                offset += SPOOL_HEADER_SIZE + length
+                uploads += 1
+        
+        if uploads:
+            writer.raw(b"]}")
+            if not await send(writer.body()):
+                return False
+        
+        if offset >= size:
+            os.remove(path)
+            self.segments.pop(0)
+            self.read_offset = 0
+        else:
+            self.read_offset = offset
+        return True
+
+# Active sampling control (updated from backend responses)
+control = {
+    "send_interval_ms": SEND_INTERVAL,
+    "sample_rate_hz": SAMPLE_RATE_HZ,
+    "upload_mode": UPLOAD_MODE
+}
+
+def apply_control(new_control, mpu, ring, features):
+    """Apply a control block from the backend, clamped to safe bounds"""
+    try:
+        interval = int(new_control.get("send_interval_ms", control["send_interval_ms"]))
+        rate = int(new_control.get("sample_rate_hz", control["sample_rate_hz"]))
+        mode = new_control.get("upload_mode", control["upload_mode"])
+        if mode in ("raw", "features", "both"):
+            control["upload_mode"] = mode
+        
+        control["send_interval_ms"] = max(MIN_SEND_INTERVAL, min(MAX_SEND_INTERVAL, interval))
+        
+        rate = max(MIN_SAMPLE_RATE_HZ, min(MAX_SAMPLE_RATE_HZ, rate))
+        if rate != control["sample_rate_hz"]:
+            mpu.set_sample_rate(rate)
+            # Frames already queued were taken at the old rate - restart the FIFO
+            mpu.start_fifo()
+            ring.clear()
+            features.reset()
+            control["sample_rate_hz"] = rate
+    except Exception as e:
+        print(f"Invalid control block: {e}")
+
+def write_payload(writer, mpu, ring, features, clock, drained_at, seq):
+    """
+    Serialise the upload for the current window into writer, by control["upload_mode"]:
+    - raw/both: compact batch of every buffered FIFO sample - raw counts plus
+      the scales to convert them; the backend spaces timestamps by 1/rate_hz
+      back from age_ms, measured from the device clock's time for the upload
+    - features/both: the window's features; features-only sends one reading
+      of window means instead of the samples
+    Returns the body as a view into the writer's buffer
+    """
+    rate_hz = control["sample_rate_hz"]
+    mode = control["upload_mode"]
+    now = time.ticks_ms()
+    writer.reset()
+    writer.raw(b'{"boot":')
+    writer.int_(BOOT_ID)
+    writer.raw(b',"seq":')
+    writer.int_(seq)
+    clock.write(writer, now)
+    # MPU6050 Data
+    writer.raw(b',"age_ms":')
+    writer.int_(time.ticks_diff(now, drained_at))
+    writer.raw(b',"temperature":')
+    writer.fixed(mpu.read_temperature(), 2)
+    if mode != "raw":
+        writer.raw(b',"features":')
+        features.write(writer, rate_hz)
+    if mode == "features":
+        features.write_means(writer)
+    else:
+        writer.raw(b',"rate_hz":')
+        writer.int_(rate_hz)
+        writer.raw(b',"accel_scale":')
+        writer.fixed(ACCEL_SCALE, 9)
+        writer.raw(b',"gyro_scale":')
+        writer.fixed(GYRO_SCALE, 9)
+        # Last, so it can use the rest of the buffer
+        writer.raw(b',"imu":')
+        writer.imu_rows(ring)
+    writer.raw(b"}")
+    return writer.body()
+
+async def send_sensor_data(uploader, body, mpu, ring, features):
+    """
+    POST one serialised upload and apply the returned control block
+    Returns False when it did not reach the backend and should be spooled
+    """
     try:
         # Check WiFi connection
         wlan = network.WLAN(network.STA_IF)
@@ -149,46 +903,131 @@ def send_sensor_data(mpu):
             print("WiFi not connected!")
             return False
         
-        # Read sensor data
-        accel_data = mpu.get_accel_data()
-        gyro_data = mpu.get_gyro_data()
-        temp_data = mpu.get_temp_data()
-        
-        # Prepare JSON payload
-        payload = {
-            "accel_x": round(accel_data['x'], 3),
-            "accel_y": round(accel_data['y'], 3),
-            "accel_z": round(accel_data['z'], 3),
-            "gyro_x": round(gyro_data['x'], 3),
-            "gyro_y": round(gyro_data['y'], 3),
-            "gyro_z": round(gyro_data['z'], 3),
-            "temperature": round(temp_data, 2)
-        }
-        
-        print("Sending data:")
-        print(json.dumps(payload))
-        
-        # Send HTTP POST request
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(API_URL, json=payload, headers=headers, timeout=5)
-        
-        print(f"HTTP Response: {response.status_code}")
-        if response.status_code == 200 or response.status_code == 201:
-            print("Data sent successfully!")
-            print(response.text)
-        else:
-            print(f"HTTP Error: {response.status_code}")
-            print(response.text)
+        response = await uploader.post(body)
+        if response is None:
+            return False
         
-        response.close()
-        return True
+        status, body = response
+        if status == 200 or status == 201:
+            if DEBUG:
+                print(f"HTTP Response: {status}")
+                print(body)
+            
+            result = json.loads(body)
+            if result.get("control"):
+                apply_control(result["control"], mpu, ring, features)
+            return True
+        
+        print(f"HTTP Error: {status}")
+        print(body)
+        # A rejected upload would be rejected again - only server errors are kept
+        return status < 500
         
     except Exception as e:
         print(f"Error sending data: {e}")
         return False
 
+async def sampler_task(mpu, ring, features, clock, free, outbox):
+    """
+    Drain the MPU6050 FIFO every IMU_DRAIN_MS on a fixed schedule and, every
+    send interval, serialise the window into a free payload buffer for the
+    uploader. The MPU6050 times the samples itself, so a slow upload never
+    shifts them - while both buffers are queued the window keeps growing
+    """
+    seq = 0
+    drained_at = last_send_time = next_drain = time.ticks_ms()
+    while True:
+        current_time = time.ticks_ms()
+        
+        # The MPU6050 samples into its FIFO at sample_rate_hz - drain it before it wraps
+        moved = mpu.drain_fifo(ring)
+        if moved:
+            drained_at = current_time
+            features.add_frames(ring, moved)
+        
+        # Cut the window every send interval (set by the backend)
+        if (time.ticks_diff(current_time, last_send_time) >= control["send_interval_ms"]
+                and ring.count and not free.empty()):
+            last_send_time = current_time
+            
+            if ring.dropped:
+                print(f"Dropped {ring.dropped} samples (FIFO or ring overflow)")
+            if DEBUG:
+                print(f"Sending {control['upload_mode']} window of {features.n} reading(s) at {control['sample_rate_hz']} Hz")
+            seq += 1
+            writer = free.get_nowait()
+            write_payload(writer, mpu, ring, features, clock, drained_at, seq)
+            ring.clear()
+            features.reset()
+            outbox.put_nowait(writer)
+        
+        # After a slow cycle carry on from now instead of bursting to catch up
+        next_drain = time.ticks_add(next_drain, IMU_DRAIN_MS)
+        delay = time.ticks_diff(next_drain, time.ticks_ms())
+        if delay < 0:
+            next_drain = time.ticks_ms()
+            delay = 0
+        await asyncio.sleep_ms(delay)
+
+async def clock_task(clock):
+    """SNTP sync at boot, then every NTP_SYNC_INTERVAL_MS - retried sooner after a failure"""
+    while True:
+        try:
+            synced = await clock.sync()
+        except Exception as e:
+            print(f"NTP sync failed: {e}")
+            synced = False
+        await asyncio.sleep_ms(NTP_SYNC_INTERVAL_MS if synced else NTP_RETRY_MS)
+
+async def upload_task(uploader, spool, mpu, ring, features, free, outbox):
+    """
+    Send the queued windows and hand their buffers back to the sampler. While
+    older uploads are spooled new ones queue behind them, so the backend
+    always receives readings in order
+    """
+    heap_mark = gc.mem_alloc() if DEBUG else 0
+    while True:
+        writer = await outbox.get()
+        body = writer.body()
+        if spool.empty() and await send_sensor_data(uploader, body, mpu, ring, features):
+            success = True
+        else:
+            spool.append(body)
+            success = await spool.drain(writer, lambda batch: send_sensor_data(uploader, batch, mpu, ring, features))
+        body = None
+        free.put_nowait(writer)
+        
+        if DEBUG:
+            # Negative when a collection ran during the cycle
+            print(f"Sent: {success}, heap allocated this cycle: {gc.mem_alloc() - heap_mark} bytes, "
+                  f"free: {gc.mem_free()} bytes")
+            print(f"Next send in {control['send_interval_ms']} ms at {control['sample_rate_hz']} Hz")
+            heap_mark = gc.mem_alloc()
+
+async def run(mpu):
+    """Sampler, clock and uploader tasks - sampler and uploader linked by bounded queues of payload buffers"""
+    uploader = Uploader(API_URL)
+    spool = FlashSpool()
+    ring = SampleRing()
+    features = WindowFeatures()
+    clock = DeviceClock()
+    free = BoundedQueue(UPLOAD_BUFFERS)
+    outbox = BoundedQueue(UPLOAD_BUFFERS)
+    for _ in range(UPLOAD_BUFFERS):
+        free.put_nowait(PayloadWriter())
+    
+    # Everything the tasks need is allocated above - start them with a clean heap
+    gc.collect()
+    try:
+        await asyncio.gather(sampler_task(mpu, ring, features, clock, free, outbox),
+                             clock_task(clock),
+                             upload_task(uploader, spool, mpu, ring, features, free, outbox))
+    finally:
+        print("Cleaning up...")
+        uploader.close()
+
 def main():
-    """Main execution loop"""
+    """Connect, then run the sensor tasks"""
     print("=" * 40)
     print("ESP32 Leg Sensor Starting...")
     print("=" * 40)
@@ -207,33 +1046,12 @@ def main():
     print("System ready!")
     print("=" * 40)
     
-    last_send_time = 0
-    
     try:
-        while True:
-            current_time = time.ticks_ms()
-            
-            # Send data every 2 seconds
-            if time.ticks_diff(current_time, last_send_time) >= SEND_INTERVAL:
-                last_send_time = current_time
-                
-                success = send_sensor_data(mpu)
-                
-                # Force garbage collection to free memory
-                gc.collect()
-                
-                if success:
-                    print(f"Free memory: {gc.mem_free()} bytes")
-                
-            # Small delay to prevent watchdog timeout
-            time.sleep(0.1)
-            
+        asyncio.run(run(mpu))
     except KeyboardInterrupt:
         print("\nProgram stopped by user")
     except Exception as e:
         print(f"Unexpected error: {e}")
-    finally:
-        print("Cleaning up...")
 
 # Auto-run when uploaded to ESP32
 if __name__ == "__main__":
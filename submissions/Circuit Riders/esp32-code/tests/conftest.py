@@ -0,0 +1,165 @@
+"""
+Test setup for the MicroPython firmware
+Stub machine / micropython / network modules are installed before the
+firmware is imported, so its tasks run under CPython's asyncio
+"""
+
+import asyncio
+import importlib.util
+import os
+import struct
+import sys
+import time
+import types
+
+import pytest
+
+FIRMWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Pin:
+    IN = 0
+    IRQ_RISING = 1
+
+    def __init__(self, number, mode=None):
+        self.number = number
+        self.handler = None
+
+    def irq(self, trigger=None, handler=None):
+        self.handler = handler
+
+
+class WLAN:
+    def __init__(self, interface):
+        pass
+
+    def isconnected(self):
+        return True
+
+
+def install_stubs():
+    machine = types.ModuleType("machine")
+    machine.Pin = Pin
+    machine.I2C = machine.UART = object
+    micropython = types.ModuleType("micropython")
+    micropython.native = lambda function: function
+    micropython.schedule = lambda function, arg: function(arg)
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.WLAN = WLAN
+    sys.modules.update(machine=machine, micropython=micropython, network=network)
+
+
+def load_firmware(name):
+    install_stubs()
+    path = os.path.join(FIRMWARE_DIR, f"micropython_{name}_sensor.py")
+    spec = importlib.util.spec_from_file_location(f"{name}_firmware", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeMPU:
+    """
+    Queues frames at the sample rate like the MPU6050 FIFO and records when it
+    was drained - each frame's accel x is its sequence number
+    """
+
+    def __init__(self, rate_hz):
+        self.rate_hz = rate_hz
+        self.started = time.monotonic()
+        self.taken = 0
+        self.drains = []
+
+    def drain_fifo(self, ring):
+        now = time.monotonic()
+        self.drains.append(now)
+        due = int((now - self.started) * self.rate_hz) - self.taken
+        for _ in range(due):
+            start = ring.write_index * 12
+            ring.data[start:start + 12] = (self.taken % 32768).to_bytes(2, "big") + bytes([0, 0, 16, 0]) + bytes(6)
+            ring.commit(1)
+            self.taken += 1
+        return due
+
+    def read_temperature(self):
+        return 25.0
+
+    def set_sample_rate(self, rate_hz):
+        self.rate_hz = rate_hz
+
+    def start_fifo(self):
+        pass
+
+
+class FakeNTP(asyncio.DatagramProtocol):
+    """SNTP server whose clock runs `offset_s` ahead of ours"""
+
+    def __init__(self, offset_s):
+        self.offset_s = offset_s
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def ntp_now(self):
+        seconds = time.time() + self.offset_s + 2208988800
+        return struct.pack(">II", int(seconds), int(seconds % 1 * 2 ** 32))
+
+    def datagram_received(self, data, addr):
+        received = self.ntp_now()
+        reply = bytes([0x24, 2]) + bytes(30) + received + self.ntp_now()
+        self.transport.sendto(reply, addr)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=("127.0.0.1", 0))
+        return self.transport.get_extra_info("sockname")[1]
+
+
+class FakeBackend:
+    """Keep-alive HTTP/1.1 server that answers every POST after `delay` seconds"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.bodies = []
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                self.bodies.append(await reader.readexactly(length))
+                await asyncio.sleep(self.delay)
+                body = b'{"status": "success"}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return "http://127.0.0.1:%d/api" % self.server.sockets[0].getsockname()[1]
+
+
+@pytest.fixture(params=["leg", "chest"])
+def firmware(request, tmp_path, monkeypatch):
+    """Freshly imported firmware with its spool in a temp dir and a fast send interval"""
+    module = load_firmware(request.param)
+    monkeypatch.setattr(module, "SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(module, "NTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(module, "NTP_PORT", 9)  # discard port - the clock stays unsynced
+    module.control["send_interval_ms"] = 200
+    module.control["upload_mode"] = "raw"
+    return module
@@ -0,0 +1,126 @@
+"""Sampler / GPS / clock / uploader tasks under CPython asyncio"""
+
+import asyncio
+import json
+import os
+import time
+from functools import reduce
+
+from conftest import FakeBackend, FakeMPU, FakeNTP, Pin, load_firmware
+
+
+class FakeUART:
+    def __init__(self, data=b""):
+        self.data = bytearray(data)
+
+    def any(self):
+        return len(self.data)
+
+    def readinto(self, buf):
+        count = min(len(buf), len(self.data))
+        buf[:count] = self.data[:count]
+        del self.data[:count]
+        return count
+
+
+def run_args(firmware, mpu):
+    if hasattr(firmware, "SimpleGPS"):
+        return firmware.SimpleGPS(FakeUART()), mpu, firmware.CrashTrigger(Pin(firmware.MOTION_INT_PIN))
+    return (mpu,)
+
+
+async def run_for(firmware, mpu, seconds):
+    try:
+        await asyncio.wait_for(firmware.run(*run_args(firmware, mpu)), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+def max_gap(times):
+    return max(later - earlier for earlier, later in zip(times, times[1:]))
+
+
+def test_sampling_stays_steady_while_uploads_are_slow(firmware):
+    async def scenario():
+        backend = FakeBackend(delay=0.5)
+        firmware.API_URL = await backend.start()
+        mpu = FakeMPU(rate_hz=100)
+        await run_for(firmware, mpu, 2.0)
+        backend.server.close()
+        return backend, mpu
+
+    backend, mpu = asyncio.run(scenario())
+
+    # Uploads take 0.5 s, windows are cut every 0.2 s - the FIFO is still drained on schedule
+    assert max_gap(mpu.drains) < 0.1
+    assert len(mpu.drains) > 60
+
+    uploads = [json.loads(body) for body in backend.bodies]
+    assert len(uploads) >= 3
+    assert [upload["seq"] for upload in uploads] == list(range(1, len(uploads) + 1))
+    # Windows wait for a free buffer instead of being dropped - every sample arrives once, in order
+    sent = [row[0] for upload in uploads for row in upload["imu"]]
+    assert sent == list(range(len(sent)))
+
+
+def test_unreachable_backend_spools_without_stalling_sampling(firmware, tmp_path):
+    firmware.API_URL = "http://127.0.0.1:9/api"  # discard port - nothing listens
+    mpu = FakeMPU(rate_hz=100)
+
+    asyncio.run(run_for(firmware, mpu, 1.0))
+
+    assert max_gap(mpu.drains) < 0.1
+    assert os.listdir(tmp_path / "spool")
+
+
+def test_impact_upload_jumps_the_queue():
+    firmware = load_firmware("chest")
+    queue = firmware.BoundedQueue(2)
+
+    assert queue.put_nowait("window")
+    assert queue.put_nowait("impact", urgent=True)
+    assert not queue.put_nowait("overflow")
+    assert [queue.get_nowait(), queue.get_nowait(), queue.get_nowait()] == ["impact", "window", None]
+
+
+def test_gps_task_parses_the_uart_stream():
+    firmware = load_firmware("chest")
+    sentence = b"GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,"
+    checksum = reduce(lambda acc, byte: acc ^ byte, sentence, 0)
+    uart = FakeUART(b"noise$" + sentence + b"*%02X\r\n" % checksum)
+    gps = firmware.SimpleGPS(uart)
+
+    async def scenario():
+        try:
+            await asyncio.wait_for(firmware.gps_task(gps), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(scenario())
+
+    assert gps.is_valid()
+    assert gps.satellites == 8
+    assert abs(gps.latitude - 48.1173) < 1e-4
+
+
+def clock_fields(firmware, clock):
+    writer = firmware.PayloadWriter()
+    writer.raw(b'{"seq":1')
+    clock.write(writer, time.ticks_ms())
+    writer.raw(b"}")
+    return json.loads(bytes(writer.body()))
+
+
+def test_clock_syncs_over_sntp_and_stamps_uploads(firmware):
+    clock = firmware.DeviceClock()
+    assert clock_fields(firmware, clock) == {"seq": 1}  # unsynced - the backend stamps on arrival
+
+    async def scenario():
+        firmware.NTP_PORT = await FakeNTP(offset_s=1000).start()
+        return await clock.sync()
+
+    assert asyncio.run(scenario())
+    fields = clock_fields(firmware, clock)
+    device_now_ms = fields["clock_base_ms"] + fields["clock_ms"]
+    assert abs(device_now_ms - (time.time() + 1000) * 1000) < 50
+    assert 1 <= fields["clock_error_ms"] < 50
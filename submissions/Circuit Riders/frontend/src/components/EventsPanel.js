@@ -18,6 +18,7 @@ const EventsPanel = ({ events }) => {
       HARSH_ACCEL: '🚀',
       FALL_DETECTED: '⚠️',
       ACCIDENT_ALERT: '🚨',
+      CRASH_CANCELLED: '✅',
       harsh_brake: '🛑',
       harsh_acceleration: '🚀',
       fall_detected: '⚠️',
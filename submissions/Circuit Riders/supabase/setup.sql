@@ -17,7 +17,12 @@ CREATE TABLE IF NOT EXISTS esp32_leg_data (
     gyro_z DOUBLE PRECISION,
     temperature DOUBLE PRECISION,
     
+    -- On-device window features (newest row of each upload)
+    features JSONB,
+    clock_error_ms INTEGER,  -- timestamp error bound from the device clock, NULL when stamped on arrival
+    
     -- Metadata
+    rider_id VARCHAR(50) DEFAULT 'default',
     device_id VARCHAR(50) DEFAULT 'ESP32_LEG',
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -25,6 +30,7 @@ CREATE TABLE IF NOT EXISTS esp32_leg_data (
 -- Index for timestamp queries
 CREATE INDEX idx_esp32_leg_timestamp ON esp32_leg_data(timestamp DESC);
 CREATE INDEX idx_esp32_leg_created ON esp32_leg_data(created_at DESC);
+CREATE INDEX idx_esp32_leg_rider_timestamp ON esp32_leg_data(rider_id, timestamp DESC);
 
 
 -- =============================================
@@ -42,6 +48,7 @@ CREATE TABLE IF NOT EXISTS esp32_chest_data (
     heading DOUBLE PRECISION,
     accuracy DOUBLE PRECISION,
     satellites INTEGER,
+    fix_age_ms INTEGER,  -- how old the position was when sent
     
     -- MPU6050 Data
     accel_x DOUBLE PRECISION,
@@ -52,7 +59,12 @@ CREATE TABLE IF NOT EXISTS esp32_chest_data (
     gyro_z DOUBLE PRECISION,
     temperature DOUBLE PRECISION,
     
+    -- On-device window features (newest row of each upload)
+    features JSONB,
+    clock_error_ms INTEGER,  -- timestamp error bound from the device clock, NULL when stamped on arrival
+    
     -- Metadata
+    rider_id VARCHAR(50) DEFAULT 'default',
     device_id VARCHAR(50) DEFAULT 'ESP32_CHEST',
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -60,6 +72,7 @@ CREATE TABLE IF NOT EXISTS esp32_chest_data (
 -- Index for timestamp queries
 CREATE INDEX idx_esp32_chest_timestamp ON esp32_chest_data(timestamp DESC);
 CREATE INDEX idx_esp32_chest_created ON esp32_chest_data(created_at DESC);
+CREATE INDEX idx_esp32_chest_rider_timestamp ON esp32_chest_data(rider_id, timestamp DESC);
 CREATE INDEX idx_esp32_chest_gps_coords ON esp32_chest_data(latitude, longitude);
 CREATE INDEX idx_esp32_chest_timestamp_gps ON esp32_chest_data(timestamp DESC) WHERE latitude IS NOT NULL;
 
@@ -97,6 +110,7 @@ CREATE TABLE IF NOT EXISTS ride_sessions (
 CREATE TABLE IF NOT EXISTS events (
     id BIGSERIAL PRIMARY KEY,
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    rider_id VARCHAR(50) DEFAULT 'default',
     event_type VARCHAR(50) NOT NULL, -- 'HARSH_BRAKE', 'HARSH_ACCEL', 'FALL_DETECTED', 'ACCIDENT_ALERT'
     severity VARCHAR(20), -- 'LOW', 'MEDIUM', 'HIGH', 'CRITICAL'
     
@@ -124,6 +138,119 @@ CREATE TABLE IF NOT EXISTS events (
 CREATE INDEX idx_events_timestamp ON events(timestamp DESC);
 CREATE INDEX idx_events_type ON events(event_type);
 CREATE INDEX idx_events_severity ON events(severity);
+CREATE INDEX idx_events_rider_timestamp ON events(rider_id, timestamp DESC);
+
+
+-- =============================================
+-- 4a. Event Counters (per rider, type and hour)
+-- =============================================
+-- Maintained by a trigger as events are inserted, so /status reads a few
+-- counter rows instead of counting the events table
+CREATE TABLE IF NOT EXISTS event_counters (
+    rider_id VARCHAR(50) NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL, -- start of the hour
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (rider_id, event_type, bucket_start)
+);
+
+CREATE INDEX idx_event_counters_bucket ON event_counters(bucket_start DESC);
+
+-- All-time totals (one row per rider and type)
+CREATE TABLE IF NOT EXISTS event_totals (
+    rider_id VARCHAR(50) NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (rider_id, event_type)
+);
+
+CREATE OR REPLACE FUNCTION count_event()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO event_counters (rider_id, event_type, bucket_start, count)
+    VALUES (COALESCE(NEW.rider_id, 'default'), NEW.event_type, date_trunc('hour', NEW.timestamp), 1)
+    ON CONFLICT (rider_id, event_type, bucket_start)
+    DO UPDATE SET count = event_counters.count + 1;
+    
+    INSERT INTO event_totals (rider_id, event_type, count)
+    VALUES (COALESCE(NEW.rider_id, 'default'), NEW.event_type, 1)
+    ON CONFLICT (rider_id, event_type)
+    DO UPDATE SET count = event_totals.count + 1;
+    
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS events_count_event ON events;
+CREATE TRIGGER events_count_event
+    AFTER INSERT ON events
+    FOR EACH ROW EXECUTE FUNCTION count_event();
+
+
+-- =============================================
+-- 4b. Riding-Behaviour Scores (per trip and per day)
+-- =============================================
+-- Maintained incrementally by the backend, upserted every 30s and on trip close
+CREATE TABLE IF NOT EXISTS rider_scores (
+    id BIGSERIAL PRIMARY KEY,
+    rider_id VARCHAR(50) NOT NULL DEFAULT 'default',
+    period VARCHAR(10) NOT NULL, -- 'trip' or 'day'
+    period_key VARCHAR(100) NOT NULL, -- trip id or YYYY-MM-DD
+    started_at TIMESTAMPTZ,
+    
+    score DOUBLE PRECISION,
+    distance_km DOUBLE PRECISION,
+    harsh_events INTEGER DEFAULT 0,
+    harsh_per_100km DOUBLE PRECISION,
+    mean_speed DOUBLE PRECISION,
+    speed_variance DOUBLE PRECISION,
+    over_limit_fraction DOUBLE PRECISION,
+    riding_time_s DOUBLE PRECISION,
+    
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE (rider_id, period, period_key)
+);
+
+CREATE INDEX idx_rider_scores_rider_updated ON rider_scores(rider_id, updated_at DESC);
+
+
+-- =============================================
+-- 4c. Track Laps (test-track lap timer)
+-- =============================================
+CREATE TABLE IF NOT EXISTS laps (
+    id BIGSERIAL PRIMARY KEY,
+    session_id UUID NOT NULL,
+    rider_id VARCHAR(50) NOT NULL DEFAULT 'default',
+    lap_number INTEGER NOT NULL,
+    lap_time_s DOUBLE PRECISION,
+    sector_splits JSONB, -- seconds per sector, last entry ends at start/finish
+    max_speed DOUBLE PRECISION,
+    avg_speed DOUBLE PRECISION,
+    started_at TIMESTAMPTZ,
+    completed_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX idx_laps_session ON laps(session_id, lap_number);
+
+
+-- =============================================
+-- 4d. Alert Deliveries (Telegram delivery ledger)
+-- =============================================
+-- One row per (event, chat), batch-upserted by the backend every few seconds
+CREATE TABLE IF NOT EXISTS alert_deliveries (
+    id BIGSERIAL PRIMARY KEY,
+    event_id BIGINT NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    telegram_chat_id BIGINT NOT NULL,
+    status VARCHAR(10) NOT NULL, -- 'sent', 'failed'
+    http_status INTEGER,
+    latency_ms INTEGER,
+    attempts INTEGER,
+    sent_at TIMESTAMPTZ,
+    UNIQUE (event_id, telegram_chat_id)
+);
+
+CREATE INDEX idx_alert_deliveries_event ON alert_deliveries(event_id);
 
 
 -- =============================================
@@ -167,6 +294,46 @@ CREATE TABLE IF NOT EXISTS telegram_pins (
 CREATE INDEX idx_telegram_pins_code ON telegram_pins(pin_code);
 CREATE INDEX idx_telegram_pins_expiry ON telegram_pins(expires_at);
 
+-- Consume a valid PIN and link its chat in one transaction (used by the
+-- backend's verify-pin endpoint). Returns the linked chat id, or NULL
+CREATE OR REPLACE FUNCTION link_telegram_pin(p_pin VARCHAR)
+RETURNS BIGINT AS $$
+DECLARE
+    v_chat_id BIGINT;
+BEGIN
+    UPDATE telegram_pins
+    SET is_used = TRUE, used_at = NOW()
+    WHERE pin_code = p_pin AND is_used = FALSE AND expires_at > NOW()
+    RETURNING telegram_chat_id INTO v_chat_id;
+    
+    IF v_chat_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+    
+    UPDATE telegram_users
+    SET is_linked = TRUE, linked_at = NOW()
+    WHERE telegram_chat_id = v_chat_id;
+    
+    RETURN v_chat_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =============================================
+-- 6b. Telegram Live Tracking Messages (/track)
+-- =============================================
+-- One live message per chat, edited in place by the backend while it is active
+CREATE TABLE IF NOT EXISTS telegram_trackers (
+    id BIGSERIAL PRIMARY KEY,
+    telegram_chat_id BIGINT UNIQUE NOT NULL,
+    message_id BIGINT NOT NULL,
+    rider_id VARCHAR(50) NOT NULL DEFAULT 'default',
+    active BOOLEAN DEFAULT TRUE,
+    started_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX idx_telegram_trackers_active ON telegram_trackers(active, rider_id);
+
 
 -- =============================================
 -- 7. System Settings
@@ -246,6 +413,36 @@ ORDER BY timestamp DESC
 LIMIT 50;
 
 
+-- =============================================
+-- 8b. Migrations for existing databases
+-- =============================================
+-- Databases created before rider_id existed: run these statements on their own
+ALTER TABLE esp32_leg_data ADD COLUMN IF NOT EXISTS rider_id VARCHAR(50) DEFAULT 'default';
+ALTER TABLE esp32_chest_data ADD COLUMN IF NOT EXISTS rider_id VARCHAR(50) DEFAULT 'default';
+ALTER TABLE events ADD COLUMN IF NOT EXISTS rider_id VARCHAR(50) DEFAULT 'default';
+
+-- Databases created before on-device window features
+ALTER TABLE esp32_leg_data ADD COLUMN IF NOT EXISTS features JSONB;
+ALTER TABLE esp32_chest_data ADD COLUMN IF NOT EXISTS features JSONB;
+
+-- Databases created before GPS fix age was reported
+ALTER TABLE esp32_chest_data ADD COLUMN IF NOT EXISTS fix_age_ms INTEGER;
+
+-- Databases created before device-clock timestamps
+ALTER TABLE esp32_leg_data ADD COLUMN IF NOT EXISTS clock_error_ms INTEGER;
+ALTER TABLE esp32_chest_data ADD COLUMN IF NOT EXISTS clock_error_ms INTEGER;
+
+-- Databases with events from before the counters existed: backfill once
+-- INSERT INTO event_counters (rider_id, event_type, bucket_start, count)
+--     SELECT COALESCE(rider_id, 'default'), event_type, date_trunc('hour', timestamp), COUNT(*)
+--     FROM events GROUP BY 1, 2, 3
+--     ON CONFLICT DO NOTHING;
+-- INSERT INTO event_totals (rider_id, event_type, count)
+--     SELECT COALESCE(rider_id, 'default'), event_type, COUNT(*)
+--     FROM events GROUP BY 1, 2
+--     ON CONFLICT DO NOTHING;
+
+
 -- =============================================
 -- 9. Row Level Security (Optional)
 -- =============================================
@@ -264,6 +461,7 @@ BEGIN
     DELETE FROM esp32_leg_data WHERE created_at < NOW() - INTERVAL '7 days';
     DELETE FROM esp32_chest_data WHERE created_at < NOW() - INTERVAL '7 days';
     DELETE FROM telegram_pins WHERE expires_at < NOW();
+    DELETE FROM event_counters WHERE bucket_start < NOW() - INTERVAL '7 days';
 END;
 $$ LANGUAGE plpgsql;
 
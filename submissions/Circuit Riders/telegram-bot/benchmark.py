@@ -0,0 +1,274 @@
+"""
+Handler throughput benchmark for tele-bot.py
+Drives /register, /status, /notifications and /unlink concurrently with
+synthetic Updates, a stub reply sink and an in-memory Supabase stand-in
+with injectable latency - no Telegram or Supabase needed
+
+Usage:
+    python benchmark.py --users 500 --rate 200 --duration 10 --latency-ms 40
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import supabase
+
+COMMANDS = ("register", "status", "notifications", "unlink")
+
+
+# =============================================
+# IN-MEMORY STORAGE
+# =============================================
+
+class MemoryQuery:
+    """The subset of the PostgREST query builder the bot uses"""
+
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self.op = 'select'
+        self.payload = None
+        self.filters = []
+        self.row_limit = None
+
+    def select(self, *columns, count=None):
+        self.op = 'select'
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, on_conflict=None):
+        self.op, self.payload = 'upsert', payload
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = 'update', payload
+        return self
+
+    def delete(self):
+        self.op = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) > str(value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) < str(value))
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def execute(self):
+        # Blocking, like the real synchronous client
+        time.sleep(self.store.latency())
+        with self.store.lock:
+            self.store.calls += 1
+            rows = self.store.tables.setdefault(self.table, [])
+
+            if self.op in ('insert', 'upsert'):
+                row = dict(self.payload, id=next(self.store.ids))
+                rows.append(row)
+                return SimpleNamespace(data=[row])
+
+            selected = [row for row in rows if all(f(row) for f in self.filters)]
+            if self.op == 'update':
+                for row in selected:
+                    row.update(self.payload)
+            elif self.op == 'delete':
+                for row in selected:
+                    rows.remove(row)
+            return SimpleNamespace(data=[dict(row) for row in selected[:self.row_limit]])
+
+
+class MemoryStore:
+    def __init__(self, latency_ms, jitter_ms):
+        self.tables = {
+            "esp32_chest_data": [{
+                "timestamp": datetime.now().isoformat(), "latitude": 12.9716, "longitude": 77.5946,
+                "speed": 32.5, "satellites": 9, "accuracy": 3.1
+            }],
+            "esp32_leg_data": [{"timestamp": datetime.now().isoformat()}],
+            "event_totals": [{"rider_id": "default", "event_type": "HARSH_BRAKE", "count": 42}],
+            "event_counters": [{"rider_id": "default", "event_type": "HARSH_BRAKE", "count": 3, "bucket_start": "2999-01-01"}],
+        }
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.calls = 0
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def latency(self):
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+
+    def table(self, name):
+        return MemoryQuery(self, name)
+
+    def link_all(self):
+        """Stand-in for the dashboard verify-pin step"""
+        with self.lock:
+            for user in self.tables.get("telegram_users", []):
+                user.update(is_linked=True, notifications_enabled=True)
+
+
+# =============================================
+# SYNTHETIC UPDATES
+# =============================================
+
+class ReplySink:
+    """Collects bot replies instead of sending them"""
+
+    def __init__(self):
+        self.count = 0
+        self.message_ids = itertools.count(1)
+
+    async def reply(self, text, **kwargs):
+        self.count += 1
+        return SimpleNamespace(message_id=next(self.message_ids), text=text)
+
+
+def make_update(chat_id, sink):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(username=f"user{chat_id}", first_name="Bench", last_name=str(chat_id)),
+        message=SimpleNamespace(reply_text=sink.reply)
+    )
+
+
+def load_bot(store, storage_workers):
+    """Import tele-bot.py with the in-memory store in place of Supabase"""
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "benchmark")
+    os.environ["STORAGE_MAX_WORKERS"] = str(storage_workers)
+    supabase.create_client = lambda *args, **kwargs: store
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tele-bot.py")
+    spec = importlib.util.spec_from_file_location("tele_bot", path)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    logging.getLogger().setLevel(logging.WARNING)  # keep per-command INFO logs out of the report
+    return bot
+
+
+# =============================================
+# BENCHMARK
+# =============================================
+
+async def measure_loop_lag(samples, stop, interval=0.01):
+    """Event-loop lag = how late a short sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+async def run_benchmark(args):
+    store = MemoryStore(args.latency_ms, args.jitter_ms)
+    bot = load_bot(store, args.storage_workers)
+    sink = ReplySink()
+    handlers = {
+        "register": bot.register,
+        "status": bot.status,
+        "notifications": bot.toggle_notifications,
+        "unlink": bot.unlink,
+    }
+    weights = [float(weight) for weight in args.mix.split(",")]
+    chat_ids = list(range(1, args.users + 1))
+
+    # Register everyone once and link them, so /status and friends do real work
+    await asyncio.gather(*(bot.register(make_update(chat_id, sink), None) for chat_id in chat_ids))
+    store.link_all()
+    bot.register_attempts.clear()
+
+    latencies = {command: [] for command in COMMANDS}
+    lag = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_loop_lag(lag, stop))
+
+    async def timed(command, chat_id):
+        started = time.perf_counter()
+        await handlers[command](make_update(chat_id, sink), None)
+        latencies[command].append(time.perf_counter() - started)
+
+    tasks = []
+    interval = 1.0 / args.rate
+    deadline = time.perf_counter() + args.duration
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        command = random.choices(COMMANDS, weights=weights)[0]
+        tasks.append(asyncio.create_task(timed(command, random.choice(chat_ids))))
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    await asyncio.gather(*tasks)
+    stop.set()
+    await monitor
+    bot.storage_executor.shutdown(wait=False)
+
+    report(args, latencies, lag, store, sink, bot.session_cache)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def report(args, latencies, lag, store, sink, session_cache):
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{total} commands in {args.duration}s (target {args.rate}/s), "
+          f"{args.users} users, storage latency {args.latency_ms}±{args.jitter_ms} ms, "
+          f"{args.storage_workers} storage workers\n")
+    print(f"{'command':<15}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for command, values in latencies.items():
+        print(f"{command:<15}{len(values):>7}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}{max(values, default=0) * 1000:>10.1f}")
+    print(f"\nevent-loop lag: mean {statistics.mean(lag) * 1000 if lag else 0:.2f} ms, "
+          f"p99 {percentile(lag, 99) * 1000:.2f} ms, max {max(lag, default=0) * 1000:.2f} ms")
+    print(f"storage calls: {store.calls}, replies: {sink.count}, "
+          f"session cache hit rate: {session_cache.hit_rate:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="distinct chats")
+    parser.add_argument("--rate", type=float, default=100, help="commands started per second")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of load")
+    parser.add_argument("--latency-ms", type=float, default=30, help="mean storage call latency")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="storage latency standard deviation")
+    parser.add_argument("--storage-workers", type=int, default=8, help="bot storage thread pool size")
+    parser.add_argument("--mix", default="1,6,2,1",
+                        help="relative weights for register,status,notifications,unlink")
+    args = parser.parse_args()
+
+    if len(args.mix.split(",")) != len(COMMANDS):
+        sys.exit(f"--mix needs {len(COMMANDS)} weights")
+
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,11 +11,15 @@ from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 from os import getenv
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 import random
 import string
+import time
 
 # Load environment variables
 load_dotenv()
@@ -31,27 +35,220 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = getenv("TELEGRAM_BOT_TOKEN")
 SUPABASE_URL = getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = getenv("SUPABASE_SERVICE_ROLE_KEY")
+RIDER_ID = getenv("RIDER_ID", "default")  # rider followed by /track
+
+# Storage fan-out (independent Supabase calls run in parallel)
+STORAGE_MAX_WORKERS = int(getenv("STORAGE_MAX_WORKERS", 8))
+STORAGE_CALL_TIMEOUT = float(getenv("STORAGE_CALL_TIMEOUT", 5.0))  # seconds
+
+# Initialize Supabase - HTTP timeout matches the fan-out timeout so a timed-out
+# call frees its worker
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_SERVICE_KEY,
+    options=ClientOptions(postgrest_client_timeout=STORAGE_CALL_TIMEOUT)
+)
+
+# The Supabase client is synchronous - every call runs on this bounded pool so
+# a DB round trip never blocks the event loop for other chats
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+
+CONCURRENT_UPDATES = int(getenv("BOT_CONCURRENT_UPDATES", 256))  # updates handled at once
+
+# PIN linking - issued PINs are kept in memory (written through to telegram_pins)
+# so a repeated /register reuses the live PIN instead of writing a new row
+PIN_TTL = timedelta(minutes=10)
+PIN_SWEEP_INTERVAL = int(getenv("PIN_SWEEP_INTERVAL", 60))  # seconds between expiry sweeps
+REGISTER_ATTEMPTS_PER_WINDOW = int(getenv("REGISTER_ATTEMPTS_PER_WINDOW", 3))
+REGISTER_ATTEMPT_WINDOW = 600  # seconds
+issued_pins = {}  # chat_id -> (pin, expires_at)
+register_attempts = defaultdict(deque)  # chat_id -> monotonic times of recent /register calls
+
+# Linked-user sessions - most commands start with the linked check
+SESSION_CACHE_SIZE = int(getenv("SESSION_CACHE_SIZE", 1024))
+SESSION_CACHE_TTL = float(getenv("SESSION_CACHE_TTL", 300))  # seconds
+SESSION_STATS_INTERVAL = 300  # seconds between hit-rate log lines
+
+
+class SessionCache:
+    """
+    LRU cache of chat_id -> session ({registered, linked, notifications_enabled, rider_id})
+    Entries expire after the TTL; hits and misses are counted to track the hit rate
+    """
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # chat_id -> (session, stored_at)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, chat_id):
+        entry = self.entries.get(chat_id)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self.entries.pop(chat_id, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(chat_id)
+        self.hits += 1
+        return entry[0]
+    
+    def put(self, chat_id, session):
+        self.entries[chat_id] = (session, time.monotonic())
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def invalidate(self, chat_id):
+        self.entries.pop(chat_id, None)
+    
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
 
-# Initialize Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
 
 
 # =============================================
 # HELPER FUNCTIONS
 # =============================================
 
+async def run_concurrently(*calls, timeout=STORAGE_CALL_TIMEOUT):
+    """
+    Run independent storage calls in parallel on the shared executor
+    Returns results in call order - a call that fails or exceeds the
+    timeout yields None, so latency is the slowest call, not the sum
+    """
+    loop = asyncio.get_running_loop()
+    
+    async def guarded(call):
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(storage_executor, call), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Storage call timed out after {timeout}s")
+        except Exception as e:
+            logger.error(f"Storage call failed: {e}")
+        return None
+    
+    return await asyncio.gather(*(guarded(call) for call in calls))
+
+
+async def run_storage(call, timeout=STORAGE_CALL_TIMEOUT):
+    """
+    Run one storage call off the event loop
+    Unlike run_concurrently, failures and timeouts are raised to the handler
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(storage_executor, call), timeout)
+
+
+async def get_session(chat_id):
+    """
+    Session for a chat - a cache hit needs no DB call
+    Only linked sessions are cached: linking happens in the backend, so an
+    unlinked chat is re-read until it shows up as linked
+    """
+    session = session_cache.get(chat_id)
+    if session is not None:
+        return session
+    
+    result = await run_storage(
+        lambda: supabase.table("telegram_users")
+            .select("is_linked, notifications_enabled")
+            .eq("telegram_chat_id", chat_id)
+            .execute()
+    )
+    row = result.data[0] if result.data else {}
+    session = {
+        "registered": bool(result.data),
+        "linked": bool(row.get('is_linked')),
+        "notifications_enabled": bool(row.get('notifications_enabled')),
+        "rider_id": RIDER_ID
+    }
+    if session["linked"]:
+        session_cache.put(chat_id, session)
+    return session
+
+
+async def log_session_cache_stats(context=None):
+    """Periodic job - log the session cache hit rate"""
+    logger.info(f"Session cache: {session_cache.hits} hits, {session_cache.misses} misses, "
+                f"hit rate {session_cache.hit_rate:.1%}, {len(session_cache.entries)} entries")
+
+
+def sum_counts_by_type(rows):
+    """Add up counter rows (one per rider/type/bucket) into {event_type: count}"""
+    counts = {}
+    for row in rows or []:
+        counts[row['event_type']] = counts.get(row['event_type'], 0) + row['count']
+    return counts
+
+
 def generate_pin():
     """Generate 6-digit PIN code"""
     return ''.join(random.choices(string.digits, k=6))
 
 
-async def cleanup_expired_pins():
-    """Remove expired PINs from database"""
+def is_rate_limited(attempts, limit, window):
+    """Sliding-window rate limit - records the attempt when it is allowed"""
+    now = time.monotonic()
+    while attempts and now - attempts[0] > window:
+        attempts.popleft()
+    if len(attempts) >= limit:
+        return True
+    attempts.append(now)
+    return False
+
+
+async def issue_pin(chat_id):
+    """
+    Return the chat's live PIN, or create one (write-through to telegram_pins)
+    Returns (pin, expires_at)
+    """
+    live = issued_pins.get(chat_id)
+    if live and live[1] > datetime.now():
+        return live
+    
+    for _ in range(3):
+        pin = generate_pin()
+        expires_at = datetime.now() + PIN_TTL
+        pin_data = {
+            "pin_code": pin,
+            "telegram_chat_id": chat_id,
+            "expires_at": expires_at.isoformat()
+        }
+        try:
+            await run_storage(lambda: supabase.table("telegram_pins").insert(pin_data).execute())
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            # pin_code is UNIQUE - a clash with another live PIN, try a new one
+            logger.warning(f"PIN insert failed, retrying: {e}")
+            continue
+        issued_pins[chat_id] = (pin, expires_at)
+        return pin, expires_at
+    
+    raise RuntimeError("Could not issue a unique PIN")
+
+
+async def cleanup_expired_pins(context=None):
+    """Periodic job - drop expired PINs from memory and the database"""
+    now = datetime.now()
+    for chat_id in [chat_id for chat_id, (_, expires_at) in issued_pins.items() if expires_at <= now]:
+        del issued_pins[chat_id]
+    for chat_id in [chat_id for chat_id, attempts in register_attempts.items()
+                    if not attempts or time.monotonic() - attempts[-1] > REGISTER_ATTEMPT_WINDOW]:
+        del register_attempts[chat_id]
+    
     try:
-        supabase.table("telegram_pins")\
-            .delete()\
-            .lt("expires_at", datetime.now().isoformat())\
-            .execute()
+        await run_storage(
+            lambda: supabase.table("telegram_pins")
+                .delete()
+                .lt("expires_at", now.isoformat())
+                .execute()
+        )
     except Exception as e:
         logger.error(f"Error cleaning up PINs: {e}")
 
@@ -74,6 +271,7 @@ This bot sends you real-time alerts about:
 *Available Commands:*
 /register - Link your account
 /status - Check system status
+/track - Follow the ride live
 /unlink - Unlink your account
 /help - Show this message
 
@@ -92,33 +290,24 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         user = update.effective_user
         
+        if is_rate_limited(register_attempts[chat_id], REGISTER_ATTEMPTS_PER_WINDOW, REGISTER_ATTEMPT_WINDOW):
+            await update.message.reply_text(
+                "⏳ Too many registration requests. Please wait a few minutes."
+            )
+            return
+        
         # Check if already linked
-        existing_user = supabase.table("telegram_users")\
-            .select("*")\
-            .eq("telegram_chat_id", chat_id)\
-            .execute()
+        session = await get_session(chat_id)
         
-        if existing_user.data and existing_user.data[0].get('is_linked'):
+        if session["linked"]:
             await update.message.reply_text(
                 "✅ You are already registered!\n\n"
                 "Use /unlink if you want to unregister."
             )
             return
         
-        # Clean up old expired PINs
-        await cleanup_expired_pins()
-        
-        # Generate new PIN
-        pin = generate_pin()
-        expires_at = datetime.now() + timedelta(minutes=10)
-        
-        # Store PIN in database
-        pin_data = {
-            "pin_code": pin,
-            "telegram_chat_id": chat_id,
-            "expires_at": expires_at.isoformat()
-        }
-        supabase.table("telegram_pins").insert(pin_data).execute()
+        # Reuse the live PIN or store a new one (expired PINs are swept by a job)
+        pin, expires_at = await issue_pin(chat_id)
         
         # Create or update user record
         user_data = {
@@ -128,20 +317,22 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "last_name": user.last_name
         }
         
-        if existing_user.data:
-            supabase.table("telegram_users")\
-                .update(user_data)\
-                .eq("telegram_chat_id", chat_id)\
-                .execute()
+        if session["registered"]:
+            await run_storage(
+                lambda: supabase.table("telegram_users")
+                    .update(user_data)
+                    .eq("telegram_chat_id", chat_id)
+                    .execute()
+            )
         else:
-            supabase.table("telegram_users").insert(user_data).execute()
+            await run_storage(lambda: supabase.table("telegram_users").insert(user_data).execute())
         
         message = f"""
 🔐 *Registration PIN Generated*
 
 Your PIN code is: `{pin}`
 
-⏰ Valid for: 10 minutes
+⏰ Valid for: {PIN_TTL.seconds // 60} minutes
 📱 Enter this PIN in the dashboard to link your account
 
 The PIN will expire at: {expires_at.strftime('%H:%M:%S')}
@@ -163,40 +354,45 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         
         # Check if user is linked
-        user_result = supabase.table("telegram_users")\
-            .select("*")\
-            .eq("telegram_chat_id", chat_id)\
-            .execute()
+        session = await get_session(chat_id)
         
-        if not user_result.data or not user_result.data[0].get('is_linked'):
+        if not session["linked"]:
             await update.message.reply_text(
                 "⚠️ You are not registered yet!\n\n"
                 "Use /register to get started."
             )
             return
         
-        # Get latest sensor data
-        chest_data = supabase.table("esp32_chest_data")\
-            .select("*")\
-            .order("timestamp", desc=True)\
-            .limit(1)\
-            .execute()
-        
-        leg_data = supabase.table("esp32_leg_data")\
-            .select("*")\
-            .order("timestamp", desc=True)\
-            .limit(1)\
-            .execute()
-        
-        # Get recent events count
-        events = supabase.table("events")\
-            .select("event_type", count="exact")\
-            .execute()
+        # Latest sensor data and event counters are independent - fetch in parallel.
+        # Counters are kept per rider/type/hour by a DB trigger, so this reads a
+        # bounded number of the linked rider's rows however many events exist
+        since = (datetime.now() - timedelta(hours=24)).isoformat()
+        chest_data, leg_data, totals, recent = await run_concurrently(
+            lambda: supabase.table("esp32_chest_data")
+                .select("*")
+                .order("timestamp", desc=True)
+                .limit(1)
+                .execute(),
+            lambda: supabase.table("esp32_leg_data")
+                .select("*")
+                .order("timestamp", desc=True)
+                .limit(1)
+                .execute(),
+            lambda: supabase.table("event_totals")
+                .select("event_type, count")
+                .eq("rider_id", session["rider_id"])
+                .execute(),
+            lambda: supabase.table("event_counters")
+                .select("event_type, count")
+                .eq("rider_id", session["rider_id"])
+                .gt("bucket_start", since)
+                .execute()
+        )
         
         # Build status message
         status_msg = "📊 *System Status*\n\n"
         
-        if chest_data.data:
+        if chest_data and chest_data.data:
             chest = chest_data.data[0]
             status_msg += f"📍 GPS: {chest.get('latitude', 'N/A')}, {chest.get('longitude', 'N/A')}\n"
             status_msg += f"🏍️ Speed: {chest.get('speed', 0):.1f} km/h\n"
@@ -209,8 +405,17 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             status_msg += "⚠️ No GPS data available\n"
         
-        status_msg += f"\n📊 Total events: {len(events.data) if events.data else 0}\n"
-        status_msg += f"🔔 Notifications: {'ON' if user_result.data[0].get('notifications_enabled') else 'OFF'}\n"
+        total_events = sum(row['count'] for row in totals.data) if totals and totals.data else 0
+        status_msg += f"\n📊 Total events: {total_events}\n"
+        
+        recent_by_type = sum_counts_by_type(recent.data if recent else None)
+        if recent_by_type:
+            status_msg += "🕒 Last 24 h:\n"
+            for event_type, count in sorted(recent_by_type.items(), key=lambda item: -item[1]):
+                status_msg += f"  • {event_type.replace('_', ' ').title()}: {count}\n"
+        else:
+            status_msg += "🕒 Last 24 h: no events\n"
+        status_msg += f"🔔 Notifications: {'ON' if session['notifications_enabled'] else 'OFF'}\n"
         
         await update.message.reply_text(status_msg, parse_mode='Markdown')
         
@@ -226,10 +431,16 @@ async def unlink(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
         
-        result = supabase.table("telegram_users")\
-            .update({"is_linked": False, "notifications_enabled": False})\
-            .eq("telegram_chat_id", chat_id)\
-            .execute()
+        result = await run_storage(
+            lambda: supabase.table("telegram_users")
+                .update({"is_linked": False, "notifications_enabled": False})
+                .eq("telegram_chat_id", chat_id)
+                .execute()
+        )
+        
+        # A PIN issued before unlinking may already be used - issue a fresh one next time
+        issued_pins.pop(chat_id, None)
+        session_cache.invalidate(chat_id)
         
         if result.data:
             await update.message.reply_text(
@@ -255,26 +466,24 @@ async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYP
         chat_id = update.effective_chat.id
         
         # Get current status
-        user_result = supabase.table("telegram_users")\
-            .select("notifications_enabled")\
-            .eq("telegram_chat_id", chat_id)\
-            .eq("is_linked", True)\
-            .execute()
+        session = await get_session(chat_id)
         
-        if not user_result.data:
+        if not session["linked"]:
             await update.message.reply_text(
                 "⚠️ You are not registered. Use /register first."
             )
             return
         
         # Toggle status
-        current_status = user_result.data[0].get('notifications_enabled', True)
-        new_status = not current_status
+        new_status = not session["notifications_enabled"]
         
-        supabase.table("telegram_users")\
-            .update({"notifications_enabled": new_status})\
-            .eq("telegram_chat_id", chat_id)\
-            .execute()
+        await run_storage(
+            lambda: supabase.table("telegram_users")
+                .update({"notifications_enabled": new_status})
+                .eq("telegram_chat_id", chat_id)
+                .execute()
+        )
+        session_cache.put(chat_id, dict(session, notifications_enabled=new_status))
         
         status_text = "enabled ✅" if new_status else "disabled ❌"
         await update.message.reply_text(
@@ -288,6 +497,66 @@ async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+async def track(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /track command - Post a live ride message the backend keeps editing"""
+    try:
+        chat_id = update.effective_chat.id
+        
+        session = await get_session(chat_id)
+        
+        if not session["linked"]:
+            await update.message.reply_text(
+                "⚠️ You are not registered. Use /register first."
+            )
+            return
+        
+        # The backend edits this message in place (throttled, one render per rider)
+        live_message = await update.message.reply_text(
+            "📡 *Live tracking*\n\nWaiting for ride data...\n\nUse /untrack to stop.",
+            parse_mode='Markdown'
+        )
+        
+        # One tracker per chat - a new /track replaces the previous message
+        await run_storage(
+            lambda: supabase.table("telegram_trackers")
+                .upsert({
+                    "telegram_chat_id": chat_id,
+                    "message_id": live_message.message_id,
+                    "rider_id": session["rider_id"],
+                    "active": True,
+                    "started_at": datetime.now().isoformat()
+                }, on_conflict="telegram_chat_id")
+                .execute()
+        )
+        
+    except Exception as e:
+        logger.error(f"Error in track command: {e}")
+        await update.message.reply_text(
+            "❌ Error starting live tracking. Please try again."
+        )
+
+
+async def untrack(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /untrack command - Stop editing the live ride message"""
+    try:
+        chat_id = update.effective_chat.id
+        
+        await run_storage(
+            lambda: supabase.table("telegram_trackers")
+                .update({"active": False})
+                .eq("telegram_chat_id", chat_id)
+                .execute()
+        )
+        
+        await update.message.reply_text("📴 Live tracking stopped.")
+        
+    except Exception as e:
+        logger.error(f"Error in untrack command: {e}")
+        await update.message.reply_text(
+            "❌ Error stopping live tracking. Please try again."
+        )
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
     help_text = """
@@ -298,6 +567,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Welcome message
 /register - Generate PIN to link your account
 /status - Check system status and latest data
+/track - Live ride updates in one message
+/untrack - Stop live ride updates
 /notifications - Toggle alerts on/off
 /unlink - Unlink your account
 /help - Show this help message
@@ -333,7 +604,12 @@ def main():
         return
     
     # Build application
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # Handlers await storage off the loop, so updates from different chats can
+    # be processed concurrently instead of one at a time
+    application = ApplicationBuilder()\
+        .token(BOT_TOKEN)\
+        .concurrent_updates(CONCURRENT_UPDATES)\
+        .build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -341,8 +617,18 @@ def main():
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("unlink", unlink))
     application.add_handler(CommandHandler("notifications", toggle_notifications))
+    application.add_handler(CommandHandler("track", track))
+    application.add_handler(CommandHandler("untrack", untrack))
     application.add_handler(CommandHandler("help", help_command))
     
+    # Expired PINs are swept on a schedule instead of inside /register
+    if application.job_queue:
+        application.job_queue.run_repeating(cleanup_expired_pins, interval=PIN_SWEEP_INTERVAL, first=PIN_SWEEP_INTERVAL)
+        application.job_queue.run_repeating(log_session_cache_stats, interval=SESSION_STATS_INTERVAL,
+                                            first=SESSION_STATS_INTERVAL)
+    else:
+        logger.warning("Job queue unavailable (install python-telegram-bot[job-queue]) - expired PINs are not swept")
+    
     # Start bot
     logger.info("🤖 Rider Telemetry Bot is starting...")
     application.run_polling()